@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        # Connect the version counters behind the dashboard fragment cache
+        from .dashboard_cache import connect_signals
+        connect_signals()
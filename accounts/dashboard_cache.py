@@ -0,0 +1,150 @@
+"""
+Version-keyed fragment caching for the role dashboards.
+
+Every model a dashboard shows has a version counter in DASHBOARD_CACHE,
+bumped whenever a row is saved or deleted (and again once the transaction
+commits, so a request that read the old rows mid-transaction cannot cache
+them under the new version). A fragment's cache key includes the current
+versions of the models it was declared with in FRAGMENTS, so a fragment
+stays cached until one of those models actually changes and is never
+served stale; no explicit invalidation is needed.
+
+Views hand the template lazy querysets and callables; on a cache hit the
+template never evaluates them, so a repeat dashboard load runs no
+dashboard queries at all. Hits and misses are counted per fragment in the
+same cache (see fragment_stats()).
+
+Writes that skip signals (bulk_create, queryset.update()) call
+bump_versions() for the models they touched. DASHBOARD_CACHE names a cache
+shared by all worker processes (the file-based 'shared' alias by default),
+so a bump in one is seen by all.
+"""
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+VERSION_KEY = 'dashboard:version:{}'
+FRAGMENT_KEY = 'dashboard:fragment:{}:{}:{}'
+STATS_KEY = 'dashboard:stats:{}:{}'
+
+# Fragment name: the models it shows
+FRAGMENTS = {
+    'admin-stats': ('students.Student', 'accounts.User', 'classes.ClassRoom', 'classes.Grade'),
+    'admin-teachers': ('accounts.User',),
+    'admin-recent-students': ('students.Student', 'accounts.User', 'classes.Grade', 'classes.ClassRoom'),
+    'teacher-welcome': ('classes.TeacherRoster', 'students.Student'),
+    'teacher-overview': ('classes.TeacherRoster', 'students.Student', 'classes.Grade', 'classes.ClassRoom'),
+    'teacher-students': (
+        'classes.TeacherRoster', 'classes.Teacher', 'students.Student', 'accounts.User', 'classes.Grade', 'classes.ClassRoom',
+    ),
+    'teacher-assignments': ('classes.Teacher', 'classes.Grade', 'classes.ClassRoom'),
+}
+# Models whose saves and deletes bump their version. TeacherRoster is bumped
+# by classes.roster.sync_roster, which writes it in bulk.
+TRACKED_MODELS = ('accounts.User', 'students.Student', 'classes.Grade', 'classes.ClassRoom', 'classes.Teacher')
+
+
+def dashboard_cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE', 'shared')]
+
+
+def _incr(cache, key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+
+
+# Versions
+
+def model_versions(labels):
+    """{label: version} for model labels such as 'students.Student'"""
+    cache = dashboard_cache()
+    keys = {VERSION_KEY.format(label): label for label in labels}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        # Start from the clock, not 1, so a counter the cache evicted can't
+        # come back at a version that still has fragments cached under it
+        start = time.time_ns() // 1000
+        cache.add(key, start, timeout=None)
+        found[key] = cache.get(key, start)
+    return {label: found[key] for key, label in keys.items()}
+
+
+def _bump(labels):
+    cache = dashboard_cache()
+    for label in labels:
+        try:
+            cache.incr(VERSION_KEY.format(label))
+        except ValueError:
+            # Not set yet: model_versions() will start it afresh
+            pass
+
+
+def bump_versions(*labels):
+    """Retire every cached fragment showing these models, now and again once the transaction commits"""
+    _bump(labels)
+    transaction.on_commit(lambda: _bump(labels))
+
+
+def _model_saved(sender, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which no dashboard shows
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_versions(sender._meta.label)
+
+
+def _model_deleted(sender, **kwargs):
+    bump_versions(sender._meta.label)
+
+
+def _assignments_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_versions('classes.Teacher')
+
+
+def connect_signals():
+    for label in TRACKED_MODELS:
+        model = apps.get_model(label)
+        post_save.connect(_model_saved, sender=model, dispatch_uid=f'dashboard_saved_{label}')
+        post_delete.connect(_model_deleted, sender=model, dispatch_uid=f'dashboard_deleted_{label}')
+    Teacher = apps.get_model('classes.Teacher')
+    for through in (Teacher.assigned_grades.through, Teacher.assigned_classes.through):
+        m2m_changed.connect(_assignments_changed, sender=through, dispatch_uid=f'dashboard_{through._meta.label}')
+
+
+# Fragments
+
+def cached_fragment(name, vary, render):
+    """
+    The fragment `name` for the `vary` values (e.g. the teacher), rendered
+    with render() on a miss
+    """
+    versions = model_versions(FRAGMENTS[name])
+    key = FRAGMENT_KEY.format(
+        name, '.'.join(str(value) for value in vary), '.'.join(str(versions[label]) for label in FRAGMENTS[name])
+    )
+    cache = dashboard_cache()
+    content = cache.get(key)
+    if content is not None:
+        _incr(cache, STATS_KEY.format(name, 'hits'))
+        return content
+    content = render()
+    cache.set(key, content, getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 3600))
+    _incr(cache, STATS_KEY.format(name, 'misses'))
+    return content
+
+
+def fragment_stats():
+    """{fragment name: {'hits': n, 'misses': n}} since the cache was last cleared"""
+    counts = dashboard_cache().get_many([STATS_KEY.format(name, kind) for name in FRAGMENTS for kind in ('hits', 'misses')])
+    return {
+        name: {kind: counts.get(STATS_KEY.format(name, kind), 0) for kind in ('hits', 'misses')}
+        for name in FRAGMENTS
+    }
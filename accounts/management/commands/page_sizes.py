@@ -0,0 +1,114 @@
+import gzip
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from accounts.models import User
+
+# URL name: the role that can view it (None for anonymous pages)
+PAGES = {
+    'landing': None,
+    'login': None,
+    'register': None,
+    'admin_dashboard': 'admin',
+    'admin_manage_students': 'admin',
+    'admin_fee_management': 'admin',
+    'fees:record_payment': 'admin',
+    'teacher_dashboard': 'teacher',
+    'student_dashboard': 'student',
+    'student_academics': 'student',
+    'student_homework': 'student',
+    'student_attendance': 'student',
+    'student_fees': 'student',
+    'student_communication': 'student',
+    'student_class_info': 'student',
+    'student_profile': 'student',
+}
+STYLESHEET = re.compile(r'<link rel="stylesheet" href="([^"]+)"')
+
+
+def gzipped_size(content):
+    return len(gzip.compress(content))
+
+
+def stylesheet_size(href):
+    """Gzipped bytes of a local stylesheet, or None for one served elsewhere"""
+    if not href.startswith(settings.STATIC_URL):
+        return None
+    name = href[len(settings.STATIC_URL):]
+    path = finders.find(name)
+    if path is None and staticfiles_storage.exists(name):
+        # A hashed name, only found among the collected files
+        path = staticfiles_storage.path(name)
+    if path is None:
+        return None
+    return gzipped_size(Path(path).read_bytes())
+
+
+class Command(BaseCommand):
+    help = 'Report the bytes each page sends on a first and a repeat visit, raw and gzipped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', action='append', choices=sorted(PAGES), help='URL name to measure; repeat for several (default: all)')
+        parser.add_argument('--admin', help='Email of the admin to view admin pages as (default: the first one)')
+        parser.add_argument('--teacher', help='Email of the teacher to view teacher pages as (default: the first one)')
+        parser.add_argument('--student', help='Email of the student to view student pages as (default: the first one)')
+
+    def viewer(self, role, email):
+        users = User.objects.filter(role=role, is_active=True)
+        if role == 'teacher':
+            users = users.filter(teacher__isnull=False)
+        elif role == 'student':
+            users = users.filter(student__isnull=False)
+        if email:
+            user = users.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'No active {role} with email {email}')
+            return user
+        return users.order_by('pk').first()
+
+    def handle(self, *args, **options):
+        pages = options['page'] or list(PAGES)
+        viewers = {role: self.viewer(role, options[role]) for role in ('admin', 'teacher', 'student')}
+
+        self.stdout.write(f"{'Page':<32}{'HTML':>9}{'gzipped':>9}{'CSS gz':>9}{'first':>9}{'repeat':>9}")
+        totals = [0, 0, 0, 0, 0]
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name in pages:
+                role = PAGES[name]
+                client = Client(raise_request_exception=False)
+                if role:
+                    if viewers[role] is None:
+                        self.stdout.write(self.style.WARNING(f'{name}: skipped, no {role} to view it as'))
+                        continue
+                    client.force_login(viewers[role])
+                url = reverse(name)
+                response = client.get(url)
+                if response.status_code != 200:
+                    self.stdout.write(self.style.WARNING(f'{name}: skipped, got HTTP {response.status_code}'))
+                    client.logout()
+                    continue
+
+                html = response.content
+                html_gz = gzipped_size(html)
+                hrefs = dict.fromkeys(STYLESHEET.findall(html.decode()))
+                css_gz = sum(size for size in map(stylesheet_size, hrefs) if size)
+                # A repeat visit finds the stylesheets cached and revalidates
+                # the page with its ETag; an unchanged page comes back empty
+                etag = response.get('ETag')
+                repeat = client.get(url, HTTP_IF_NONE_MATCH=etag) if etag else None
+                repeat_gz = 0 if repeat is not None and repeat.status_code == 304 else html_gz
+                client.logout()
+
+                row = [len(html), html_gz, css_gz, html_gz + css_gz, repeat_gz]
+                totals = [total + value for total, value in zip(totals, row)]
+                self.stdout.write(f'{name:<32}' + ''.join(f'{value:>9}' for value in row))
+
+        self.stdout.write(self.style.SUCCESS(f'{"Total":<32}' + ''.join(f'{value:>9}' for value in totals)))
@@ -0,0 +1,37 @@
+from django import template
+
+from accounts.dashboard_cache import FRAGMENTS, cached_fragment
+
+register = template.Library()
+
+
+class DashboardFragmentNode(template.Node):
+    def __init__(self, nodelist, name, vary):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary = vary
+
+    def render(self, context):
+        return cached_fragment(
+            self.name, [value.resolve(context) for value in self.vary], lambda: self.nodelist.render(context)
+        )
+
+
+@register.tag
+def dashboardfragment(parser, token):
+    """
+    {% dashboardfragment "name" [vary ...] %} ... {% enddashboardfragment %}
+
+    Caches the block until a model listed for `name` in
+    accounts.dashboard_cache.FRAGMENTS changes; `vary` values (such as the
+    teacher) get their own copy.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2 or bits[1][0] not in '"\'' or bits[1][-1] != bits[1][0]:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' needs a quoted fragment name")
+    name = bits[1][1:-1]
+    if name not in FRAGMENTS:
+        raise template.TemplateSyntaxError(f"Unknown dashboard fragment '{name}'")
+    nodelist = parser.parse(('enddashboardfragment',))
+    parser.delete_first_token()
+    return DashboardFragmentNode(nodelist, name, [parser.compile_filter(bit) for bit in bits[2:]])
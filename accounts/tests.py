@@ -1,3 +1,115 @@
-from django.test import TestCase
+from io import StringIO
 
-# Create your tests here.
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from classes.models import ClassRoom, Grade, Teacher
+from students.testing import make_student
+
+from .dashboard_cache import dashboard_cache, fragment_stats, model_versions
+from .models import User
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        dashboard_cache().clear()
+        self.grade = Grade.objects.create(name='Grade 3')
+        self.class_room = ClassRoom.objects.create(name='A', grade=self.grade)
+        make_student('tariro@school.com', self.grade, self.class_room)
+        self.admin = User.objects.create_user(username='admin@school.com', email='admin@school.com', password='x', role='admin')
+        teacher_user = User.objects.create_user(
+            username='teacher@school.com', email='teacher@school.com', password='x', role='teacher', first_name='Rudo'
+        )
+        self.teacher = Teacher.objects.create(user=teacher_user)
+        self.teacher.assigned_classes.add(self.class_room)
+
+    def test_repeat_admin_dashboard_runs_no_dashboard_queries(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin_dashboard')
+        self.assertContains(self.client.get(url), '<div class="stat-value">1</div>', html=True)
+
+        # Only the session and the logged-in user
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        self.assertEqual(fragment_stats()['admin-stats'], {'hits': 1, 'misses': 1})
+
+        make_student('farai@school.com', self.grade)
+        response = self.client.get(url)
+        self.assertContains(response, '<div class="stat-value">2</div>', html=True)
+        self.assertContains(response, 'farai@school.com')
+        self.assertEqual(fragment_stats()['admin-stats'], {'hits': 1, 'misses': 2})
+        # The teacher list shows users too, so it was re-rendered as well
+        self.assertEqual(fragment_stats()['admin-teachers'], {'hits': 1, 'misses': 2})
+
+    def test_versions_live_in_a_cache_all_processes_share(self):
+        self.assertNotIsInstance(dashboard_cache(), LocMemCache)
+
+    def test_logging_in_does_not_retire_fragments(self):
+        versions = model_versions(['accounts.User'])
+        self.client.login(username='admin@school.com', password='x')
+        self.assertEqual(model_versions(['accounts.User']), versions)
+
+    def test_teacher_dashboard_follows_assignments(self):
+        self.client.force_login(self.teacher.user)
+        url = reverse('teacher_dashboard')
+        self.assertContains(self.client.get(url), 'My Students (1)')
+        # Session, user and the teacher profile
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+        make_student('farai@school.com', self.grade)
+        self.assertContains(self.client.get(url), 'My Students (1)')
+        self.teacher.assigned_grades.add(self.grade)
+        self.assertContains(self.client.get(url), 'My Students (2)')
+
+    def test_stats_are_admin_only(self):
+        url = reverse('dashboard_cache_stats')
+        self.client.force_login(self.teacher.user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.admin)
+        self.client.get(reverse('admin_dashboard'))
+        stats = self.client.get(url).json()['fragments']
+        self.assertEqual(stats['admin-stats'], {'hits': 0, 'misses': 1})
+        self.assertEqual(stats['teacher-students'], {'hits': 0, 'misses': 0})
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PagePayloadTests(TestCase):
+    def setUp(self):
+        dashboard_cache().clear()
+        self.admin = User.objects.create_user(username='admin@school.com', email='admin@school.com', password='x', role='admin')
+
+    def test_pages_link_shared_stylesheets(self):
+        response = self.client.get(reverse('login'))
+        self.assertContains(response, '<link rel="stylesheet" href="/static/css/auth.css">')
+        self.assertContains(response, '<link rel="stylesheet" href="/static/css/pages/accounts-login.css">')
+        self.assertNotContains(response, '<style>')
+
+    def test_pages_are_compressed(self):
+        response = self.client.get(reverse('landing'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_unchanged_page_is_not_sent_again(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin_dashboard')
+        etag = self.client.get(url)['ETag']
+        repeat = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat.content, b'')
+
+        make_student('farai@school.com', Grade.objects.create(name='Grade 3'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_page_sizes_reports_each_page(self):
+        out = StringIO()
+        call_command('page_sizes', '--page', 'landing', '--page', 'admin_dashboard', stdout=out)
+        rows = {line.split()[0]: line.split()[1:] for line in out.getvalue().splitlines()[1:]}
+        self.assertEqual(set(rows), {'landing', 'admin_dashboard', 'Total'})
+        html, html_gz, css_gz, first, repeat = map(int, rows['admin_dashboard'])
+        self.assertLess(html_gz, html)
+        self.assertEqual(first, html_gz + css_gz)
+        self.assertEqual(repeat, 0)
@@ -2,11 +2,19 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.db import models
+from django.http import JsonResponse
+from django.utils.functional import SimpleLazyObject
+from .dashboard_cache import fragment_stats
 from .forms import StudentRegistrationForm
 from .models import User
 from students.models import Student
+from students.search import STUDENT_FILTERS, filter_students, student_ordering
 from classes.models import Grade, ClassRoom, Teacher
+from classes.roster import roster_students
+from fees.exchange import ExchangeRateError, convert, converted_totals, reporting_currency
+from fees.filters import filter_querystring
 from fees.models import FeeStructure, Payment
+from fees.pagination import KeysetPaginator
 
 def landing(request):
     return render(request, 'landing.html')
@@ -57,11 +65,12 @@ def admin_dashboard(request):
     if not request.user.is_authenticated or request.user.role != 'admin':
         return redirect('login')
 
-    # Get statistics
-    total_students = Student.objects.count()
-    total_teachers = User.objects.filter(role='teacher').count()
-    total_classes = ClassRoom.objects.count()
-    total_grades = Grade.objects.count()
+    # Counts are passed uncalled and querysets unevaluated: the template's
+    # cached fragments only run them on a miss (see accounts.dashboard_cache)
+    total_students = Student.objects.count
+    total_teachers = User.objects.filter(role='teacher').count
+    total_classes = ClassRoom.objects.count
+    total_grades = Grade.objects.count
 
     # Get recent data
     recent_students = Student.objects.select_related('user', 'grade', 'class_room').order_by('-user__date_joined')[:5]
@@ -82,6 +91,12 @@ def admin_dashboard(request):
     }
     return render(request, 'admin/dashboard.html', context)
 
+def dashboard_cache_stats(request):
+    """Hit and miss counts for each cached dashboard fragment"""
+    if not request.user.is_authenticated or request.user.role != 'admin':
+        return redirect('login')
+    return JsonResponse({'fragments': fragment_stats()})
+
 def teacher_dashboard(request):
     if not request.user.is_authenticated or request.user.role != 'teacher':
         return redirect('login')
@@ -89,17 +104,19 @@ def teacher_dashboard(request):
     # Get teacher's assignments
     try:
         teacher_profile = Teacher.objects.get(user=request.user)
-        assigned_classes = teacher_profile.assigned_classes.all()
+        assigned_classes = teacher_profile.assigned_classes.select_related('grade')
         assigned_grades = teacher_profile.assigned_grades.all()
 
-        # Get students in assigned classes or grades
-        students = Student.objects.filter(
-            models.Q(class_room__in=assigned_classes) | models.Q(grade__in=assigned_grades)
-        ).select_related('user', 'grade', 'class_room').distinct()
+        # Students in assigned classes or grades, from the precomputed roster;
+        # only loaded if a cached fragment misses
+        students = SimpleLazyObject(
+            lambda: list(roster_students(teacher_profile).select_related('user', 'grade', 'class_room'))
+        )
 
     except Teacher.DoesNotExist:
         # If no teacher profile, show no students
-        students = Student.objects.none()
+        teacher_profile = None
+        students = []
         assigned_classes = ClassRoom.objects.none()
         assigned_grades = Grade.objects.none()
 
@@ -109,7 +126,9 @@ def teacher_dashboard(request):
 
     context = {
         'teacher': request.user,
+        'teacher_profile': teacher_profile,
         'students': students,
+        'student_count': lambda: len(students),
         'grades': grades,
         'classes': classes,
         'assigned_classes': assigned_classes,
@@ -229,8 +248,24 @@ def admin_manage_students(request):
     if not request.user.is_authenticated or request.user.role != 'admin':
         return redirect('login')
 
-    students = Student.objects.all().select_related('user', 'grade', 'class_room')
-    return render(request, 'admin/manage_students.html', {'students': students})
+    students = filter_students(request.GET).select_related('user', 'grade', 'class_room')
+
+    # Keyset pagination on the chosen column, served by the search indexes
+    ordering, sort = student_ordering(request.GET)
+    paginator = KeysetPaginator(students, ordering, 50)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
+    context = {
+        'page_obj': page_obj,
+        'sort': sort,
+        'filters': {name: request.GET.get(name, '') for name in STUDENT_FILTERS},
+        'filter_query': filter_querystring(request.GET, STUDENT_FILTERS),
+        # Sort links keep the search and filters but start a new ordering
+        'sort_query': filter_querystring(request.GET, ('q', 'grade', 'class_room')),
+        'grades': Grade.objects.all(),
+        'class_rooms': ClassRoom.objects.select_related('grade').order_by('grade__name', 'name'),
+    }
+    return render(request, 'admin/manage_students.html', context)
 
 def admin_fee_management(request):
     if not request.user.is_authenticated or request.user.role != 'admin':
@@ -243,8 +278,13 @@ def admin_fee_management(request):
     recent_payments = Payment.objects.all().select_related('student__user', 'recorded_by').order_by('-payment_date')[:10]
 
     # Calculate totals
-    total_expected = sum(fs.total_fee for fs in fee_structures)
-    total_collected = Payment.objects.aggregate(total=models.Sum('amount'))['total'] or 0
+    try:
+        total_expected = sum(convert(fs.total_fee, fs.currency) for fs in fee_structures)
+        total_collected = converted_totals(Payment.objects.all())[0]
+    except ExchangeRateError as e:
+        messages.warning(request, f'Totals are shown at face value: {e}')
+        total_expected = sum(fs.total_fee for fs in fee_structures)
+        total_collected = Payment.objects.aggregate(total=models.Sum('amount'))['total'] or 0
     total_outstanding = total_expected - total_collected
 
     context = {
@@ -253,6 +293,7 @@ def admin_fee_management(request):
         'total_expected': total_expected,
         'total_collected': total_collected,
         'total_outstanding': total_outstanding,
+        'reporting_currency': reporting_currency(),
     }
     return render(request, 'admin/fee_management.html', context)
 
@@ -261,7 +302,7 @@ def admin_record_payment(request):
         return redirect('login')
 
     # Redirect to the new fee management system
-    return redirect('record_payment')
+    return redirect('fees:record_payment')
 
 def teacher_add_student(request):
     if not request.user.is_authenticated or request.user.role != 'teacher':
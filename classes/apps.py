@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ClassesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'classes'
+
+    def ready(self):
+        # Connect the signals that keep teacher rosters current
+        from . import roster  # noqa: F401
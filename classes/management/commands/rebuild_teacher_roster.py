@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from classes.models import Teacher
+from classes.roster import sync_roster
+
+
+class Command(BaseCommand):
+    help = 'Rebuild teacher rosters from class and grade assignments, e.g. after bulk student changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teacher', help='Email of one teacher to rebuild (default: all)')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
+
+    def handle(self, *args, **options):
+        teacher_ids = None
+        if options['teacher']:
+            try:
+                teacher_ids = [Teacher.objects.get(user__email=options['teacher']).id]
+            except Teacher.DoesNotExist:
+                raise CommandError(f"No teacher with email {options['teacher']}")
+
+        added, removed = sync_roster(teacher_ids=teacher_ids, dry_run=options['dry_run'])
+
+        if not added and not removed:
+            self.stdout.write(self.style.SUCCESS('Rosters are up to date.'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f'{added} roster entries missing and {removed} stale; rerun without --dry-run to repair.'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Added {added} and removed {removed} roster entries.'))
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_roster(apps, schema_editor):
+    Student = apps.get_model('students', 'Student')
+    TeacherRoster = apps.get_model('classes', 'TeacherRoster')
+    pairs = set(Student.objects.filter(class_room__teacher__isnull=False).values_list('class_room__teacher', 'id'))
+    pairs.update(Student.objects.filter(grade__teacher__isnull=False).values_list('grade__teacher', 'id'))
+    TeacherRoster.objects.bulk_create(
+        [TeacherRoster(teacher_id=teacher_id, student_id=student_id) for teacher_id, student_id in pairs],
+        batch_size=1000,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0003_student_guardian_phone'),
+        ('classes', '0002_teacher'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeacherRoster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='roster_entries', to='students.student')),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='roster', to='classes.teacher')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='teacherroster',
+            constraint=models.UniqueConstraint(fields=('teacher', 'student'), name='unique_teacher_roster_student'),
+        ),
+        migrations.RunPython(build_roster, migrations.RunPython.noop),
+    ]
@@ -20,3 +20,16 @@ class Teacher(models.Model):
 
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name}"
+
+class TeacherRoster(models.Model):
+    """One student a teacher teaches, through an assigned class or grade; kept by classes.roster"""
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name='roster')
+    student = models.ForeignKey('students.Student', on_delete=models.CASCADE, related_name='roster_entries')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['teacher', 'student'], name='unique_teacher_roster_student'),
+        ]
+
+    def __str__(self):
+        return f"{self.teacher} - {self.student}"
@@ -0,0 +1,95 @@
+"""
+Teacher rosters.
+
+A teacher teaches every student in their assigned classes and assigned
+grades. Working that out per request takes an OR across two many-to-many
+joins plus DISTINCT, which gets slower as the student table grows, so the
+answer is kept in TeacherRoster instead and the dashboard reads it with one
+indexed join.
+
+sync_roster() recomputes the roster for some teachers and/or students:
+two queries find the pairs there should be, one finds the pairs there are,
+and the difference is inserted and deleted in bulk (retiring the cached
+dashboard fragments that show rosters). Signals keep it current when
+assignments change (m2m_changed on either assignment field) and when a
+student is saved. Writes that skip signals (queryset.update(), bulk_create)
+should call sync_roster() for what they touched, or run the
+rebuild_teacher_roster command afterwards.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+
+from accounts.dashboard_cache import bump_versions
+from students.models import Student
+
+from .models import Teacher, TeacherRoster
+
+CHANGED_ACTIONS = ('post_add', 'post_remove', 'post_clear')
+
+
+def roster_pairs(teacher_ids=None, student_ids=None):
+    """The (teacher_id, student_id) pairs the assignments call for"""
+    students = Student.objects.all()
+    if student_ids is not None:
+        students = students.filter(id__in=student_ids)
+    by_class, by_grade = Q(class_room__teacher__isnull=False), Q(grade__teacher__isnull=False)
+    if teacher_ids is not None:
+        by_class, by_grade = Q(class_room__teacher__in=teacher_ids), Q(grade__teacher__in=teacher_ids)
+    pairs = set(students.filter(by_class).values_list('class_room__teacher', 'id'))
+    pairs.update(students.filter(by_grade).values_list('grade__teacher', 'id'))
+    return pairs
+
+
+def sync_roster(teacher_ids=None, student_ids=None, dry_run=False):
+    """
+    Bring the roster rows for these teachers and students (default: all) in
+    line with their assignments. Returns (added, removed) counts.
+    """
+    with transaction.atomic():
+        stored = TeacherRoster.objects.all()
+        if teacher_ids is not None:
+            stored = stored.filter(teacher_id__in=teacher_ids)
+        if student_ids is not None:
+            stored = stored.filter(student_id__in=student_ids)
+        existing = {pair[1:]: pair[0] for pair in stored.values_list('id', 'teacher_id', 'student_id')}
+        wanted = roster_pairs(teacher_ids, student_ids)
+        missing = wanted - set(existing)
+        stale = [entry_id for pair, entry_id in existing.items() if pair not in wanted]
+        if not dry_run:
+            TeacherRoster.objects.bulk_create(
+                [TeacherRoster(teacher_id=teacher_id, student_id=student_id) for teacher_id, student_id in missing],
+                batch_size=1000, ignore_conflicts=True,
+            )
+            TeacherRoster.objects.filter(id__in=stale).delete()
+            if missing or stale:
+                bump_versions('classes.TeacherRoster')
+    return len(missing), len(stale)
+
+
+def roster_students(teacher):
+    """The students on a teacher's roster"""
+    return Student.objects.filter(roster_entries__teacher=teacher)
+
+
+# Signals
+
+@receiver(m2m_changed, sender=Teacher.assigned_grades.through)
+@receiver(m2m_changed, sender=Teacher.assigned_classes.through)
+def _assignments_changed(sender, instance, action, **kwargs):
+    if action not in CHANGED_ACTIONS:
+        return
+    if isinstance(instance, Teacher):
+        sync_roster(teacher_ids=[instance.pk])
+    else:
+        # A grade or class gained or lost teachers: recheck its students
+        field = 'grade' if sender is Teacher.assigned_grades.through else 'class_room'
+        sync_roster(student_ids=Student.objects.filter(**{field: instance}).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Student)
+def _student_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not {'grade', 'grade_id', 'class_room', 'class_room_id'} & set(update_fields):
+        return
+    sync_roster(student_ids=[instance.pk])
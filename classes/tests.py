@@ -1,3 +1,74 @@
-from django.test import TestCase
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from students.models import Student
+from students.testing import make_student
+
+from .models import ClassRoom, Grade, Teacher, TeacherRoster
+from .roster import roster_students, sync_roster
+
+
+class TeacherRosterTests(TestCase):
+    def setUp(self):
+        self.grade3, self.grade4 = Grade.objects.create(name='Grade 3'), Grade.objects.create(name='Grade 4')
+        self.class_3a = ClassRoom.objects.create(name='A', grade=self.grade3)
+        self.class_4a = ClassRoom.objects.create(name='A', grade=self.grade4)
+        self.in_3a = make_student('in3a@school.com', self.grade3, self.class_3a)
+        self.in_3 = make_student('in3@school.com', self.grade3)
+        self.in_4a = make_student('in4a@school.com', self.grade4, self.class_4a)
+        user = User.objects.create_user(username='teacher@school.com', email='teacher@school.com', password='x', role='teacher')
+        self.teacher = Teacher.objects.create(user=user)
+
+    def roster(self):
+        return set(roster_students(self.teacher))
+
+    def test_assignments_keep_the_roster(self):
+        self.teacher.assigned_classes.add(self.class_3a)
+        self.assertEqual(self.roster(), {self.in_3a})
+        self.teacher.assigned_grades.add(self.grade3)
+        self.assertEqual(self.roster(), {self.in_3a, self.in_3})
+        self.assertEqual(TeacherRoster.objects.count(), 2)
+
+        # Still taught through the grade
+        self.teacher.assigned_classes.remove(self.class_3a)
+        self.assertEqual(self.roster(), {self.in_3a, self.in_3})
+
+        # From the grade's side
+        self.grade4.teacher_set.add(self.teacher)
+        self.assertEqual(self.roster(), {self.in_3a, self.in_3, self.in_4a})
+        self.grade3.teacher_set.clear()
+        self.assertEqual(self.roster(), {self.in_4a})
+        self.teacher.assigned_grades.clear()
+        self.assertEqual(self.roster(), set())
+
+    def test_student_moves_follow_the_roster(self):
+        self.teacher.assigned_classes.add(self.class_4a)
+        self.in_3a.grade, self.in_3a.class_room = self.grade4, self.class_4a
+        self.in_3a.save()
+        self.assertEqual(self.roster(), {self.in_3a, self.in_4a})
+        self.in_4a.class_room = None
+        self.in_4a.save(update_fields=['class_room'])
+        self.assertEqual(self.roster(), {self.in_3a})
+
+    def test_rebuild_repairs_bulk_changes(self):
+        self.teacher.assigned_grades.add(self.grade3)
+        Student.objects.filter(pk=self.in_4a.pk).update(grade=self.grade3)
+        self.assertEqual(sync_roster(dry_run=True), (1, 0))
+        out = StringIO()
+        call_command('rebuild_teacher_roster', stdout=out)
+        self.assertIn('Added 1 and removed 0', out.getvalue())
+        self.assertEqual(self.roster(), {self.in_3a, self.in_3, self.in_4a})
+        self.assertEqual(sync_roster(), (0, 0))
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_dashboard_reads_the_roster(self):
+        self.teacher.assigned_classes.add(self.class_3a, self.class_4a)
+        self.teacher.assigned_grades.add(self.grade3)
+        self.client.force_login(self.teacher.user)
+        response = self.client.get(reverse('teacher_dashboard'))
+        self.assertEqual(set(response.context['students']), {self.in_3a, self.in_3, self.in_4a})
+        self.assertContains(response, 'My Students (3)')
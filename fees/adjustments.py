@@ -0,0 +1,112 @@
+"""
+Late-payment penalties and early-payment credits.
+
+Each FeeStructure with a payment_deadline can charge late_payment_penalty
+percent of the outstanding balance on ledgers still owing after the
+deadline, and credit early_payment_discount percent of the term fee to
+ledgers settled before it. Every adjustment is a FeeAdjustment row, unique
+per ledger and kind, so a ledger is penalised or credited at most once and
+reruns of the nightly job are no-ops.
+
+Work is set-based per fee structure: one SELECT of the eligible ledgers with
+the amount computed in SQL, one bulk INSERT of the adjustments, and one
+UPDATE of the ledgers they belong to. The change in expected fees and fully
+paid ledgers is then added to the term summary with one more UPDATE.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from .models import FeeAdjustment, FeeStructure, StudentLedger
+from .summary import add_ledger_changes, day_bounds, record_term_deltas, term_deltas
+
+HUNDRED = Decimal('100')
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+INSERT_BATCH_SIZE = 5000
+
+
+def _percent_of(field, percentage, sign=1):
+    return Round(F(field) * Value(sign * percentage / HUNDRED), 2, output_field=MONEY)
+
+
+def _apply(structure, kind, eligible, amount, now, deltas):
+    """
+    Record `kind` for every eligible ledger without one and post it to the
+    ledger, adding the change to `deltas` (see summary.term_deltas())
+    """
+    already = FeeAdjustment.objects.filter(ledger=OuterRef('pk'), kind=kind)
+    rows = list(
+        eligible.filter(~Exists(already)).select_for_update(of=('self',))
+        .annotate(adjustment=amount).values_list('id', 'adjustment', 'total_required', 'outstanding_balance')
+    )
+    rows = [row for row in rows if row[1]]
+    if not rows:
+        return 0
+
+    percentage = structure.late_payment_penalty if kind == 'late_penalty' else structure.early_payment_discount
+    FeeAdjustment.objects.bulk_create(
+        [
+            FeeAdjustment(ledger_id=ledger_id, kind=kind, amount=adjustment, percentage=percentage, assessed_at=now)
+            for ledger_id, adjustment, _, _ in rows
+        ],
+        batch_size=INSERT_BATCH_SIZE,
+    )
+
+    # Only this structure's ledgers: every structure in a run shares `now`
+    posted = Subquery(
+        FeeAdjustment.objects.filter(ledger=OuterRef('pk'), kind=kind).values('amount')[:1], output_field=MONEY
+    )
+    ledger_ids = [ledger_id for ledger_id, _, _, _ in rows]
+    for start in range(0, len(ledger_ids), INSERT_BATCH_SIZE):
+        StudentLedger.objects.filter(id__in=ledger_ids[start:start + INSERT_BATCH_SIZE]).update(
+            adjustments=F('adjustments') + posted,
+            total_required=F('total_required') + posted,
+            outstanding_balance=F('outstanding_balance') + posted,
+            updated_at=now,
+        )
+    # These are the grade's day-scholar fees, so the ledgers are kept in their currency
+    term = (structure.academic_year_id, structure.term_id, structure.currency)
+    add_ledger_changes(deltas, (
+        ((*term, required, balance), (*term, required + adjustment, balance + adjustment))
+        for _, adjustment, required, balance in rows
+    ))
+    return len(rows)
+
+
+def assess_fee_adjustments(academic_year, term, today=None):
+    """
+    Charge late penalties and credit early-payment discounts for the term's
+    fee structures whose deadline has passed. Returns
+    {'penalised': n, 'credited': n}.
+    """
+    today = today or timezone.localdate()
+    now = timezone.now()
+    result = {'penalised': 0, 'credited': 0}
+    structures = FeeStructure.objects.filter(
+        academic_year=academic_year, term=term, is_day_scholar=True, payment_deadline__lt=today
+    )
+    for structure in structures:
+        deadline_end = day_bounds(structure.payment_deadline)[1]
+        ledgers = StudentLedger.objects.filter(
+            academic_year=academic_year, term=term, student__grade=structure.grade_id
+        )
+        with transaction.atomic():
+            deltas = term_deltas()
+            if structure.late_payment_penalty > 0:
+                result['penalised'] += _apply(
+                    structure, 'late_penalty', ledgers.filter(outstanding_balance__gt=0),
+                    _percent_of('outstanding_balance', structure.late_payment_penalty), now, deltas,
+                )
+            if structure.early_payment_discount > 0:
+                result['credited'] += _apply(
+                    structure, 'early_payment',
+                    ledgers.filter(outstanding_balance__lte=0, last_payment_date__lt=deadline_end, term_fees__gt=0),
+                    _percent_of('term_fees', structure.early_payment_discount, sign=-1), now, deltas,
+                )
+
+            # Set-based updates skip the per-row summary deltas
+            record_term_deltas(deltas)
+    return result
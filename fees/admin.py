@@ -1,12 +1,26 @@
-from django.contrib import admin
-from django.urls import reverse
+import io
+
+from django.contrib import admin, messages
+from django.db.models import Max, Min
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils.html import format_html
 from django.utils import timezone
 from .models import (
     AcademicYear, Term, FeeComponent, FeeStructure, StudentLedger,
-    PaymentMethod, Payment, Receipt, FeeReminder, Discount,
-    PaymentPlan, Refund, AuditLog, ExchangeRate, BankReconciliation, AgentPayment
+    PaymentMethod, Payment, Receipt, ReceiptSequence, FeeReminder, Discount, FeeAdjustment,
+    PaymentPlan, PaymentPlanInstallment, Refund, AuditLog, AuditLogArchive, ExchangeRate, BankReconciliation, BankStatementLine, AgentPayment,
+    AgentSettlement, TermCollectionSummary
 )
+from .exports import AGENT_PAYMENT_COLUMNS, SETTLEMENT_COLUMNS, export_response
+from .forms import BankStatementForm, StatementImportForm
+from .imports import StatementImportError, import_statement
+from .payment_actions import approve_refunds, reject_payments, reject_refunds, verify_payments
+from .payment_plans import approve_plans
+from .reconciliation import reconcile_statement
+from .reminders import queue_reminders
+from .settlements import COMMISSION, settle_agents
 
 @admin.register(AcademicYear)
 class AcademicYearAdmin(admin.ModelAdmin):
@@ -52,7 +66,7 @@ class StudentLedgerAdmin(admin.ModelAdmin):
     list_filter = ('academic_year', 'term', 'flagged_for_followup')
     search_fields = ('student__user__first_name', 'student__user__last_name')
     readonly_fields = ('outstanding_balance',)
-    actions = ['flag_for_followup', 'unflag_for_followup']
+    actions = ['flag_for_followup', 'unflag_for_followup', 'queue_payment_reminders']
 
     def flag_for_followup(self, request, queryset):
         queryset.update(flagged_for_followup=True)
@@ -62,6 +76,26 @@ class StudentLedgerAdmin(admin.ModelAdmin):
         queryset.update(flagged_for_followup=False)
     unflag_for_followup.short_description = "Remove follow-up flag from selected ledgers"
 
+    def queue_payment_reminders(self, request, queryset):
+        # Only queued here; the send_fee_reminders worker delivers them
+        queued = 0
+        for academic_year, term in queryset.values_list('academic_year', 'term').distinct():
+            queued += queue_reminders(
+                'payment_due', academic_year, term, sent_by=request.user,
+                ledger_ids=queryset.filter(academic_year=academic_year, term=term).values('id'),
+            )
+        self.message_user(request, f"Queued {queued} reminder(s).")
+    queue_payment_reminders.short_description = "Queue payment reminders for selected ledgers"
+
+@admin.register(TermCollectionSummary)
+class TermCollectionSummaryAdmin(admin.ModelAdmin):
+    list_display = ('term', 'academic_year', 'currency', 'total_expected', 'total_collected', 'total_outstanding', 'fully_paid_count', 'rebuilt_at')
+    list_filter = ('academic_year', 'currency')
+    readonly_fields = (
+        'academic_year', 'term', 'currency', 'total_expected', 'total_collected', 'total_outstanding',
+        'ledger_count', 'fully_paid_count', 'todays_collections', 'collections_date', 'rebuilt_at'
+    )
+
 @admin.register(PaymentMethod)
 class PaymentMethodAdmin(admin.ModelAdmin):
     list_display = ('name', 'is_active', 'requires_reference')
@@ -69,11 +103,52 @@ class PaymentMethodAdmin(admin.ModelAdmin):
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
-    list_display = ('student', 'amount', 'payment_method', 'status', 'payment_date', 'recorded_by', 'receipt_link')
-    list_filter = ('status', 'payment_method', 'payment_date', 'recorded_by')
+    list_display = ('student', 'amount', 'currency', 'payment_method', 'status', 'payment_date', 'recorded_by', 'receipt_link')
+    list_filter = ('status', 'currency', 'payment_method', 'payment_date', 'recorded_by')
     search_fields = ('student__user__first_name', 'student__user__last_name', 'reference_number')
     readonly_fields = ('verified_at',)
     actions = ['verify_payments', 'reject_payments']
+    change_list_template = 'admin/fees/payment/change_list.html'
+
+    def get_urls(self):
+        urls = [
+            path('import-statement/', self.admin_site.admin_view(self.import_statement_view), name='fees_payment_import_statement'),
+        ]
+        return urls + super().get_urls()
+
+    def import_statement_view(self, request):
+        """Upload a bank/EcoCash CSV statement and post it in bulk"""
+        if not self.has_add_permission(request):
+            return redirect('admin:fees_payment_changelist')
+
+        result = None
+        if request.method == 'POST':
+            form = StatementImportForm(request.POST, request.FILES)
+            if form.is_valid():
+                statement = io.TextIOWrapper(form.cleaned_data['statement'].file, encoding='utf-8-sig', newline='')
+                try:
+                    result = import_statement(
+                        statement, request.user,
+                        payment_method=form.cleaned_data['payment_method'],
+                        currency=form.cleaned_data['currency'] or None,
+                        dry_run=form.cleaned_data['dry_run'],
+                    )
+                except (StatementImportError, UnicodeDecodeError) as e:
+                    messages.error(request, f'Could not import statement: {e}')
+                else:
+                    level = messages.WARNING if result.errors else messages.SUCCESS
+                    messages.add_message(request, level, str(result))
+        else:
+            form = StatementImportForm()
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import payment statement',
+            'form': form,
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/fees/payment/import_statement.html', context)
 
     def receipt_link(self, obj):
         if hasattr(obj, 'receipt'):
@@ -82,11 +157,13 @@ class PaymentAdmin(admin.ModelAdmin):
     receipt_link.short_description = "Receipt"
 
     def verify_payments(self, request, queryset):
-        queryset.update(status='verified', verified_at=timezone.now(), verified_by=request.user)
+        verified = verify_payments(queryset, request.user)
+        messages.success(request, f'Verified {verified} payment(s) and credited their ledgers.')
     verify_payments.short_description = "Verify selected payments"
 
     def reject_payments(self, request, queryset):
-        queryset.update(status='failed')
+        rejected = reject_payments(queryset, request.user)
+        messages.success(request, f'Rejected {rejected} payment(s).')
     reject_payments.short_description = "Reject selected payments"
 
 @admin.register(Receipt)
@@ -95,10 +172,15 @@ class ReceiptAdmin(admin.ModelAdmin):
     search_fields = ('receipt_number', 'payment__student__user__first_name', 'payment__student__user__last_name')
     readonly_fields = ('receipt_number',)
 
+@admin.register(ReceiptSequence)
+class ReceiptSequenceAdmin(admin.ModelAdmin):
+    list_display = ('year', 'last_number')
+    readonly_fields = ('year', 'last_number')
+
 @admin.register(FeeReminder)
 class FeeReminderAdmin(admin.ModelAdmin):
-    list_display = ('student', 'reminder_type', 'sent_via_sms', 'sent_via_email', 'sent_at', 'sent_by')
-    list_filter = ('reminder_type', 'sent_at', 'sent_by')
+    list_display = ('student', 'reminder_type', 'status', 'email_status', 'sms_status', 'attempts', 'sent_at', 'sent_by')
+    list_filter = ('reminder_type', 'status', 'email_status', 'sms_status', 'sent_at', 'sent_by')
     search_fields = ('student__user__first_name', 'student__user__last_name')
 
 @admin.register(Discount)
@@ -107,25 +189,59 @@ class DiscountAdmin(admin.ModelAdmin):
     list_filter = ('discount_type', 'is_active', 'approved_by')
     search_fields = ('student__user__first_name', 'student__user__last_name')
 
+@admin.register(FeeAdjustment)
+class FeeAdjustmentAdmin(admin.ModelAdmin):
+    list_display = ('ledger', 'kind', 'amount', 'percentage', 'assessed_at')
+    list_filter = ('kind', 'ledger__term')
+    search_fields = ('ledger__student__user__first_name', 'ledger__student__user__last_name')
+    readonly_fields = ('ledger', 'kind', 'amount', 'percentage', 'assessed_at')
+
+class PaymentPlanInstallmentInline(admin.TabularInline):
+    model = PaymentPlanInstallment
+    extra = 0
+    can_delete = False
+    readonly_fields = ('number', 'due_date', 'amount', 'amount_paid', 'status', 'paid_at')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(PaymentPlan)
 class PaymentPlanAdmin(admin.ModelAdmin):
-    list_display = ('student', 'total_amount', 'number_of_installments', 'installment_amount', 'status', 'created_by')
+    list_display = ('student', 'total_amount', 'number_of_installments', 'installment_amount', 'start_date', 'end_date', 'status', 'created_by', 'approved_by')
     list_filter = ('status', 'created_by')
     search_fields = ('student__user__first_name', 'student__user__last_name')
+    readonly_fields = ('approved_by', 'approved_at')
+    inlines = [PaymentPlanInstallmentInline]
+    actions = ['approve_payment_plans']
+
+    def approve_payment_plans(self, request, queryset):
+        approved = approve_plans(queryset, request.user)
+        messages.success(request, f'Approved {approved} payment plan(s) and scheduled their installments.')
+    approve_payment_plans.short_description = "Approve selected payment plans"
+
+@admin.register(PaymentPlanInstallment)
+class PaymentPlanInstallmentAdmin(admin.ModelAdmin):
+    list_display = ('plan', 'number', 'due_date', 'amount', 'amount_paid', 'status', 'paid_at')
+    list_filter = ('status', 'due_date')
+    search_fields = ('plan__student__user__first_name', 'plan__student__user__last_name')
+    readonly_fields = ('plan', 'number', 'due_date', 'amount', 'amount_paid', 'status', 'paid_at')
 
 @admin.register(Refund)
 class RefundAdmin(admin.ModelAdmin):
-    list_display = ('student', 'amount', 'status', 'refund_method', 'requested_by', 'approved_by')
+    list_display = ('student', 'amount', 'status', 'refund_method', 'ledger', 'requested_by', 'approved_by', 'approved_at')
     list_filter = ('status', 'refund_method', 'requested_by')
     search_fields = ('student__user__first_name', 'student__user__last_name')
+    readonly_fields = ('ledger', 'approved_by', 'approved_at')
     actions = ['approve_refunds', 'reject_refunds']
 
     def approve_refunds(self, request, queryset):
-        queryset.update(status='approved', approved_by=request.user)
+        approved = approve_refunds(queryset, request.user)
+        messages.success(request, f'Approved {approved} refund(s) and debited their ledgers.')
     approve_refunds.short_description = "Approve selected refunds"
 
     def reject_refunds(self, request, queryset):
-        queryset.update(status='rejected')
+        rejected = reject_refunds(queryset, request.user)
+        messages.success(request, f'Rejected {rejected} refund(s).')
     reject_refunds.short_description = "Reject selected refunds"
 
 @admin.register(AuditLog)
@@ -134,6 +250,16 @@ class AuditLogAdmin(admin.ModelAdmin):
     list_filter = ('action_type', 'timestamp', 'user')
     search_fields = ('user__username', 'student__user__first_name', 'student__user__last_name')
     readonly_fields = ('timestamp',)
+    date_hierarchy = 'timestamp'
+    list_select_related = ('user', 'student__user')
+
+@admin.register(AuditLogArchive)
+class AuditLogArchiveAdmin(admin.ModelAdmin):
+    list_display = ('month', 'table_name', 'row_count', 'archived_at')
+    readonly_fields = ('month', 'table_name', 'row_count', 'archived_at')
+
+    def has_add_permission(self, request):
+        return False
 
 @admin.register(ExchangeRate)
 class ExchangeRateAdmin(admin.ModelAdmin):
@@ -142,20 +268,104 @@ class ExchangeRateAdmin(admin.ModelAdmin):
 
 @admin.register(BankReconciliation)
 class BankReconciliationAdmin(admin.ModelAdmin):
-    list_display = ('date', 'bank_balance', 'book_balance', 'difference', 'reconciled_by')
+    list_display = ('date', 'bank_balance', 'book_balance', 'difference', 'reconciled_by', 'lines_link')
     list_filter = ('date', 'reconciled_by')
+    change_list_template = 'admin/fees/bankreconciliation/change_list.html'
+
+    def get_urls(self):
+        urls = [
+            path('reconcile-statement/', self.admin_site.admin_view(self.reconcile_statement_view), name='fees_bankreconciliation_reconcile_statement'),
+        ]
+        return urls + super().get_urls()
+
+    def reconcile_statement_view(self, request):
+        """Upload a bank statement and match its lines against payments"""
+        if not self.has_add_permission(request):
+            return redirect('admin:fees_bankreconciliation_changelist')
+
+        report = None
+        if request.method == 'POST':
+            form = BankStatementForm(request.POST, request.FILES)
+            if form.is_valid():
+                statement = io.TextIOWrapper(form.cleaned_data['statement'].file, encoding='utf-8-sig', newline='')
+                try:
+                    report = reconcile_statement(
+                        statement, request.user,
+                        window_days=form.cleaned_data['window_days'],
+                        bank_balance=form.cleaned_data['bank_balance'],
+                        dry_run=form.cleaned_data['dry_run'],
+                    )
+                except (StatementImportError, UnicodeDecodeError) as e:
+                    messages.error(request, f'Could not reconcile statement: {e}')
+                else:
+                    level = messages.WARNING if report.ambiguous or report.unmatched else messages.SUCCESS
+                    messages.add_message(request, level, str(report))
+        else:
+            form = BankStatementForm()
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Reconcile bank statement',
+            'form': form,
+            'report': report,
+        }
+        return TemplateResponse(request, 'admin/fees/bankreconciliation/reconcile_statement.html', context)
+
+    def lines_link(self, obj):
+        url = reverse('admin:fees_bankstatementline_changelist')
+        return format_html('<a href="{}?reconciliation__id__exact={}">Statement lines</a>', url, obj.id)
+    lines_link.short_description = "Lines"
+
+@admin.register(BankStatementLine)
+class BankStatementLineAdmin(admin.ModelAdmin):
+    list_display = ('reconciliation', 'line_number', 'date', 'amount', 'reference', 'status', 'match_type', 'payment', 'candidates')
+    list_filter = ('status', 'match_type', 'reconciliation')
+    search_fields = ('reference', 'description')
+    raw_id_fields = ('payment',)
+    list_select_related = ('reconciliation', 'payment__student__user')
 
 @admin.register(AgentPayment)
 class AgentPaymentAdmin(admin.ModelAdmin):
-    list_display = ('agent_name', 'student', 'amount', 'status', 'collected_at', 'recorded_by')
+    list_display = ('agent_name', 'student', 'amount', 'commission_amount', 'status', 'settlement', 'collected_at', 'recorded_by')
     list_filter = ('status', 'collected_at', 'recorded_by')
     search_fields = ('agent_name', 'student__user__first_name', 'student__user__last_name')
     actions = ['verify_agent_payments', 'mark_as_paid']
 
     def verify_agent_payments(self, request, queryset):
-        queryset.update(status='verified')
+        queryset.filter(status='pending').update(status='verified', commission_amount=COMMISSION)
     verify_agent_payments.short_description = "Verify selected agent payments"
 
     def mark_as_paid(self, request, queryset):
-        queryset.update(status='paid')
-    mark_as_paid.short_description = "Mark selected payments as paid to agent"
+        # Settles through a settlement run so commission totals and audit are kept
+        dates = queryset.filter(status='verified', settlement__isnull=True).aggregate(
+            first=Min('collected_at'), last=Max('collected_at')
+        )
+        if dates['first'] is None:
+            self.message_user(request, "No verified, unsettled payments selected.", messages.WARNING)
+            return
+        settlements = settle_agents(
+            request.user, timezone.localdate(dates['first']), timezone.localdate(dates['last']), payments=queryset
+        )
+        self.message_user(request, f"Created {len(settlements)} agent settlement(s).")
+    mark_as_paid.short_description = "Settle selected payments and mark them paid to agent"
+
+@admin.register(AgentSettlement)
+class AgentSettlementAdmin(admin.ModelAdmin):
+    list_display = ('agent_name', 'agent_phone', 'period_start', 'period_end', 'payment_count', 'total_collected', 'total_commission', 'net_payable', 'settled_at')
+    list_filter = ('settled_at', 'agent_name')
+    search_fields = ('agent_name', 'agent_phone')
+    readonly_fields = (
+        'agent_name', 'agent_phone', 'period_start', 'period_end', 'payment_count', 'total_collected',
+        'total_commission', 'net_payable', 'settled_by', 'settled_at'
+    )
+    actions = ['export_settlements', 'export_collections']
+
+    def export_settlements(self, request, queryset):
+        return export_response(queryset.order_by('settled_at', 'agent_name'), SETTLEMENT_COLUMNS, 'agent-settlements')
+    export_settlements.short_description = "Export selected settlements (CSV)"
+
+    def export_collections(self, request, queryset):
+        payments = AgentPayment.objects.filter(settlement__in=queryset).order_by('settlement', 'collected_at', 'id')
+        return export_response(payments, AGENT_PAYMENT_COLUMNS, 'agent-collections')
+    export_collections.short_description = "Export collections in selected settlements (CSV)"
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class FeesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'fees'
+
+    def ready(self):
+        # Connect the current year/term cache, exchange rate cache and
+        # discount repricing signals
+        from . import current, discounts, exchange  # noqa: F401
@@ -0,0 +1,160 @@
+"""
+Buffered audit logging.
+
+audit() builds an AuditLog entry stamped with the current request's IP
+address and user agent, and queues it once the surrounding transaction
+commits (immediately outside one), so an action that rolls back leaves no
+trail. AuditMiddleware opens a buffer per request and writes everything
+queued with one bulk_create when the response is ready; audit_batch() does
+the same for management commands and other code outside a request. With no
+buffer open, each entry is written on commit by itself.
+
+Code that already writes its audit rows with bulk_create builds them with
+audit_entry() to get the same request details.
+
+archive_audit_log() keeps the live table small: each closed month older than
+AUDIT_LOG_LIVE_MONTHS is copied into its own fees_auditlog_YYYY_MM table
+with one INSERT ... SELECT and deleted from AuditLog with one DELETE, in a
+single transaction, and recorded as an AuditLogArchive.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import AuditLog, AuditLogArchive
+
+_buffer = ContextVar('fees_audit_buffer', default=None)
+
+
+class _Buffer:
+    def __init__(self, request=None):
+        self.entries = []
+        self.closed = False
+        self.ip_address = client_ip(request) if request is not None else None
+        self.user_agent = request.META.get('HTTP_USER_AGENT', '') if request is not None else ''
+
+    def add(self, entry):
+        if self.closed:
+            # Committed after the buffer was written
+            entry.save()
+        else:
+            self.entries.append(entry)
+
+    def flush(self):
+        self.closed = True
+        entries, self.entries = self.entries, []
+        if entries:
+            AuditLog.objects.bulk_create(entries)
+
+
+def client_ip(request):
+    """The client's address; X-Forwarded-For is only trusted behind AUDIT_TRUST_X_FORWARDED_FOR"""
+    if getattr(settings, 'AUDIT_TRUST_X_FORWARDED_FOR', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return forwarded.split(',')[0].strip() or None
+    return request.META.get('REMOTE_ADDR') or None
+
+
+def audit_entry(user, action_type, description, student=None, amount=None, student_id=None):
+    """An unsaved AuditLog carrying the current request's IP address and user agent"""
+    buffer = _buffer.get()
+    return AuditLog(
+        user=user, action_type=action_type, description=description, amount=amount,
+        student_id=student.pk if student is not None else student_id,
+        ip_address=buffer.ip_address if buffer else None, user_agent=buffer.user_agent if buffer else '',
+    )
+
+
+def audit(user, action_type, description, student=None, amount=None):
+    """Record an audit entry once the current transaction commits"""
+    entry = audit_entry(user, action_type, description, student=student, amount=amount)
+    buffer = _buffer.get()
+    if buffer is not None:
+        transaction.on_commit(lambda: buffer.add(entry))
+    else:
+        transaction.on_commit(entry.save)
+
+
+@contextmanager
+def audit_batch(request=None):
+    """Buffer audit() entries made inside the block and write them together at the end"""
+    buffer = _Buffer(request)
+    token = _buffer.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _buffer.reset(token)
+        buffer.flush()
+
+
+# Archive
+
+def _month_start(month):
+    return timezone.make_aware(datetime(month.year, month.month, 1))
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def archive_table_name(month):
+    return f'{AuditLog._meta.db_table}_{month:%Y_%m}'
+
+
+def archive_month(month):
+    """Move one calendar month of AuditLog into its archive table; returns how many entries moved"""
+    month = month.replace(day=1)
+    entries = AuditLog.objects.filter(
+        timestamp__gte=_month_start(month), timestamp__lt=_month_start(_next_month(month))
+    ).order_by()
+    table = archive_table_name(month)
+    fields = AuditLog._meta.concrete_fields
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+
+    with transaction.atomic():
+        if not entries.exists():
+            return 0
+        with connection.cursor() as cursor:
+            if table not in connection.introspection.table_names(cursor):
+                cursor.execute(
+                    f'CREATE TABLE {quote(table)} AS SELECT {columns} FROM {quote(AuditLog._meta.db_table)} WHERE 1 = 0'
+                )
+            select, params = entries.values_list(*(field.attname for field in fields)).query.sql_with_params()
+            cursor.execute(f'INSERT INTO {quote(table)} ({columns}) {select}', params)
+            moved = cursor.rowcount
+        entries.delete()
+        archive, _ = AuditLogArchive.objects.select_for_update().get_or_create(month=month, defaults={'table_name': table})
+        archive.row_count += moved
+        archive.save()
+    return moved
+
+
+def archive_audit_log(before=None):
+    """
+    Archive every month before `before` (default: AUDIT_LOG_LIVE_MONTHS
+    months before this one). Returns {month: entries moved}.
+    """
+    if before is None:
+        today = timezone.localdate()
+        months_back = getattr(settings, 'AUDIT_LOG_LIVE_MONTHS', 12)
+        index = today.year * 12 + today.month - 1 - months_back
+        before = date(index // 12, index % 12 + 1, 1)
+    before = before.replace(day=1)
+    oldest = AuditLog.objects.filter(timestamp__lt=_month_start(before)).aggregate(oldest=Min('timestamp'))['oldest']
+    moved = {}
+    if oldest is None:
+        return moved
+    month = timezone.localtime(oldest).date().replace(day=1)
+    while month < before:
+        count = archive_month(month)
+        if count:
+            moved[month] = count
+        month = _next_month(month)
+    return moved
@@ -0,0 +1,92 @@
+"""
+The current academic year and term.
+
+Both change a few times a year but are needed on nearly every request, so
+they are cached in process and only re-read from the database when they
+are invalidated (by saving or deleting an AcademicYear or Term, including
+the admin's list_editable toggles, or by make_current) or after
+CURRENT_PERIOD_TTL seconds.
+
+Invalidation signals only reach the process that made the change. With
+several worker processes, set CURRENT_PERIOD_CACHE to a shared cache alias:
+each process then checks a version number in that cache (one cache read per
+request) and reloads as soon as any process bumps it.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import AcademicYear, Term
+
+VERSION_KEY = 'fees:current-period:version'
+
+# This process's copy: version seen in the shared cache, expiry, (year, term)
+_state = {'version': None, 'expires': 0, 'period': None}
+_lock = threading.Lock()
+
+
+def _shared_cache():
+    alias = getattr(settings, 'CURRENT_PERIOD_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _shared_version(cache):
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def _load():
+    year = AcademicYear.objects.filter(is_current=True).first()
+    term = Term.objects.filter(is_current=True).select_related('academic_year').first()
+    return year, term
+
+
+def get_current_period():
+    """(current AcademicYear, current Term); either may be None"""
+    cache = _shared_cache()
+    version = _shared_version(cache) if cache is not None else None
+    now = time.monotonic()
+    with _lock:
+        if _state['period'] is not None and _state['version'] == version and now < _state['expires']:
+            return _state['period']
+    period = _load()
+    with _lock:
+        _state.update(version=version, expires=now + getattr(settings, 'CURRENT_PERIOD_TTL', 300), period=period)
+    return period
+
+
+def get_current_year():
+    return get_current_period()[0]
+
+
+def get_current_term():
+    return get_current_period()[1]
+
+
+def clear_current_period():
+    """Drop the cached year and term here and, if configured, in every process"""
+    with _lock:
+        _state.update(version=None, expires=0, period=None)
+    cache = _shared_cache()
+    if cache is not None:
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 1, timeout=None)
+
+
+@receiver([post_save, post_delete], sender=AcademicYear)
+@receiver([post_save, post_delete], sender=Term)
+def _period_changed(sender, **kwargs):
+    # Now, so this request sees the change, and again on commit in case
+    # another request re-read the old rows in between
+    clear_current_period()
+    transaction.on_commit(clear_current_period)
@@ -0,0 +1,125 @@
+"""
+Discount pricing for term ledgers.
+
+A ledger's term_fees is its grade's FeeStructure total less the student's
+active discounts; the amount taken off is kept in discount_amount. All of a
+student's active discounts combine: percentages are added (capped at 100)
+and applied to the gross fee, fixed amounts are then subtracted, and the
+fee never goes below zero. A full scholarship always counts as 100%.
+
+price_ledgers() reads the discounts, fee structures and ledgers in one query
+each, prices every ledger in a single pass and writes only the ledgers whose
+figures change, with bulk_update, adding the change in expected fees and
+fully paid ledgers to each term summary with one UPDATE. The ledgers stay
+locked from the read to the write. By default it only looks at ledgers that
+have a discount now or had one before, so rerunning it after a discount
+changes does not reprice the whole school.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .current import get_current_period
+from .exchange import reporting_currency
+from .models import Discount, FeeStructure, StudentLedger
+from .summary import add_ledger_changes, ledger_snapshot, record_term_deltas, term_deltas
+
+ZERO = Decimal('0.00')
+HUNDRED = Decimal('100')
+UPDATE_BATCH_SIZE = 1000
+
+
+def _cents(value):
+    return value.quantize(ZERO, rounding=ROUND_HALF_UP)
+
+
+def net_fee(gross, percentage, fixed_amount):
+    """(net fee, discount) for a gross fee and a student's combined discounts"""
+    discount = gross * min(percentage, HUNDRED) / HUNDRED + fixed_amount
+    discount = _cents(min(max(discount, ZERO), gross))
+    return gross - discount, discount
+
+
+def active_discounts(student_ids=None):
+    """{student_id: (total percentage, total fixed amount)} in one query"""
+    discounts = Discount.objects.filter(is_active=True)
+    if student_ids is not None:
+        discounts = discounts.filter(student_id__in=student_ids)
+    rows = discounts.values('student_id').annotate(
+        percentage=Sum(Case(
+            When(discount_type='full_scholarship', then=Value(HUNDRED)),
+            default=F('percentage'),
+            output_field=DecimalField(max_digits=7, decimal_places=2),
+        )),
+        fixed=Sum('fixed_amount'),
+    )
+    return {row['student_id']: (row['percentage'] or ZERO, row['fixed'] or ZERO) for row in rows}
+
+
+def price_ledgers(academic_year, term, student_ids=None, all_ledgers=False):
+    """
+    Apply active discounts to the term's ledgers and return how many changed.
+    Pass student_ids to reprice just those students, or all_ledgers=True to
+    reprice every ledger in the term (e.g. after a fee structure change).
+    """
+    discounts = active_discounts(student_ids)
+    ledgers = StudentLedger.objects.filter(academic_year=academic_year, term=term)
+    if student_ids is not None:
+        ledgers = ledgers.filter(student_id__in=student_ids)
+    elif not all_ledgers:
+        ledgers = ledgers.filter(Q(student_id__in=list(discounts)) | ~Q(discount_amount=0))
+
+    # Students carry no boarding flag yet, so day-scholar fees apply
+    structures = {
+        grade_id: (total_fee, currency)
+        for grade_id, total_fee, currency in FeeStructure.objects.filter(
+            academic_year=academic_year, term=term, is_day_scholar=True
+        ).order_by('id').values_list('grade_id', 'total_fee', 'currency')
+    }
+
+    now = timezone.now()
+    changed = []
+    snapshots = []
+    # Locked from the read to the write so a payment recorded in between
+    # is not overwritten with a stale payments_made
+    with transaction.atomic():
+        for ledger in ledgers.select_for_update(of=('self',)).annotate(grade_id=F('student__grade_id')).only(
+            'id', 'student_id', 'academic_year', 'term', 'opening_balance', 'term_fees', 'discount_amount', 'adjustments', 'payments_made',
+            'total_required', 'outstanding_balance',
+        ):
+            gross, currency = structures.get(ledger.grade_id, (ledger.term_fees + ledger.discount_amount, reporting_currency()))
+            term_fees, discount = net_fee(gross, *discounts.get(ledger.student_id, (ZERO, ZERO)))
+            if term_fees == ledger.term_fees and discount == ledger.discount_amount:
+                continue
+            before = ledger_snapshot(ledger, currency)
+            ledger.term_fees = term_fees
+            ledger.discount_amount = discount
+            ledger.total_required = ledger.opening_balance + term_fees + ledger.adjustments
+            ledger.outstanding_balance = ledger.total_required - ledger.payments_made
+            ledger.updated_at = now
+            changed.append(ledger)
+            snapshots.append((before, ledger_snapshot(ledger, currency)))
+
+        if changed:
+            StudentLedger.objects.bulk_update(
+                changed,
+                ['term_fees', 'discount_amount', 'total_required', 'outstanding_balance', 'updated_at'],
+                batch_size=UPDATE_BATCH_SIZE,
+            )
+            # bulk_update skips the per-row summary deltas
+            record_term_deltas(add_ledger_changes(term_deltas(), snapshots))
+    return len(changed)
+
+
+@receiver([post_save, post_delete], sender=Discount)
+def _discount_changed(sender, instance, **kwargs):
+    def reprice():
+        term = get_current_period()[1]
+        if term is not None:
+            price_ledgers(term.academic_year_id, term, student_ids=[instance.student_id])
+
+    transaction.on_commit(reprice)
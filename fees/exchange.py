@@ -0,0 +1,253 @@
+"""
+Exchange rates as of a date, and totals in a reporting currency.
+
+An ExchangeRate applies from its date until the next rate for the same
+pair. RateTable loads every rate in one query, keeps each (from, to) pair's
+dates sorted, and answers "rate on day D" by bisecting them. A pair with no
+rate of its own uses the inverse of the opposite pair, or goes through
+REPORTING_CURRENCY.
+
+The table is cached in process and rebuilt after an ExchangeRate is saved or
+deleted, or after EXCHANGE_RATE_TTL seconds. As with the current period
+cache, set EXCHANGE_RATE_CACHE to a shared cache alias so a change made by
+one worker process is seen by all.
+
+converted_totals() sums payments in the reporting currency with one grouped
+query: amounts are summed per (currency, day) in SQL and each group is
+converted in Python, so the cost does not grow with the number of payments.
+It only loads rates once a group is in a currency other than the target.
+
+A ledger is kept in the currency its term's day-scholar fees are set in
+(REPORTING_CURRENCY if its grade has none); fee_currency() and
+ledger_currencies() answer which that is, and to_ledger_currency() and
+in_ledger_currency() restate payment amounts in it.
+"""
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import CharField, Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ExchangeRate, FeeStructure, StudentLedger
+
+VERSION_KEY = 'fees:exchange-rates:version'
+CENT = Decimal('0.01')
+ONE = Decimal('1')
+
+_state = {'version': None, 'expires': 0, 'table': None}
+_lock = threading.Lock()
+
+
+class ExchangeRateError(Exception):
+    """Raised when no rate converts between two currencies on a date"""
+
+
+def reporting_currency():
+    return getattr(settings, 'REPORTING_CURRENCY', 'USD')
+
+
+class RateTable:
+    def __init__(self, rows):
+        """`rows` are (from_currency, to_currency, date, rate) ordered by date"""
+        pairs = defaultdict(lambda: ([], []))
+        for from_currency, to_currency, day, rate in rows:
+            dates, rates = pairs[(from_currency, to_currency)]
+            dates.append(day)
+            rates.append(rate)
+        self.pairs = dict(pairs)
+
+    def _direct(self, from_currency, to_currency, day):
+        dates, rates = self.pairs.get((from_currency, to_currency), ((), ()))
+        index = bisect_right(dates, day) - 1
+        return rates[index] if index >= 0 else None
+
+    def _single(self, from_currency, to_currency, day):
+        rate = self._direct(from_currency, to_currency, day)
+        if rate is not None:
+            return rate
+        inverse = self._direct(to_currency, from_currency, day)
+        if inverse:
+            return ONE / inverse
+        return None
+
+    def rate(self, from_currency, to_currency, day):
+        """Units of to_currency per unit of from_currency on `day`"""
+        if from_currency == to_currency:
+            return ONE
+        rate = self._single(from_currency, to_currency, day)
+        if rate is None:
+            pivot = reporting_currency()
+            if pivot not in (from_currency, to_currency):
+                first = self._single(from_currency, pivot, day)
+                second = self._single(pivot, to_currency, day)
+                if first is not None and second is not None:
+                    rate = first * second
+        if rate is None:
+            raise ExchangeRateError(f'No {from_currency} to {to_currency} exchange rate on or before {day}')
+        return rate
+
+    def convert(self, amount, from_currency, to_currency, day):
+        return (amount * self.rate(from_currency, to_currency, day)).quantize(CENT)
+
+
+# Cache
+
+def _shared_cache():
+    alias = getattr(settings, 'EXCHANGE_RATE_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _shared_version(cache):
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def get_rate_table():
+    """The cached RateTable, loading it if it is missing, stale or invalidated"""
+    cache = _shared_cache()
+    version = _shared_version(cache) if cache is not None else None
+    now = time.monotonic()
+    with _lock:
+        if _state['table'] is not None and _state['version'] == version and now < _state['expires']:
+            return _state['table']
+    table = RateTable(
+        ExchangeRate.objects.order_by('date').values_list('from_currency', 'to_currency', 'date', 'rate')
+    )
+    with _lock:
+        _state.update(version=version, expires=now + getattr(settings, 'EXCHANGE_RATE_TTL', 3600), table=table)
+    return table
+
+
+def clear_rate_table():
+    """Drop the cached rates here and, if configured, in every process"""
+    with _lock:
+        _state.update(version=None, expires=0, table=None)
+    cache = _shared_cache()
+    if cache is not None:
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 1, timeout=None)
+
+
+@receiver([post_save, post_delete], sender=ExchangeRate)
+def _rates_changed(sender, **kwargs):
+    clear_rate_table()
+    transaction.on_commit(clear_rate_table)
+
+
+# Conversion
+
+def convert(amount, from_currency, to_currency=None, day=None):
+    """`amount` in to_currency (default REPORTING_CURRENCY) at the rate on `day` (default today)"""
+    return get_rate_table().convert(
+        amount, from_currency, to_currency or reporting_currency(), day or timezone.localdate()
+    )
+
+
+def _day_totals(payments, date_field):
+    """(currency, day, amount, count) sums of `payments` in one grouped query"""
+    return list(
+        payments.annotate(day=TruncDate(date_field)).values_list('currency', 'day')
+        .annotate(total=Sum('amount'), count=Count('id')).order_by()
+    )
+
+
+class _LazyTable:
+    """Loads the rate table only once a conversion actually needs it"""
+
+    def __init__(self):
+        self.table = None
+
+    def convert(self, amount, from_currency, to_currency, day):
+        if from_currency == to_currency:
+            return amount
+        if self.table is None:
+            self.table = get_rate_table()
+        return self.table.convert(amount, from_currency, to_currency, day)
+
+
+def converted_totals(payments, to_currency=None, date_field='payment_date'):
+    """(sum in to_currency, count) of `payments`, each converted at the rate on its own day"""
+    to_currency = to_currency or reporting_currency()
+    table = _LazyTable()
+    total, count = Decimal('0.00'), 0
+    for currency, day, amount, rows in _day_totals(payments, date_field):
+        total += table.convert(amount, currency, to_currency, day)
+        count += rows
+    return total, count
+
+
+# Ledger currencies
+
+def fee_currencies():
+    """{(year_id, term_id, grade_id): currency} for the day-scholar fee structures"""
+    return {
+        (year_id, term_id, grade_id): currency
+        for year_id, term_id, grade_id, currency in FeeStructure.objects.filter(is_day_scholar=True).order_by('id').values_list(
+            'academic_year_id', 'term_id', 'grade_id', 'currency'
+        )
+    }
+
+
+def fee_currency(currencies, year_id, term_id, grade_id):
+    """The currency a ledger for this term and grade is kept in, looked up in fee_currencies()"""
+    return currencies.get((year_id, term_id, grade_id), reporting_currency())
+
+
+def fee_currency_expression(year='academic_year', term='term', grade='student__grade'):
+    """fee_currency() in SQL, for annotating a queryset with the fields named"""
+    structure = FeeStructure.objects.filter(
+        academic_year=OuterRef(year), term=OuterRef(term), grade=OuterRef(grade), is_day_scholar=True
+    ).order_by('-id').values('currency')[:1]
+    return Coalesce(Subquery(structure), Value(reporting_currency()), output_field=CharField())
+
+
+def ledger_currencies(ledgers):
+    """{ledger_id: the currency its term's fees are set in} for a StudentLedger queryset"""
+    currencies = fee_currencies()
+    return {
+        ledger_id: fee_currency(currencies, year_id, term_id, grade_id)
+        for ledger_id, year_id, term_id, grade_id in ledgers.values_list(
+            'id', 'academic_year_id', 'term_id', 'student__grade_id'
+        )
+    }
+
+
+def to_ledger_currency(rows):
+    """
+    (ledger currency, amount in it) for each (ledger_id, amount, currency,
+    payment_date) row, converted at the payment date's rate, in order; None
+    for rows with no ledger
+    """
+    ledger_ids = {row[0] for row in rows if row[0] is not None}
+    currencies = ledger_currencies(StudentLedger.objects.filter(id__in=ledger_ids)) if ledger_ids else {}
+    table = _LazyTable()
+    converted = []
+    for ledger_id, amount, currency, payment_date in rows:
+        if ledger_id is None:
+            converted.append(None)
+            continue
+        target = currencies.get(ledger_id, currency)
+        converted.append((target, table.convert(amount, currency, target, timezone.localdate(payment_date))))
+    return converted
+
+
+def in_ledger_currency(rows):
+    """
+    Amounts of (ledger_id, amount, currency, payment_date) rows converted into
+    their ledgers' fee currencies, in order; None for rows with no ledger
+    """
+    return [None if row is None else row[1] for row in to_ledger_currency(rows)]
@@ -0,0 +1,139 @@
+"""
+Streaming exports of payments, ledgers and arrears.
+
+Rows are read with values() projections and iterator(), and written out as
+they are produced, so memory use does not grow with the size of the export.
+CSV rows go straight into the response; an XLSX workbook has to be complete
+before it can be sent, so it is written to a temporary file and streamed
+from there in EXPORT_FILE_BLOCK_SIZE chunks.
+"""
+import csv
+import tempfile
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+
+try:
+    import openpyxl
+except ImportError:  # only needed for XLSX exports
+    openpyxl = None
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FILE_BLOCK_SIZE = 64 * 1024
+
+PAYMENT_COLUMNS = (
+    ('payment_date', 'Date'),
+    ('receipt__receipt_number', 'Receipt'),
+    ('student__user__username', 'Admission number'),
+    ('student__user__first_name', 'First name'),
+    ('student__user__last_name', 'Last name'),
+    ('student__grade__name', 'Grade'),
+    ('amount', 'Amount'),
+    ('currency', 'Currency'),
+    ('payment_method__name', 'Method'),
+    ('reference_number', 'Reference'),
+    ('status', 'Status'),
+    ('recorded_by__email', 'Recorded by'),
+)
+
+LEDGER_COLUMNS = (
+    ('student__user__username', 'Admission number'),
+    ('student__user__first_name', 'First name'),
+    ('student__user__last_name', 'Last name'),
+    ('student__grade__name', 'Grade'),
+    ('academic_year__name', 'Year'),
+    ('term__name', 'Term'),
+    ('opening_balance', 'Opening balance'),
+    ('term_fees', 'Term fees'),
+    ('total_required', 'Total required'),
+    ('payments_made', 'Payments made'),
+    ('outstanding_balance', 'Outstanding'),
+    ('last_payment_date', 'Last payment'),
+)
+
+SETTLEMENT_COLUMNS = (
+    ('id', 'Settlement'),
+    ('agent_name', 'Agent'),
+    ('agent_phone', 'Phone'),
+    ('period_start', 'From'),
+    ('period_end', 'To'),
+    ('payment_count', 'Collections'),
+    ('total_collected', 'Total collected'),
+    ('total_commission', 'Commission'),
+    ('net_payable', 'Net payable'),
+    ('settled_at', 'Settled at'),
+    ('settled_by__email', 'Settled by'),
+)
+
+AGENT_PAYMENT_COLUMNS = (
+    ('settlement_id', 'Settlement'),
+    ('agent_name', 'Agent'),
+    ('collected_at', 'Collected at'),
+    ('reference', 'Reference'),
+    ('student__user__username', 'Admission number'),
+    ('amount', 'Amount'),
+    ('commission_rate', 'Commission rate'),
+    ('commission_amount', 'Commission'),
+)
+
+
+class Echo:
+    """File-like object that hands back what is written, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    if hasattr(value, 'tzinfo') and value.tzinfo is not None:
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M')
+    return '' if value is None else value
+
+
+def export_rows(queryset, columns):
+    """Yield the header and then one tuple per row, streamed from the database"""
+    fields = [field for field, _ in columns]
+    yield tuple(label for _, label in columns)
+    for row in queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield tuple(_cell(value) for value in row)
+
+
+def _filename(name, extension):
+    return f"{name}-{timezone.localdate():%Y%m%d}.{extension}"
+
+
+def csv_response(rows, name):
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{_filename(name, "csv")}"'
+    return response
+
+
+def xlsx_response(rows, name):
+    """
+    XLSX via openpyxl's write-only mode, which writes each row out to disk as
+    it is appended; the saved workbook is served from a temporary file
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=name[:31])
+    for row in rows:
+        sheet.append(row)
+    # Deleted when the response closes it
+    spool = tempfile.TemporaryFile()
+    workbook.save(spool)
+    spool.seek(0)
+    response = FileResponse(
+        spool, as_attachment=True, filename=_filename(name, 'xlsx'),
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+    response.block_size = EXPORT_FILE_BLOCK_SIZE
+    return response
+
+
+def export_response(queryset, columns, name, export_format='csv'):
+    rows = export_rows(queryset, columns)
+    if export_format == 'xlsx':
+        if openpyxl is None:
+            return HttpResponse('XLSX export needs openpyxl installed.', status=501, content_type='text/plain')
+        return xlsx_response(rows, name)
+    return csv_response(rows, name)
@@ -0,0 +1,76 @@
+"""
+Batch fee information for the cashier front-end and SMS gateway.
+
+Students are looked up by id or admission number (username) and returned
+with their current-term ledger in one query. The ETag is built from a
+single aggregate over the same students and ledgers (their counts and
+latest updated_at; a student's moves forward when their name, admission
+number or grade changes too), so a client polling an unchanged batch gets
+a 304 without the rows being read.
+"""
+import hashlib
+
+from django.db.models import Count, FilteredRelation, Max, Q
+
+from students.models import Student
+
+MAX_BATCH_SIZE = 500
+
+FEE_INFO_FIELDS = (
+    'id', 'user__username', 'user__first_name', 'user__last_name', 'grade__name',
+    'ledger__total_required', 'ledger__payments_made', 'ledger__outstanding_balance',
+)
+
+
+def parse_student_keys(params):
+    """(ids, admission numbers) from repeated or comma separated query parameters"""
+    def values(name):
+        return {value.strip() for raw in params.getlist(name) for value in raw.split(',') if value.strip()}
+
+    ids = {int(value) for value in values('ids') if value.isdigit()}
+    return ids, values('admission_numbers')
+
+
+def _match(ids, admission_numbers):
+    return Q(id__in=ids) | Q(user__username__in=admission_numbers)
+
+
+def _with_ledger(students, academic_year, term):
+    return students.annotate(ledger=FilteredRelation(
+        'studentledger', condition=Q(studentledger__academic_year=academic_year, studentledger__term=term),
+    ))
+
+
+def fee_info_etag(ids, admission_numbers, academic_year, term):
+    """ETag for a batch, from one aggregate over the matched students and their ledgers"""
+    state = _with_ledger(Student.objects.filter(_match(ids, admission_numbers)), academic_year, term).aggregate(
+        students=Count('id'), students_changed=Max('updated_at'),
+        ledgers=Count('ledger__id'), ledgers_changed=Max('ledger__updated_at'),
+    )
+    key = ':'.join([
+        str(getattr(academic_year, 'pk', None)), str(getattr(term, 'pk', None)),
+        ','.join(str(value) for value in sorted(ids)), ','.join(sorted(admission_numbers)),
+        str(state['students']), str(state['ledgers']),
+        *(changed.isoformat() if changed else '' for changed in (state['students_changed'], state['ledgers_changed'])),
+    ])
+    return f'"{hashlib.md5(key.encode()).hexdigest()}"'
+
+
+def student_fee_info(ids, admission_numbers, academic_year, term):
+    """Fee info dicts for the matched students, in one query"""
+    rows = _with_ledger(
+        Student.objects.filter(_match(ids, admission_numbers)), academic_year, term
+    ).order_by('id').values_list(*FEE_INFO_FIELDS)
+
+    return [
+        {
+            'student_id': student_id,
+            'student_name': f'{first_name} {last_name}',
+            'admission_number': username,
+            'class': grade,
+            'total_required': str(total_required) if total_required is not None else '0',
+            'paid_amount': str(payments_made) if payments_made is not None else '0',
+            'outstanding': str(outstanding) if outstanding is not None else '0',
+        }
+        for student_id, username, first_name, last_name, grade, total_required, payments_made, outstanding in rows
+    ]
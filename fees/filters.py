@@ -0,0 +1,82 @@
+"""
+Filter sets shared by the fee list views and their exports.
+"""
+import hashlib
+import json
+from urllib.parse import urlencode
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.utils.dateparse import parse_date
+
+from .exchange import converted_totals
+from .models import Payment, StudentLedger
+from .summary import day_bounds
+
+TOTALS_CACHE_TIMEOUT = 60  # seconds
+
+PAYMENT_FILTERS = ('start_date', 'end_date', 'payment_method', 'recorded_by')
+ARREARS_FILTERS = ('grade', 'min_amount')
+
+
+def _filter_values(params, names):
+    return {name: params.get(name) for name in names if params.get(name)}
+
+
+def filter_querystring(params, names):
+    """Active filters as a query string, for building next/previous page links"""
+    return urlencode(_filter_values(params, names))
+
+
+def _parse_day(value):
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
+
+def filter_payments(params, queryset=None):
+    """Apply the payment_history filters in `params` (a QueryDict or dict)"""
+    payments = Payment.objects.all() if queryset is None else queryset
+    filters = _filter_values(params, PAYMENT_FILTERS)
+
+    # Date filters as ranges on payment_date so an index can serve them
+    start_date = _parse_day(filters.get('start_date'))
+    end_date = _parse_day(filters.get('end_date'))
+    if start_date:
+        payments = payments.filter(payment_date__gte=day_bounds(start_date)[0])
+    if end_date:
+        payments = payments.filter(payment_date__lt=day_bounds(end_date)[1])
+    if filters.get('payment_method', '').isdigit():
+        payments = payments.filter(payment_method_id=filters['payment_method'])
+    if filters.get('recorded_by', '').isdigit():
+        payments = payments.filter(recorded_by_id=filters['recorded_by'])
+    return payments
+
+
+def filter_arrears(params, academic_year, term, queryset=None):
+    """Apply the arrears_list filters in `params` to the term's ledgers"""
+    ledgers = StudentLedger.objects.all() if queryset is None else queryset
+    filters = _filter_values(params, ARREARS_FILTERS)
+    try:
+        min_amount = Decimal(filters.get('min_amount', '0'))
+    except InvalidOperation:
+        min_amount = Decimal('0')
+    ledgers = ledgers.filter(academic_year=academic_year, term=term, outstanding_balance__gt=min_amount)
+    if filters.get('grade', '').isdigit():
+        ledgers = ledgers.filter(student__grade_id=filters['grade'])
+    return ledgers
+
+
+def payment_totals(params):
+    """Sum (in the reporting currency) and count of the filtered payments in one query, cached per filter set"""
+    filters = _filter_values(params, PAYMENT_FILTERS)
+    digest = hashlib.md5(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+    key = f'fees:payment_totals:{digest}'
+    totals = cache.get(key)
+    if totals is None:
+        # In the reporting currency, at each payment's own date
+        total_amount, payment_count = converted_totals(filter_payments(params))
+        totals = {'total_amount': total_amount, 'payment_count': payment_count}
+        cache.set(key, totals, TOTALS_CACHE_TIMEOUT)
+    return totals
@@ -0,0 +1,32 @@
+from django import forms
+
+from .models import CURRENCY_CHOICES, PaymentMethod
+from .reconciliation import DEFAULT_WINDOW_DAYS
+
+
+class StatementImportForm(forms.Form):
+    statement = forms.FileField(help_text='CSV export with admission number, amount, date and reference columns')
+    payment_method = forms.ModelChoiceField(
+        queryset=PaymentMethod.objects.filter(is_active=True),
+        required=False,
+        help_text='Used for rows without a method column'
+    )
+    currency = forms.ChoiceField(
+        choices=[('', 'Reporting currency'), *CURRENCY_CHOICES],
+        required=False,
+        help_text='Used for rows without a currency column'
+    )
+    dry_run = forms.BooleanField(required=False, initial=True, help_text='Validate only, post nothing')
+
+
+class BankStatementForm(forms.Form):
+    statement = forms.FileField(help_text='CSV bank statement with date, amount and (ideally) reference columns')
+    window_days = forms.IntegerField(
+        min_value=0, max_value=31, initial=DEFAULT_WINDOW_DAYS,
+        help_text='How many days either side of a line a payment without a matching reference may fall'
+    )
+    bank_balance = forms.DecimalField(
+        max_digits=10, decimal_places=2, required=False,
+        help_text='Bank balance for the period (default: the statement total)'
+    )
+    dry_run = forms.BooleanField(required=False, initial=True, help_text='Match only, save nothing')
@@ -0,0 +1,308 @@
+"""
+Bulk payment statement import (bank and EcoCash CSV exports).
+
+Rows are validated up front, then posted in chunks. Each chunk runs in one
+transaction: ledgers for the current term are locked and created in bulk,
+Payment, Receipt and AuditLog rows go in with bulk_create, each affected
+ledger is written once with bulk_update, and the chunk's changes to the
+term summary (new ledgers, collections, ledgers paid off) are added to it
+with one UPDATE. Payments keep the statement's currency and are credited to
+ledgers in their fee currency at the payment date's rate.
+"""
+import csv
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from students.models import Student
+
+from .audit import audit_entry
+from .current import get_current_period
+from .exchange import ExchangeRateError, fee_currencies, fee_currency, in_ledger_currency, reporting_currency
+from .models import CURRENCY_CHOICES, AuditLog, Payment, PaymentMethod, Receipt, StudentLedger
+from .payment_plans import allocate_payments
+from .sequences import format_receipt_number, reserve_numbers
+from .statements import StatementImportError, parse_amount, parse_date, resolve_columns
+from .summary import add_ledger_changes, ledger_snapshot, record_term_deltas, term_deltas
+
+# Accepted header spellings for each statement column
+COLUMN_ALIASES = {
+    'student': ('admission_number', 'admission_no', 'student', 'username', 'email'),
+    'amount': ('amount', 'credit', 'paid_in'),
+    'reference': ('reference', 'reference_number', 'ref', 'transaction_id'),
+    'date': ('date', 'payment_date', 'transaction_date', 'value_date'),
+    'method': ('method', 'payment_method', 'channel'),
+    'currency': ('currency', 'currency_code', 'ccy'),
+    'notes': ('notes', 'description', 'narrative'),
+}
+CURRENCIES = {code for code, _ in CURRENCY_CHOICES}
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class ImportResult:
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.rows_read = 0
+        self.posted = 0
+        self.totals = {}  # {currency: amount}
+        self.errors = []  # (line number, message)
+
+    def add_error(self, line, message):
+        self.errors.append((line, message))
+
+    def __str__(self):
+        verb = 'Would post' if self.dry_run else 'Posted'
+        amounts = ', '.join(f'{currency} {amount}' for currency, amount in sorted(self.totals.items())) or 'nothing'
+        return f'{verb} {self.posted} of {self.rows_read} rows ({amounts}); {len(self.errors)} error(s)'
+
+
+def _parse_rows(rows, columns, default_method, default_currency, methods, result):
+    """Validate raw CSV rows; returns a list of clean row dicts"""
+    parsed = []
+    seen_references = set()
+    for line, row in rows:
+        result.rows_read += 1
+        student_key = (row.get(columns['student']) or '').strip()
+        if not student_key:
+            result.add_error(line, 'missing admission number')
+            continue
+        try:
+            amount = parse_amount(row.get(columns['amount']))
+        except ValueError as e:
+            result.add_error(line, str(e))
+            continue
+        if amount <= 0:
+            result.add_error(line, 'amount must be positive')
+            continue
+        try:
+            payment_date = parse_date(row.get(columns['date']) or '')
+        except ValueError as e:
+            result.add_error(line, str(e))
+            continue
+
+        method = default_method
+        if 'method' in columns and (row.get(columns['method']) or '').strip():
+            method = methods.get(row[columns['method']].strip().lower().replace(' ', '_'))
+            if method is None:
+                result.add_error(line, f"unknown payment method \"{row[columns['method']]}\"")
+                continue
+        if method is None:
+            result.add_error(line, 'no payment method given')
+            continue
+
+        currency = default_currency
+        if 'currency' in columns and (row.get(columns['currency']) or '').strip():
+            currency = row[columns['currency']].strip().upper()
+            if currency not in CURRENCIES:
+                result.add_error(line, f"unknown currency \"{row[columns['currency']]}\"")
+                continue
+
+        reference = (row.get(columns['reference']) or '').strip() if 'reference' in columns else ''
+        if method.requires_reference and not reference:
+            result.add_error(line, f'{method} payments need a reference')
+            continue
+        if reference:
+            if (method.id, reference) in seen_references:
+                result.add_error(line, f'duplicate reference "{reference}" in statement')
+                continue
+            seen_references.add((method.id, reference))
+
+        parsed.append({
+            'line': line,
+            'student_key': student_key,
+            'amount': amount.quantize(Decimal('0.01')),
+            'currency': currency,
+            'payment_date': payment_date,
+            'method': method,
+            'reference': reference,
+            'notes': (row.get(columns['notes']) or '').strip() if 'notes' in columns else '',
+        })
+    return parsed
+
+
+def _match_students(rows, result):
+    """Attach students (by username/email or id) with one query per chunk"""
+    keys = {row['student_key'] for row in rows}
+    numeric_ids = {int(key) for key in keys if key.isdigit()}
+    students = Student.objects.filter(
+        Q(user__username__in=keys) | Q(user__email__in=keys) | Q(id__in=numeric_ids)
+    ).select_related('user')
+    by_key = {}
+    for student in students:
+        by_key[student.user.username] = student
+        by_key[student.user.email] = student
+        by_key[str(student.id)] = student
+
+    matched = []
+    for row in rows:
+        student = by_key.get(row['student_key'])
+        if student is None:
+            result.add_error(row['line'], f"no student with admission number \"{row['student_key']}\"")
+            continue
+        row['student'] = student
+        matched.append(row)
+    return matched
+
+
+def _drop_existing_references(rows, result):
+    """Skip rows whose reference was already posted, so re-imports are safe"""
+    references = {row['reference'] for row in rows if row['reference']}
+    if not references:
+        return rows
+    existing = set(
+        Payment.objects.filter(reference_number__in=references).values_list('payment_method_id', 'reference_number')
+    )
+    fresh = []
+    for row in rows:
+        if (row['method'].id, row['reference']) in existing:
+            result.add_error(row['line'], f"reference \"{row['reference']}\" already posted")
+            continue
+        fresh.append(row)
+    return fresh
+
+
+def _post_chunk(rows, year, term, recorded_by):
+    now = timezone.now()
+    student_ids = {row['student'].id for row in rows}
+    fees_in = fee_currencies()
+    currencies = {
+        row['student'].id: fee_currency(fees_in, year.id, term.id, row['student'].grade_id) for row in rows
+    }
+
+    # Lock this term's ledgers for the affected students, creating any missing
+    ledgers = {
+        ledger.student_id: ledger
+        for ledger in StudentLedger.objects.select_for_update().filter(
+            student_id__in=student_ids, academic_year=year, term=term
+        )
+    }
+    before = {student_id: ledger_snapshot(ledger, currencies[student_id]) for student_id, ledger in ledgers.items()}
+    missing = student_ids - set(ledgers)
+    if missing:
+        StudentLedger.objects.bulk_create(
+            [StudentLedger(student_id=student_id, academic_year=year, term=term) for student_id in missing],
+            ignore_conflicts=True,
+        )
+        for ledger in StudentLedger.objects.select_for_update().filter(
+            student_id__in=missing, academic_year=year, term=term
+        ):
+            ledgers[ledger.student_id] = ledger
+
+    payments = Payment.objects.bulk_create([
+        Payment(
+            student=row['student'],
+            ledger=ledgers[row['student'].id],
+            amount=row['amount'],
+            currency=row['currency'],
+            payment_method=row['method'],
+            reference_number=row['reference'],
+            payment_date=row['payment_date'],
+            recorded_by=recorded_by,
+            notes=row['notes'],
+            status='verified',
+            verified_at=now,
+            verified_by=recorded_by,
+        )
+        for row in rows
+    ])
+
+    # Ledgers are credited in their fee currency, as record_payment does
+    credited = in_ledger_currency([
+        (payment.ledger_id, payment.amount, payment.currency, payment.payment_date) for payment in payments
+    ])
+
+    # Walk each ledger forward payment by payment for the receipt balances
+    first_number = reserve_numbers(now.year, len(payments))
+    receipts = []
+    for offset, (payment, credit) in enumerate(zip(payments, credited)):
+        ledger = ledgers[payment.student_id]
+        previous_balance = ledger.opening_balance + ledger.term_fees + ledger.adjustments - ledger.payments_made
+        ledger.payments_made += credit
+        if ledger.last_payment_date is None or payment.payment_date > ledger.last_payment_date:
+            ledger.last_payment_date = payment.payment_date
+        receipts.append(Receipt(
+            payment=payment,
+            receipt_number=format_receipt_number(now.year, first_number + offset),
+            generated_by=recorded_by,
+            amount_paid=payment.amount,
+            previous_balance=previous_balance,
+            new_balance=previous_balance - credit,
+        ))
+    Receipt.objects.bulk_create(receipts)
+    allocate_payments(payments, credited=credited)
+
+    for ledger in ledgers.values():
+        ledger.total_required = ledger.opening_balance + ledger.term_fees + ledger.adjustments
+        ledger.outstanding_balance = ledger.total_required - ledger.payments_made
+        ledger.updated_at = now
+    StudentLedger.objects.bulk_update(
+        list(ledgers.values()),
+        ['payments_made', 'total_required', 'outstanding_balance', 'last_payment_date', 'updated_at'],
+    )
+
+    AuditLog.objects.bulk_create([
+        audit_entry(
+            user=recorded_by,
+            action_type='payment_recorded',
+            description=f"Statement payment of {payment.currency} {payment.amount} recorded for {payment.student} (ref {payment.reference_number or 'n/a'})",
+            student=payment.student,
+            amount=payment.amount,
+        )
+        for payment in payments
+    ])
+
+    # bulk_create/bulk_update skip the per-row summary deltas
+    deltas = add_ledger_changes(term_deltas(), (
+        (before.get(student_id), ledger_snapshot(ledger, currencies[student_id])) for student_id, ledger in ledgers.items()
+    ))
+    today = timezone.localdate()
+    for payment, credit in zip(payments, credited):
+        deltas[(year.id, term.id, currencies[payment.student_id])].update(
+            collected=credit,
+            today_amount=credit if timezone.localdate(payment.payment_date) == today else Decimal('0.00'),
+        )
+    record_term_deltas(deltas)
+
+
+def import_statement(csv_file, recorded_by, payment_method=None, currency=None, dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Import a CSV statement (a text file object) and return an ImportResult.
+    Rows without a currency column are in `currency` (default
+    REPORTING_CURRENCY). Rows with errors are reported and skipped; valid
+    rows are still posted.
+    """
+    year, term = get_current_period()
+    if year is None or term is None:
+        raise StatementImportError('Set a current academic year and term before importing payments.')
+
+    reader = csv.DictReader(csv_file)
+    columns = resolve_columns(reader.fieldnames, COLUMN_ALIASES, required=('student', 'amount', 'date'))
+    methods = {method.name: method for method in PaymentMethod.objects.filter(is_active=True)}
+    result = ImportResult(dry_run=dry_run)
+
+    # Header is line 1
+    rows = _parse_rows(
+        ((index + 2, row) for index, row in enumerate(reader)), columns, payment_method,
+        currency or reporting_currency(), methods, result,
+    )
+
+    for start in range(0, len(rows), chunk_size):
+        chunk = _drop_existing_references(_match_students(rows[start:start + chunk_size], result), result)
+        if not chunk:
+            continue
+        if not dry_run:
+            try:
+                with transaction.atomic():
+                    _post_chunk(chunk, year, term, recorded_by)
+            except ExchangeRateError as e:
+                for row in chunk:
+                    result.add_error(row['line'], str(e))
+                continue
+        result.posted += len(chunk)
+        for row in chunk:
+            result.totals[row['currency']] = result.totals.get(row['currency'], Decimal('0.00')) + row['amount']
+
+    result.errors.sort()
+    return result
@@ -0,0 +1,148 @@
+"""
+Ledger verification and repair.
+
+StudentLedger.payments_made and the balances derived from it are running
+totals, bumped in Python as payments are recorded. verify_ledgers()
+recomputes them from Payment with a single GROUP BY over the verified
+payments (per ledger, currency and day, so payments made in another
+currency are converted at their own day's rate into the ledger's fee
+currency) and a second over the approved refunds, diffs them against the
+stored values and, with repair=True, writes the corrected rows back with
+bulk_update and rebuilds the affected term summaries.
+
+verify_ledgers_in_parallel() splits the checking by grade across forked
+worker processes, which only read. The ledgers they report are then
+re-checked and repaired together under lock in the parent, so concurrent
+payments are not overwritten with stale totals and the workers never
+contend for write locks.
+"""
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.db.models import Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .exchange import get_rate_table, ledger_currencies
+from .models import Payment, Refund, StudentLedger
+from .summary import REFUNDED_STATUSES, rebuild_summaries
+
+LEDGER_FIELDS = ('payments_made', 'total_required', 'outstanding_balance', 'last_payment_date')
+UPDATE_BATCH_SIZE = 1000
+ZERO = Decimal('0.00')
+
+
+def _ledgers(grade_ids=None, academic_year_id=None, term_id=None, ledger_ids=None):
+    ledgers = StudentLedger.objects.all()
+    if ledger_ids is not None:
+        ledgers = ledgers.filter(id__in=ledger_ids)
+    if grade_ids is not None:
+        ledgers = ledgers.filter(student__grade_id__in=grade_ids)
+    if academic_year_id is not None:
+        ledgers = ledgers.filter(academic_year_id=academic_year_id)
+    if term_id is not None:
+        ledgers = ledgers.filter(term_id=term_id)
+    return ledgers
+
+
+def compute_ledger_payments(ledgers):
+    """
+    {ledger_id: (payments_made, last_payment_date)} from verified payments,
+    in each ledger's currency, less the refunds approved against it
+    """
+    ledger_currency = ledger_currencies(ledgers)
+    groups = Payment.objects.filter(status='verified', ledger__in=ledgers).annotate(
+        day=TruncDate('payment_date')
+    ).values_list('ledger_id', 'currency', 'day').annotate(
+        total=Sum('amount'), latest=Max('payment_date')
+    ).order_by()
+
+    paid = defaultdict(lambda: ZERO)
+    latest = {}
+    table = None
+    for ledger_id, currency, day, total, last in groups:
+        target = ledger_currency.get(ledger_id, currency)
+        if currency != target:
+            table = table or get_rate_table()
+            total = table.convert(total, currency, target, day)
+        paid[ledger_id] += total
+        if ledger_id not in latest or last > latest[ledger_id]:
+            latest[ledger_id] = last
+    for ledger_id, refunded in Refund.objects.filter(
+        status__in=REFUNDED_STATUSES, ledger__in=ledgers
+    ).values_list('ledger_id').annotate(total=Sum('amount')).order_by():
+        paid[ledger_id] -= refunded
+    return {ledger_id: (paid[ledger_id], latest.get(ledger_id)) for ledger_id in ledger_currency}
+
+
+def verify_ledgers(grade_ids=None, academic_year_id=None, term_id=None, repair=False, ledger_ids=None):
+    """
+    Recompute ledger payments and balances and return the drift as a list of
+    (ledger_id, field, stored, actual). With repair=True the drifted ledgers
+    are corrected and their terms' summaries rebuilt.
+    """
+    ledgers = _ledgers(grade_ids, academic_year_id, term_id, ledger_ids)
+    with transaction.atomic():
+        if repair:
+            ledgers = ledgers.select_for_update(of=('self',))
+        actual = compute_ledger_payments(ledgers)
+        drift = []
+        repaired = []
+        stored = ledgers.only(
+            'id', 'academic_year_id', 'term_id', 'opening_balance', 'term_fees', 'adjustments', *LEDGER_FIELDS
+        )
+        for ledger in stored:
+            payments_made, last_payment_date = actual.get(ledger.id, (ZERO, None))
+            total_required = ledger.opening_balance + ledger.term_fees + ledger.adjustments
+            values = {
+                'payments_made': payments_made,
+                'total_required': total_required,
+                'outstanding_balance': total_required - payments_made,
+                'last_payment_date': last_payment_date,
+            }
+            changed = [field for field in LEDGER_FIELDS if getattr(ledger, field) != values[field]]
+            if not changed:
+                continue
+            drift.extend((ledger.id, field, getattr(ledger, field), values[field]) for field in changed)
+            for field, value in values.items():
+                setattr(ledger, field, value)
+            repaired.append(ledger)
+
+        if repair and repaired:
+            now = timezone.now()
+            for ledger in repaired:
+                ledger.updated_at = now
+            StudentLedger.objects.bulk_update(repaired, [*LEDGER_FIELDS, 'updated_at'], batch_size=UPDATE_BATCH_SIZE)
+            # bulk_update skips the per-row summary deltas
+            for year_id, term_id in {(ledger.academic_year_id, ledger.term_id) for ledger in repaired}:
+                rebuild_summaries(academic_year_id=year_id, term_id=term_id)
+    return drift
+
+
+def _verify_grade(grade_id, academic_year_id, term_id):
+    try:
+        return verify_ledgers([grade_id], academic_year_id, term_id)
+    finally:
+        connections.close_all()
+
+
+def verify_ledgers_in_parallel(workers, academic_year_id=None, term_id=None, repair=False):
+    """verify_ledgers() with each grade's ledgers checked in one of `workers` forked processes"""
+    grade_ids = sorted(set(
+        _ledgers(None, academic_year_id, term_id).values_list('student__grade_id', flat=True).distinct()
+    ))
+    # Children must open their own connections, not share the parent's
+    connections.close_all()
+    drift = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        for grade_drift in pool.map(
+            _verify_grade, grade_ids, [academic_year_id] * len(grade_ids), [term_id] * len(grade_ids)
+        ):
+            drift.extend(grade_drift)
+
+    if repair and drift:
+        drift = verify_ledgers(repair=True, ledger_ids={ledger_id for ledger_id, *_ in drift})
+    return drift
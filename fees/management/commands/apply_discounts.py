@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fees.current import get_current_period
+from fees.discounts import price_ledgers
+from fees.models import Term
+
+
+class Command(BaseCommand):
+    help = "Reprice term ledgers from the fee structures and students' active discounts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--term', type=int, help='Term id to reprice (default: the current term)')
+        parser.add_argument('--student', type=int, action='append', help='Only reprice this student id (repeatable)')
+        parser.add_argument('--all', action='store_true', help='Reprice every ledger in the term, not just discounted ones')
+
+    def handle(self, *args, **options):
+        if options['term']:
+            term = Term.objects.select_related('academic_year').filter(pk=options['term']).first()
+        else:
+            term = get_current_period()[1]
+        if term is None:
+            raise CommandError('No term to reprice; pass --term.')
+
+        changed = price_ledgers(
+            term.academic_year, term, student_ids=options['student'], all_ledgers=options['all']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Repriced {changed} ledger(s) for {term}.'))
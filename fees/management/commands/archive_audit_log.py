@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fees.audit import archive_audit_log
+
+
+class Command(BaseCommand):
+    help = 'Move closed months of the audit log into monthly archive tables (run monthly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before', help='Archive every month before this one, YYYY-MM (default: AUDIT_LOG_LIVE_MONTHS ago)'
+        )
+
+    def handle(self, *args, **options):
+        before = None
+        if options['before']:
+            try:
+                before = datetime.strptime(options['before'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError(f"Invalid --before \"{options['before']}\"; use YYYY-MM.")
+
+        moved = archive_audit_log(before=before)
+        for month, count in moved.items():
+            self.stdout.write(f'{month:%B %Y}: {count} entries archived')
+        self.stdout.write(self.style.SUCCESS(f'Archived {sum(moved.values())} audit entries from {len(moved)} month(s).'))
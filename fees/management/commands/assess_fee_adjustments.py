@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from fees.adjustments import assess_fee_adjustments
+from fees.current import get_current_period
+from fees.models import Term
+
+
+class Command(BaseCommand):
+    help = 'Charge late-payment penalties and credit early-payment discounts past each payment deadline (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--term', type=int, help='Term id to assess (default: the current term)')
+        parser.add_argument('--date', help='Assess as of this date, YYYY-MM-DD (default: today)')
+
+    def handle(self, *args, **options):
+        if options['term']:
+            term = Term.objects.select_related('academic_year').filter(pk=options['term']).first()
+        else:
+            term = get_current_period()[1]
+        if term is None:
+            raise CommandError('No term to assess; pass --term.')
+
+        today = None
+        if options['date']:
+            today = parse_date(options['date'])
+            if today is None:
+                raise CommandError(f"Invalid --date \"{options['date']}\"; use YYYY-MM-DD.")
+
+        result = assess_fee_adjustments(term.academic_year, term, today=today)
+        self.stdout.write(self.style.SUCCESS(
+            f"{term}: {result['penalised']} ledger(s) penalised, {result['credited']} credited for early payment."
+        ))
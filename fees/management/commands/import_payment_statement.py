@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from fees.imports import DEFAULT_CHUNK_SIZE, StatementImportError, import_statement
+from fees.models import CURRENCY_CHOICES, PaymentMethod
+
+
+class Command(BaseCommand):
+    help = 'Import payments from a bank or EcoCash CSV statement'
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help='Path to the CSV statement')
+        parser.add_argument('--recorded-by', required=True, help='Email of the staff user posting the payments')
+        parser.add_argument('--method', help='Payment method for rows without a method column, e.g. ecocash')
+        parser.add_argument('--currency', choices=[code for code, _ in CURRENCY_CHOICES], help='Currency of rows without a currency column (default: the reporting currency)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows posted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and report without posting anything')
+
+    def handle(self, *args, **options):
+        try:
+            recorded_by = User.objects.get(email=options['recorded_by'], is_staff=True)
+        except User.DoesNotExist:
+            raise CommandError(f"No staff user with email {options['recorded_by']}")
+
+        payment_method = None
+        if options['method']:
+            try:
+                payment_method = PaymentMethod.objects.get(name=options['method'])
+            except PaymentMethod.DoesNotExist:
+                raise CommandError(f"Unknown payment method {options['method']}")
+
+        try:
+            with open(options['statement'], newline='', encoding='utf-8-sig') as statement:
+                result = import_statement(
+                    statement, recorded_by,
+                    payment_method=payment_method,
+                    currency=options['currency'],
+                    dry_run=options['dry_run'],
+                    chunk_size=options['chunk_size'],
+                )
+        except (OSError, StatementImportError) as e:
+            raise CommandError(str(e))
+
+        for line, message in result.errors:
+            self.stdout.write(self.style.WARNING(f'Line {line}: {message}'))
+        style = self.style.WARNING if result.errors else self.style.SUCCESS
+        self.stdout.write(style(str(result)))
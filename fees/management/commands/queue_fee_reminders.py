@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from fees.current import get_current_period
+from fees.reminders import REMINDER_SUBJECTS, queue_reminders
+
+
+class Command(BaseCommand):
+    help = 'Queue fee reminders for ledgers that are due soon, overdue or due a final notice'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', dest='reminder_type', choices=sorted(REMINDER_SUBJECTS), action='append',
+                            help='Reminder type to queue (repeatable; default: all)')
+        parser.add_argument('--user', help='Email of the staff user the reminders are sent on behalf of')
+
+    def handle(self, *args, **options):
+        year, term = get_current_period()
+        if year is None or term is None:
+            raise CommandError('Set a current academic year and term first.')
+
+        sent_by = None
+        if options['user']:
+            sent_by = User.objects.filter(email=options['user']).first()
+            if sent_by is None:
+                raise CommandError(f"No user with email {options['user']}")
+
+        for reminder_type in options['reminder_type'] or list(REMINDER_SUBJECTS):
+            queued = queue_reminders(reminder_type, year, term, sent_by=sent_by)
+            self.stdout.write(self.style.SUCCESS(f'Queued {queued} {reminder_type} reminder(s).'))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fees.models import AcademicYear, Term
+from fees.summary import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuild term collection summaries from ledgers and payments and report any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', help='Academic year name to rebuild (default: all)')
+        parser.add_argument('--term', help='Term name to rebuild, e.g. term1 (default: all)')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
+
+    def handle(self, *args, **options):
+        years = {year.id: year.name for year in AcademicYear.objects.all()}
+        terms = {term.id: term.name for term in Term.objects.all()}
+
+        academic_year_id = term_id = None
+        if options['year']:
+            try:
+                academic_year_id = AcademicYear.objects.get(name=options['year']).id
+            except AcademicYear.DoesNotExist:
+                raise CommandError(f"No academic year named {options['year']}.")
+        if options['term']:
+            matches = Term.objects.filter(name=options['term'])
+            if options['year']:
+                matches = matches.filter(academic_year__name=options['year'])
+            if matches.count() != 1:
+                raise CommandError(f"Can't pick a single {options['term']}; pass --year as well.")
+            term_id = matches.get().id
+
+        drift = rebuild_summaries(academic_year_id, term_id, dry_run=options['dry_run'])
+
+        for (year_key, term_key, currency), field, stored, actual in drift:
+            label = f'{terms.get(term_key)} {years.get(year_key)} ({currency})'
+            if field is None:
+                self.stdout.write(self.style.WARNING(f'{label}: summary row missing'))
+            else:
+                self.stdout.write(self.style.WARNING(f'{label}: {field} stored {stored}, actual {actual}'))
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} drifted value(s) found; rerun without --dry-run to repair.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(drift)} drifted value(s).'))
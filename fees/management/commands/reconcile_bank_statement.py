@@ -0,0 +1,50 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from fees.reconciliation import DEFAULT_WINDOW_DAYS, reconcile_statement
+from fees.statements import StatementImportError
+
+
+class Command(BaseCommand):
+    help = 'Match a CSV bank statement against verified payments and save the reconciliation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help='Path to the CSV statement')
+        parser.add_argument('--reconciled-by', required=True, help='Email of the staff user doing the reconciliation')
+        parser.add_argument('--window-days', type=int, default=DEFAULT_WINDOW_DAYS, help='Date window for matching by amount')
+        parser.add_argument('--bank-balance', help='Bank balance for the period (default: the statement total)')
+        parser.add_argument('--dry-run', action='store_true', help='Match and report without saving anything')
+
+    def handle(self, *args, **options):
+        try:
+            reconciled_by = User.objects.get(email=options['reconciled_by'], is_staff=True)
+        except User.DoesNotExist:
+            raise CommandError(f"No staff user with email {options['reconciled_by']}")
+
+        bank_balance = None
+        if options['bank_balance']:
+            try:
+                bank_balance = Decimal(options['bank_balance'])
+            except InvalidOperation:
+                raise CommandError(f"Invalid --bank-balance {options['bank_balance']}")
+
+        try:
+            with open(options['statement'], newline='', encoding='utf-8-sig') as statement:
+                report = reconcile_statement(
+                    statement, reconciled_by,
+                    window_days=options['window_days'],
+                    bank_balance=bank_balance,
+                    dry_run=options['dry_run'],
+                )
+        except (OSError, StatementImportError) as e:
+            raise CommandError(str(e))
+
+        for line in report.ambiguous:
+            candidates = ', '.join(str(payment_id) for payment_id in line.candidates)
+            self.stdout.write(self.style.WARNING(f'Line {line.line_number}: ambiguous, payments {candidates}'))
+        for line in report.unmatched:
+            self.stdout.write(self.style.WARNING(f'Line {line.line_number}: no matching payment'))
+        style = self.style.WARNING if report.ambiguous or report.unmatched else self.style.SUCCESS
+        self.stdout.write(style(str(report)))
@@ -0,0 +1,46 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from fees.models import Receipt
+from fees.receipts import receipt_data, receipt_pdf_name, render_receipt_pdf
+
+
+class Command(BaseCommand):
+    help = 'Pre-render PDFs for receipts that do not have one yet, using a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Rendering processes (default: one per core)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Receipts loaded and saved per batch')
+        parser.add_argument('--all', action='store_true', help='Re-render receipts that already have a PDF')
+
+    def handle(self, *args, **options):
+        receipts = Receipt.objects.all()
+        if not options['all']:
+            receipts = receipts.filter(Q(pdf_file='') | Q(pdf_file__isnull=True))
+        pending_ids = list(receipts.order_by('id').values_list('id', flat=True))
+        if not pending_ids:
+            self.stdout.write(self.style.SUCCESS('All receipts already have PDFs.'))
+            return
+
+        storage = Receipt._meta.get_field('pdf_file').storage
+        batch_size = options['batch_size']
+        rendered = 0
+
+        # Workers only turn plain dicts into bytes and never touch the
+        # database; loading and saving stays in this process
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for start in range(0, len(pending_ids), batch_size):
+                batch = list(receipt_data(Receipt.objects.filter(id__in=pending_ids[start:start + batch_size])))
+                updates = []
+                for data, pdf in zip(batch, pool.map(render_receipt_pdf, batch, chunksize=25)):
+                    name = storage.save(receipt_pdf_name(data['receipt_number']), ContentFile(pdf))
+                    updates.append(Receipt(id=data['id'], pdf_file=name))
+                Receipt.objects.bulk_update(updates, ['pdf_file'])
+                rendered += len(updates)
+                self.stdout.write(f'Rendered {rendered}/{len(pending_ids)}')
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} receipt PDF(s).'))
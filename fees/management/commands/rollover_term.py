@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fees.models import Term
+from fees.rollover import DEFAULT_BATCH_SIZE, make_current, next_term_after, rollover_term
+
+
+class Command(BaseCommand):
+    help = "Open the next term's ledgers for all students, carrying arrears forward"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-term', type=int, help='Term id to roll over from (default: the current term)')
+        parser.add_argument('--to-term', type=int, help='Term id to open (default: the next term by start date)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Students per insert batch')
+        parser.add_argument('--make-current', action='store_true', help='Flag the new term and its year as current afterwards')
+
+    def handle(self, *args, **options):
+        terms = Term.objects.select_related('academic_year')
+        if options['from_term']:
+            from_term = terms.filter(pk=options['from_term']).first()
+        else:
+            from_term = terms.filter(is_current=True).first()
+        if from_term is None:
+            raise CommandError('No term to roll over from; pass --from-term.')
+
+        to_term = terms.filter(pk=options['to_term']).first() if options['to_term'] else next_term_after(from_term)
+        if to_term is None:
+            raise CommandError(f'No term after {from_term}; create it first or pass --to-term.')
+
+        self.stdout.write(f'Rolling over {from_term} -> {to_term}')
+        try:
+            result = rollover_term(
+                from_term, to_term,
+                batch_size=options['batch_size'],
+                progress=lambda created: self.stdout.write(f'  {created} ledgers created'),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['make_current']:
+            make_current(to_term)
+            self.stdout.write(f'{to_term} is now the current term')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']} ledger(s), assessed {result['assessed']} existing ledger(s)."
+        ))
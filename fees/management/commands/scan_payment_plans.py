@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from fees.payment_plans import scan_delinquent_plans
+
+
+class Command(BaseCommand):
+    help = 'Mark overdue payment plan installments and default their plans (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Scan as of this date, YYYY-MM-DD (default: today)')
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            today = parse_date(options['date'])
+            if today is None:
+                raise CommandError(f"Invalid --date \"{options['date']}\"; use YYYY-MM-DD.")
+
+        result = scan_delinquent_plans(today=today)
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['overdue']} installment(s) marked overdue, {result['defaulted']} plan(s) defaulted."
+        ))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fees.reminders import DEFAULT_BATCH_SIZE, send_pending_reminders
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued fee reminders by email and SMS; run one or more of these as workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Reminders claimed per batch')
+        parser.add_argument('--poll', type=int, default=0,
+                            help='Keep running, checking the queue every POLL seconds (default: drain once and exit)')
+
+    def handle(self, *args, **options):
+        while True:
+            counts = send_pending_reminders(batch_size=options['batch_size'])
+            if any(counts.values()):
+                self.stdout.write(self.style.SUCCESS(
+                    f"Sent {counts['sent']}, {counts['retrying']} to retry, {counts['failed']} failed."
+                ))
+            if not options['poll']:
+                break
+            time.sleep(options['poll'])
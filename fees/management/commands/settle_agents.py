@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from accounts.models import User
+from fees.settlements import settle_agents
+
+
+class Command(BaseCommand):
+    help = "Settle agents' verified collections for a period (default: last calendar month)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--settled-by', required=True, help='Email of the staff user running the settlement')
+        parser.add_argument('--from', dest='period_start', help='First day of the period, YYYY-MM-DD')
+        parser.add_argument('--to', dest='period_end', help='Last day of the period, YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        try:
+            settled_by = User.objects.get(email=options['settled_by'], is_staff=True)
+        except User.DoesNotExist:
+            raise CommandError(f"No staff user with email {options['settled_by']}")
+
+        last_month_end = timezone.localdate().replace(day=1) - timedelta(days=1)
+        period_start = parse_date(options['period_start']) if options['period_start'] else last_month_end.replace(day=1)
+        period_end = parse_date(options['period_end']) if options['period_end'] else last_month_end
+        if period_start is None or period_end is None or period_start > period_end:
+            raise CommandError('Give --from and --to as YYYY-MM-DD, with --from on or before --to.')
+
+        settlements = settle_agents(settled_by, period_start, period_end)
+        for settlement in settlements:
+            self.stdout.write(
+                f'{settlement.agent_name}: {settlement.payment_count} collection(s), '
+                f'${settlement.total_collected} collected, ${settlement.total_commission} commission, '
+                f'${settlement.net_payable} net'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Settled {len(settlements)} agent(s) for {period_start} to {period_end}.'
+        ))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fees.ledgers import verify_ledgers, verify_ledgers_in_parallel
+from fees.models import AcademicYear, Term
+
+
+class Command(BaseCommand):
+    help = 'Recompute ledger payments and balances from verified payments, report drift and optionally repair it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', help='Academic year name to check (default: all)')
+        parser.add_argument('--term', help='Term name to check, e.g. term1 (default: all)')
+        parser.add_argument('--grade', type=int, action='append', help='Grade id to check; repeat for several (default: all)')
+        parser.add_argument('--repair', action='store_true', help='Write the recomputed values back')
+        parser.add_argument('--workers', type=int, default=1, help='Check grades in this many parallel processes')
+
+    def handle(self, *args, **options):
+        academic_year_id = term_id = None
+        if options['year']:
+            academic_year_id = AcademicYear.objects.filter(name=options['year']).values_list('id', flat=True).first()
+            if academic_year_id is None:
+                raise CommandError(f"No academic year named {options['year']}.")
+        if options['term']:
+            matches = Term.objects.filter(name=options['term'])
+            if options['year']:
+                matches = matches.filter(academic_year__name=options['year'])
+            if matches.count() != 1:
+                raise CommandError(f"Can't pick a single {options['term']}; pass --year as well.")
+            term_id = matches.get().id
+        if options['workers'] > 1 and options['grade']:
+            raise CommandError('--workers splits the work by grade itself; drop --grade.')
+
+        if options['workers'] > 1:
+            drift = verify_ledgers_in_parallel(options['workers'], academic_year_id, term_id, repair=options['repair'])
+        else:
+            drift = verify_ledgers(options['grade'], academic_year_id, term_id, repair=options['repair'])
+
+        for ledger_id, field, stored, actual in drift:
+            self.stdout.write(self.style.WARNING(f'Ledger {ledger_id}: {field} stored {stored}, actual {actual}'))
+        ledger_count = len({ledger_id for ledger_id, *_ in drift})
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('All ledgers match their payments.'))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(drift)} value(s) on {ledger_count} ledger(s).'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'{len(drift)} drifted value(s) on {ledger_count} ledger(s); rerun with --repair to fix.'
+            ))
@@ -0,0 +1,24 @@
+from .audit import audit_batch
+from .current import get_current_period
+
+
+class CurrentTermMiddleware:
+    """Set request.current_year and request.current_term from the cached current period"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.current_year, request.current_term = get_current_period()
+        return self.get_response(request)
+
+
+class AuditMiddleware:
+    """Buffer the request's audit entries and write them with one bulk_create at the end"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with audit_batch(request):
+            return self.get_response(request)
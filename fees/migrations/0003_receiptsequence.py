@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:36
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    """Start each year's sequence after the highest receipt already issued"""
+    Receipt = apps.get_model('fees', 'Receipt')
+    ReceiptSequence = apps.get_model('fees', 'ReceiptSequence')
+    last_numbers = {}
+    for receipt_number in Receipt.objects.filter(receipt_number__startswith='RCP-').values_list('receipt_number', flat=True).iterator():
+        try:
+            _, year, number = receipt_number.split('-')
+            year, number = int(year), int(number)
+        except ValueError:
+            continue
+        last_numbers[year] = max(number, last_numbers.get(year, 0))
+    ReceiptSequence.objects.bulk_create([
+        ReceiptSequence(year=year, last_number=number)
+        for year, number in last_numbers.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0002_academicyear_feecomponent_paymentmethod_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceiptSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(unique=True)),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0003_receiptsequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TermCollectionSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_expected', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_collected', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_outstanding', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('ledger_count', models.PositiveIntegerField(default=0)),
+                ('fully_paid_count', models.PositiveIntegerField(default=0)),
+                ('todays_collections', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('collections_date', models.DateField(blank=True, null=True)),
+                ('rebuilt_at', models.DateTimeField(blank=True, null=True)),
+                ('academic_year', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='fees.academicyear')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='fees.term')),
+            ],
+            options={
+                'unique_together': {('academic_year', 'term')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0004_termcollectionsummary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='term',
+            name='name',
+            field=models.CharField(choices=[('term1', 'Term 1'), ('term2', 'Term 2'), ('term3', 'Term 3')], max_length=10),
+        ),
+        migrations.AlterUniqueTogether(
+            name='term',
+            unique_together={('name', 'academic_year')},
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0005_term_unique_per_year'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'payment_date'], name='payment_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['student', '-payment_date'], name='payment_student_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['payment_date', 'id'], name='payment_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['reference_number'], name='payment_reference_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentledger',
+            index=models.Index(fields=['academic_year', 'term', 'outstanding_balance'], name='ledger_term_balance_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0006_fee_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentledger',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
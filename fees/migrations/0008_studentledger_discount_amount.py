@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0007_studentledger_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentledger',
+            name='discount_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0008_studentledger_discount_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentledger',
+            name='adjustments',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='FeeAdjustment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('late_penalty', 'Late Payment Penalty'), ('early_payment', 'Early Payment Discount')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('assessed_at', models.DateTimeField()),
+                ('ledger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fee_adjustments', to='fees.studentledger')),
+            ],
+            options={
+                'unique_together': {('ledger', 'kind')},
+            },
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def close_existing_reminders(apps, schema_editor):
+    """Reminders from before delivery tracking are history, not a send queue"""
+    FeeReminder = apps.get_model('fees', 'FeeReminder')
+    FeeReminder.objects.update(status='done', email_status='skipped', sms_status='skipped')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fees', '0009_fee_adjustments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feereminder',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='feereminder',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='feereminder',
+            name='email_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='feereminder',
+            name='email_to',
+            field=models.EmailField(blank=True, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='feereminder',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='feereminder',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='feereminder',
+            name='sms_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='feereminder',
+            name='sms_to',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='feereminder',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('done', 'Done')], default='queued', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='feereminder',
+            name='subject',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='feereminder',
+            name='sent_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='feereminder',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='reminder_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feereminder',
+            index=models.Index(fields=['student', 'reminder_type', 'sent_at'], name='reminder_student_type_idx'),
+        ),
+        migrations.RunPython(close_existing_reminders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0010_fee_reminder_delivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BankStatementLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.PositiveIntegerField()),
+                ('date', models.DateTimeField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('matched', 'Matched'), ('ambiguous', 'Ambiguous'), ('unmatched', 'Unmatched')], max_length=10)),
+                ('match_type', models.CharField(blank=True, choices=[('reference', 'Reference'), ('amount_date', 'Amount and date')], max_length=12)),
+                ('candidates', models.CharField(blank=True, max_length=255)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bank_lines', to='fees.payment')),
+                ('reconciliation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='fees.bankreconciliation')),
+            ],
+            options={
+                'ordering': ['reconciliation', 'line_number'],
+            },
+        ),
+    ]
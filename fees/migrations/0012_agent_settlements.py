@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fees', '0011_bank_statement_lines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgentSettlement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('agent_name', models.CharField(max_length=100)),
+                ('agent_phone', models.CharField(max_length=20)),
+                ('period_start', models.DateField()),
+                ('period_end', models.DateField()),
+                ('payment_count', models.PositiveIntegerField(default=0)),
+                ('total_collected', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_commission', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('net_payable', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('settled_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='action_type',
+            field=models.CharField(choices=[('payment_recorded', 'Payment Recorded'), ('payment_verified', 'Payment Verified'), ('receipt_generated', 'Receipt Generated'), ('discount_applied', 'Discount Applied'), ('refund_processed', 'Refund Processed'), ('ledger_edited', 'Ledger Edited'), ('fee_structure_changed', 'Fee Structure Changed'), ('agent_settled', 'Agent Settled')], max_length=25),
+        ),
+        migrations.AddIndex(
+            model_name='agentpayment',
+            index=models.Index(fields=['status', 'collected_at'], name='agentpayment_status_idx'),
+        ),
+        migrations.AddField(
+            model_name='agentsettlement',
+            name='settled_by',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='agentpayment',
+            name='settlement',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='payments', to='fees.agentsettlement'),
+        ),
+        migrations.AddIndex(
+            model_name='agentsettlement',
+            index=models.Index(fields=['agent_name', 'agent_phone', 'settled_at'], name='settlement_agent_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:13
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def payments_in_fee_currency(apps, schema_editor):
+    """Existing payments were made in the currency their term's fees were set in"""
+    FeeStructure = apps.get_model('fees', 'FeeStructure')
+    Payment = apps.get_model('fees', 'Payment')
+    currency = FeeStructure.objects.filter(
+        academic_year=OuterRef('ledger__academic_year'), term=OuterRef('ledger__term'),
+        grade=OuterRef('student__grade'), is_day_scholar=True,
+    ).exclude(currency='USD').values('currency')[:1]
+    rows = Payment.objects.filter(ledger__isnull=False).annotate(fee_currency=Subquery(currency)).filter(
+        fee_currency__isnull=False
+    ).values_list('id', 'fee_currency')
+    by_currency = {}
+    for payment_id, fee_currency in rows:
+        by_currency.setdefault(fee_currency, []).append(payment_id)
+    for fee_currency, ids in by_currency.items():
+        Payment.objects.filter(id__in=ids).update(currency=fee_currency)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0012_agent_settlements'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='currency',
+            field=models.CharField(choices=[('USD', 'USD'), ('ZWL', 'ZWL'), ('ZAR', 'ZAR')], default='USD', max_length=3),
+        ),
+        migrations.RunPython(payments_in_fee_currency, migrations.RunPython.noop),
+    ]
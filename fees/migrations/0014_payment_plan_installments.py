@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fees', '0013_payment_currency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentplan',
+            name='approved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='paymentplan',
+            name='approved_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='approved_payment_plans', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='paymentplan',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending Approval'), ('active', 'Active'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('defaulted', 'Defaulted')], default='active', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='PaymentPlanInstallment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('due_date', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('amount_paid', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('partial', 'Partially Paid'), ('paid', 'Paid'), ('overdue', 'Overdue')], default='pending', max_length=10)),
+                ('paid_at', models.DateTimeField(blank=True, null=True)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='installments', to='fees.paymentplan')),
+            ],
+            options={
+                'ordering': ['plan', 'number'],
+                'indexes': [models.Index(fields=['due_date', 'status'], name='installment_due_status_idx')],
+                'unique_together': {('plan', 'number')},
+            },
+        ),
+    ]
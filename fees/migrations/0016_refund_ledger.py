@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0015_audit_log_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refund',
+            name='approved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='ledger',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='fees.studentledger'),
+        ),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='action_type',
+            field=models.CharField(choices=[('payment_recorded', 'Payment Recorded'), ('payment_verified', 'Payment Verified'), ('payment_rejected', 'Payment Rejected'), ('receipt_generated', 'Receipt Generated'), ('discount_applied', 'Discount Applied'), ('refund_approved', 'Refund Approved'), ('refund_rejected', 'Refund Rejected'), ('refund_processed', 'Refund Processed'), ('ledger_edited', 'Ledger Edited'), ('fee_structure_changed', 'Fee Structure Changed'), ('agent_settled', 'Agent Settled')], max_length=25),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:07
+
+from django.db import migrations, models
+
+
+def drop_summaries(apps, schema_editor):
+    """Existing rows mix every fee currency; get_term_summaries() rebuilds them per currency"""
+    apps.get_model('fees', 'TermCollectionSummary').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0016_refund_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_summaries, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='termcollectionsummary',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='termcollectionsummary',
+            name='currency',
+            field=models.CharField(choices=[('USD', 'USD'), ('ZWL', 'ZWL'), ('ZAR', 'ZAR')], default='USD', max_length=3),
+        ),
+        migrations.AlterUniqueTogether(
+            name='termcollectionsummary',
+            unique_together={('academic_year', 'term', 'currency')},
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 from decimal import Decimal
@@ -20,12 +20,15 @@ class Term(models.Model):
         ('term2', 'Term 2'),
         ('term3', 'Term 3'),
     ]
-    name = models.CharField(max_length=10, choices=TERM_CHOICES, unique=True)
+    name = models.CharField(max_length=10, choices=TERM_CHOICES)
     academic_year = models.ForeignKey(AcademicYear, on_delete=models.CASCADE)
     start_date = models.DateField()
     end_date = models.DateField()
     is_current = models.BooleanField(default=False)
 
+    class Meta:
+        unique_together = ['name', 'academic_year']
+
     def __str__(self):
         return f"{self.name} - {self.academic_year.name}"
 
@@ -54,12 +57,14 @@ class FeeComponent(models.Model):
     def __str__(self):
         return self.get_name_display()
 
+CURRENCY_CHOICES = [('USD', 'USD'), ('ZWL', 'ZWL'), ('ZAR', 'ZAR')]
+
 class FeeStructure(models.Model):
     """Comprehensive fee structure per grade and term"""
     academic_year = models.ForeignKey(AcademicYear, on_delete=models.CASCADE, null=True, blank=True)
     term = models.ForeignKey(Term, on_delete=models.CASCADE, null=True, blank=True)
     grade = models.ForeignKey('classes.Grade', on_delete=models.CASCADE)
-    currency = models.CharField(max_length=3, default='USD', choices=[('USD', 'USD'), ('ZWL', 'ZWL'), ('ZAR', 'ZAR')])
+    currency = models.CharField(max_length=3, default='USD', choices=CURRENCY_CHOICES)
 
     # Fee components
     tuition_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -109,7 +114,9 @@ class StudentLedger(models.Model):
 
     # Balances
     opening_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Arrears from previous term
-    term_fees = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    term_fees = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Net of discount_amount
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    adjustments = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Late penalties less early-payment credits
     total_required = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     payments_made = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     outstanding_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -118,19 +125,69 @@ class StudentLedger(models.Model):
     last_payment_date = models.DateTimeField(null=True, blank=True)
     flagged_for_followup = models.BooleanField(default=False)
     notes = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
 
     class Meta:
         unique_together = ['student', 'academic_year', 'term']
+        indexes = [
+            # Arrears lists, dashboard counts and exports for a term
+            models.Index(fields=['academic_year', 'term', 'outstanding_balance'], name='ledger_term_balance_idx'),
+        ]
 
     def update_balances(self):
-        self.total_required = self.opening_balance + self.term_fees
+        self.total_required = self.opening_balance + self.term_fees + self.adjustments
         self.outstanding_balance = self.total_required - self.payments_made
         self.save()
 
+    def save(self, *args, **kwargs):
+        from .summary import record_ledger_change, stored_ledger_snapshot
+        with transaction.atomic():
+            before = stored_ledger_snapshot(self.pk) if self.pk else None
+            super().save(*args, **kwargs)
+            record_ledger_change(before, stored_ledger_snapshot(self.pk))
+
+    def delete(self, *args, **kwargs):
+        from .summary import record_ledger_change, record_ledger_payments_removed, stored_ledger_snapshot
+        with transaction.atomic():
+            before = stored_ledger_snapshot(self.pk)
+            record_ledger_payments_removed(self)
+            result = super().delete(*args, **kwargs)
+            record_ledger_change(before, None)
+        return result
+
     def __str__(self):
         return f"{self.student} - {self.term.name} {self.academic_year.name}"
 
+class TermCollectionSummary(models.Model):
+    """Running collection totals per academic year, term and fee currency (see fees.summary)"""
+    academic_year = models.ForeignKey(AcademicYear, on_delete=models.CASCADE)
+    term = models.ForeignKey(Term, on_delete=models.CASCADE)
+    currency = models.CharField(max_length=3, default='USD', choices=CURRENCY_CHOICES)
+
+    total_expected = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_collected = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_outstanding = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    ledger_count = models.PositiveIntegerField(default=0)
+    fully_paid_count = models.PositiveIntegerField(default=0)
+
+    # Verified collections on collections_date; stale once the day rolls over
+    todays_collections = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    collections_date = models.DateField(null=True, blank=True)
+
+    rebuilt_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['academic_year', 'term', 'currency']
+
+    def collections_today(self):
+        if self.collections_date != timezone.localdate():
+            return Decimal('0.00')
+        return self.todays_collections
+
+    def __str__(self):
+        return f"{self.term.name} {self.academic_year.name} {self.currency} summary"
+
 class PaymentMethod(models.Model):
     """Available payment methods"""
     METHOD_CHOICES = [
@@ -157,6 +214,7 @@ class Payment(models.Model):
     student = models.ForeignKey('students.Student', on_delete=models.CASCADE)
     ledger = models.ForeignKey(StudentLedger, on_delete=models.CASCADE, null=True, blank=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default='USD', choices=CURRENCY_CHOICES)
     payment_method = models.ForeignKey(PaymentMethod, on_delete=models.CASCADE)
     reference_number = models.CharField(max_length=100, blank=True)
     payment_date = models.DateTimeField(default=timezone.now)
@@ -177,6 +235,29 @@ class Payment(models.Model):
     verified_at = models.DateTimeField(null=True, blank=True)
     verified_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='verified_payments', null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'payment_date'], name='payment_status_date_idx'),
+            models.Index(fields=['student', '-payment_date'], name='payment_student_date_idx'),
+            # Payment history keyset pages: ORDER BY payment_date, id
+            models.Index(fields=['payment_date', 'id'], name='payment_date_id_idx'),
+            models.Index(fields=['reference_number'], name='payment_reference_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        from .summary import payment_snapshot, record_payment_change, stored_payment_snapshot
+        with transaction.atomic():
+            before = stored_payment_snapshot(self.pk) if self.pk else None
+            super().save(*args, **kwargs)
+            record_payment_change(before, payment_snapshot(self))
+
+    def delete(self, *args, **kwargs):
+        from .summary import record_payment_change, stored_payment_snapshot
+        with transaction.atomic():
+            before = stored_payment_snapshot(self.pk)
+            result = super().delete(*args, **kwargs)
+            record_payment_change(before, None)
+        return result
 
     def __str__(self):
         return f"{self.student} - {self.amount} - {self.payment_method} - {self.status}"
@@ -197,21 +278,25 @@ class Receipt(models.Model):
     pdf_file = models.FileField(upload_to='receipts/', blank=True, null=True)
 
     def save(self, *args, **kwargs):
-        if not self.receipt_number:
-            # Generate receipt number: RCP-YYYY-NNNNNN
-            year = timezone.now().year
-            last_receipt = Receipt.objects.filter(receipt_number__startswith=f'RCP-{year}').order_by('-receipt_number').first()
-            if last_receipt:
-                last_num = int(last_receipt.receipt_number.split('-')[-1])
-                new_num = last_num + 1
-            else:
-                new_num = 1
-            self.receipt_number = f'RCP-{year}-{new_num:06d}'
-        super().save(*args, **kwargs)
+        # Number allocation and insert share one transaction so a failed
+        # insert hands its number back (see fees.sequences)
+        with transaction.atomic():
+            if not self.receipt_number:
+                from .sequences import next_receipt_number
+                self.receipt_number = next_receipt_number()
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return self.receipt_number
 
+class ReceiptSequence(models.Model):
+    """Per-year counter behind RCP-YYYY-NNNNNN receipt numbers"""
+    year = models.PositiveIntegerField(unique=True)
+    last_number = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"RCP-{self.year}: {self.last_number}"
+
 class FeeReminder(models.Model):
     """Automated reminders for fee payments"""
     REMINDER_TYPES = [
@@ -220,14 +305,43 @@ class FeeReminder(models.Model):
         ('final_notice', 'Final Notice'),
         ('receipt_confirmation', 'Receipt Confirmation'),
     ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('done', 'Done'),
+    ]
+    DELIVERY_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('skipped', 'Skipped'),
+    ]
 
     student = models.ForeignKey('students.Student', on_delete=models.CASCADE)
     reminder_type = models.CharField(max_length=20, choices=REMINDER_TYPES)
+    subject = models.CharField(max_length=200, blank=True)
     message = models.TextField()
     sent_via_sms = models.BooleanField(default=False)
     sent_via_email = models.BooleanField(default=False)
     sent_at = models.DateTimeField(auto_now_add=True)
-    sent_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    sent_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+
+    # Delivery tracking (see fees/reminders.py)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    email_to = models.EmailField(blank=True)
+    email_status = models.CharField(max_length=10, choices=DELIVERY_CHOICES, default='pending')
+    sms_to = models.CharField(max_length=20, blank=True)
+    sms_status = models.CharField(max_length=10, choices=DELIVERY_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='reminder_queue_idx'),
+            models.Index(fields=['student', 'reminder_type', 'sent_at'], name='reminder_student_type_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student} - {self.reminder_type} - {self.sent_at.date()}"
@@ -255,6 +369,25 @@ class Discount(models.Model):
     def __str__(self):
         return f"{self.student} - {self.discount_type} - {self.percentage}%"
 
+class FeeAdjustment(models.Model):
+    """Late-payment penalty or early-payment credit, at most one of each per ledger"""
+    KINDS = [
+        ('late_penalty', 'Late Payment Penalty'),
+        ('early_payment', 'Early Payment Discount'),
+    ]
+
+    ledger = models.ForeignKey(StudentLedger, on_delete=models.CASCADE, related_name='fee_adjustments')
+    kind = models.CharField(max_length=20, choices=KINDS)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)  # Positive for penalties, negative for credits
+    percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    assessed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['ledger', 'kind']
+
+    def __str__(self):
+        return f"{self.ledger.student} - {self.get_kind_display()} - {self.amount}"
+
 class PaymentPlan(models.Model):
     """Installment payment plans"""
     student = models.ForeignKey('students.Student', on_delete=models.CASCADE)
@@ -266,6 +399,7 @@ class PaymentPlan(models.Model):
     end_date = models.DateField()
 
     STATUS_CHOICES = [
+        ('pending', 'Pending Approval'),
         ('active', 'Active'),
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled'),
@@ -275,13 +409,44 @@ class PaymentPlan(models.Model):
 
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    approved_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, related_name='approved_payment_plans', null=True, blank=True)
+    approved_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.student} - {self.number_of_installments} installments - {self.status}"
 
+class PaymentPlanInstallment(models.Model):
+    """One scheduled installment of an approved payment plan"""
+    plan = models.ForeignKey(PaymentPlan, on_delete=models.CASCADE, related_name='installments')
+    number = models.PositiveIntegerField()
+    due_date = models.DateField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    amount_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('partial', 'Partially Paid'),
+        ('paid', 'Paid'),
+        ('overdue', 'Overdue'),
+    ]
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    paid_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['plan', 'number']
+        ordering = ['plan', 'number']
+        indexes = [
+            # Delinquency scan: due_date < cutoff AND status IN (unpaid)
+            models.Index(fields=['due_date', 'status'], name='installment_due_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.plan.student} - installment {self.number} due {self.due_date} - {self.status}"
+
 class Refund(models.Model):
     """Fee refunds and credits"""
     student = models.ForeignKey('students.Student', on_delete=models.CASCADE)
+    ledger = models.ForeignKey(StudentLedger, on_delete=models.SET_NULL, null=True, blank=True)  # Debited on approval
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     reason = models.TextField()
     refund_method = models.ForeignKey(PaymentMethod, on_delete=models.CASCADE)
@@ -296,6 +461,7 @@ class Refund(models.Model):
 
     requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='requested_refunds')
     approved_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='approved_refunds')
+    approved_at = models.DateTimeField(null=True, blank=True)
     processed_at = models.DateTimeField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
@@ -308,11 +474,15 @@ class AuditLog(models.Model):
     ACTION_TYPES = [
         ('payment_recorded', 'Payment Recorded'),
         ('payment_verified', 'Payment Verified'),
+        ('payment_rejected', 'Payment Rejected'),
         ('receipt_generated', 'Receipt Generated'),
         ('discount_applied', 'Discount Applied'),
+        ('refund_approved', 'Refund Approved'),
+        ('refund_rejected', 'Refund Rejected'),
         ('refund_processed', 'Refund Processed'),
         ('ledger_edited', 'Ledger Edited'),
         ('fee_structure_changed', 'Fee Structure Changed'),
+        ('agent_settled', 'Agent Settled'),
     ]
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -325,9 +495,28 @@ class AuditLog(models.Model):
 
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp'], name='auditlog_timestamp_idx'),
+            models.Index(fields=['student', 'timestamp'], name='auditlog_student_time_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user} - {self.action_type} - {self.timestamp}"
 
+class AuditLogArchive(models.Model):
+    """A month of audit entries moved out of AuditLog into its own table"""
+    month = models.DateField(unique=True)  # First day of the month
+    table_name = models.CharField(max_length=63)
+    row_count = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-month']
+
+    def __str__(self):
+        return f"Audit log {self.month:%B %Y} ({self.row_count} entries in {self.table_name})"
+
 class ExchangeRate(models.Model):
     """Currency exchange rates"""
     from_currency = models.CharField(max_length=3)
@@ -355,6 +544,35 @@ class BankReconciliation(models.Model):
     def __str__(self):
         return f"Bank Reconciliation - {self.date}"
 
+class BankStatementLine(models.Model):
+    """One line of an imported bank statement and what it was matched to"""
+    STATUS_CHOICES = [
+        ('matched', 'Matched'),
+        ('ambiguous', 'Ambiguous'),
+        ('unmatched', 'Unmatched'),
+    ]
+    MATCH_TYPES = [
+        ('reference', 'Reference'),
+        ('amount_date', 'Amount and date'),
+    ]
+
+    reconciliation = models.ForeignKey(BankReconciliation, on_delete=models.CASCADE, related_name='lines')
+    line_number = models.PositiveIntegerField()
+    date = models.DateTimeField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    reference = models.CharField(max_length=100, blank=True)
+    description = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    match_type = models.CharField(max_length=12, choices=MATCH_TYPES, blank=True)
+    payment = models.ForeignKey('Payment', on_delete=models.SET_NULL, null=True, blank=True, related_name='bank_lines')
+    candidates = models.CharField(max_length=255, blank=True)  # Payment ids, for ambiguous lines
+
+    class Meta:
+        ordering = ['reconciliation', 'line_number']
+
+    def __str__(self):
+        return f"Line {self.line_number}: {self.amount} {self.reference} ({self.status})"
+
 class AgentPayment(models.Model):
     """Mobile money agent payments"""
     agent_name = models.CharField(max_length=100)
@@ -374,6 +592,12 @@ class AgentPayment(models.Model):
 
     commission_rate = models.DecimalField(max_digits=5, decimal_places=2, default=5.0)  # percentage
     commission_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    settlement = models.ForeignKey('AgentSettlement', on_delete=models.PROTECT, null=True, blank=True, related_name='payments')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'collected_at'], name='agentpayment_status_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         self.commission_amount = (self.amount * self.commission_rate) / 100
@@ -381,3 +605,24 @@ class AgentPayment(models.Model):
 
     def __str__(self):
         return f"{self.agent_name} - {self.student} - ${self.amount}"
+
+class AgentSettlement(models.Model):
+    """One agent's verified collections for a period, paid out together"""
+    agent_name = models.CharField(max_length=100)
+    agent_phone = models.CharField(max_length=20)
+    period_start = models.DateField()
+    period_end = models.DateField()
+    payment_count = models.PositiveIntegerField(default=0)
+    total_collected = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_commission = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    net_payable = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # Collected less commission
+    settled_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    settled_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['agent_name', 'agent_phone', 'settled_at'], name='settlement_agent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.agent_name} {self.period_start} to {self.period_end} - ${self.net_payable}"
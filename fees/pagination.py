@@ -0,0 +1,108 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by the sort key of the row at their edge instead of an
+OFFSET, so every page is one indexed range scan and no COUNT is needed.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def _encode(values, direction):
+    payload = json.dumps({'d': direction, 'k': [str(value) for value in values]})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode(cursor, fields):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction, raw = payload['d'], payload['k']
+        if direction not in ('next', 'prev') or len(raw) != len(fields):
+            return None, None
+        return direction, [field.to_python(value) for field, value in zip(fields, raw)]
+    except (ValueError, KeyError, TypeError, ValidationError):
+        return None, None
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginate `queryset` on `ordering`, e.g. ('-payment_date', '-id'). The
+    last field must be unique so the key identifies exactly one row.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+        self.names = [name.lstrip('-') for name in ordering]
+        self.fields = [queryset.model._meta.get_field(name) for name in self.names]
+
+    def _after(self, values, reverse=False):
+        """Q for rows strictly after `values` in the ordering (or before, if reverse)"""
+        condition = Q()
+        for index in range(len(self.ordering) - 1, -1, -1):
+            descending = self.ordering[index].startswith('-') != reverse
+            lookup = f"{self.names[index]}__{'lt' if descending else 'gt'}"
+            step = Q(**{lookup: values[index]})
+            if index < len(self.ordering) - 1:
+                step |= Q(**{self.names[index]: values[index]}) & condition
+            condition = step
+        # Redundant bound on the leading column so the planner can turn the
+        # OR into a single index range scan
+        descending = self.ordering[0].startswith('-') != reverse
+        leading = Q(**{f"{self.names[0]}__{'lte' if descending else 'gte'}": values[0]})
+        return leading & condition
+
+    def _key(self, obj):
+        return [getattr(obj, field.attname) for field in self.fields]
+
+    def page_queryset(self, cursor=None):
+        """The (sliced) query a page runs, and the cursor direction it came from"""
+        direction, values = _decode(cursor, self.fields) if cursor else (None, None)
+        if direction == 'prev':
+            reversed_ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+            queryset = self.queryset.filter(self._after(values, reverse=True)).order_by(*reversed_ordering)
+        else:
+            queryset = self.queryset.order_by(*self.ordering)
+            if direction == 'next':
+                queryset = queryset.filter(self._after(values))
+        return queryset[:self.per_page + 1], direction
+
+    def get_page(self, cursor=None):
+        queryset, direction = self.page_queryset(cursor)
+        rows = list(queryset)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if direction == 'prev':
+            rows.reverse()
+            previous_cursor = _encode(self._key(rows[0]), 'prev') if rows and has_more else None
+            next_cursor = _encode(self._key(rows[-1]), 'next') if rows else None
+            return KeysetPage(rows, next_cursor, previous_cursor)
+
+        next_cursor = _encode(self._key(rows[-1]), 'next') if rows and has_more else None
+        previous_cursor = _encode(self._key(rows[0]), 'prev') if rows and direction == 'next' else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
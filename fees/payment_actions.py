@@ -0,0 +1,258 @@
+"""
+Set-based bulk actions on payments and refunds, behind the admin actions.
+
+Each action runs in one transaction with a fixed number of queries however
+many rows are selected: one locked SELECT of the rows that change, one
+UPDATE of their status, one UPDATE per LEDGER_BATCH_SIZE ledgers adding
+each ledger's aggregated amount to its stored totals (with F() expressions,
+so concurrent payments are not overwritten), bulk_create for any missing
+receipts and for the audit rows, and one UPDATE per affected term summary
+adding the term's share of the change (see _post).
+
+Amounts are posted to a ledger in the currency its fees are set in, as
+record_payment does, converting at the payment date's rate.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DateTimeField, DecimalField, Exists, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .audit import audit_entry
+from .current import get_current_period
+from .exchange import fee_currency_expression, in_ledger_currency
+from .models import AuditLog, Payment, Receipt, Refund, StudentLedger
+from .payment_plans import allocate_payments, reallocate_payments
+from .sequences import format_receipt_number, reserve_numbers
+from .summary import record_term_deltas, term_deltas
+
+LEDGER_BATCH_SIZE = 500
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+ZERO = Decimal('0.00')
+
+
+def _shift_ledgers(amounts, now, latest_payments=None):
+    """
+    Add {ledger_id: amount} to payments_made and take it off
+    outstanding_balance; move last_payment_date forward to
+    latest_payments[ledger_id] where that is later
+    """
+    ledger_ids = sorted(amounts)
+    for start in range(0, len(ledger_ids), LEDGER_BATCH_SIZE):
+        batch = ledger_ids[start:start + LEDGER_BATCH_SIZE]
+        amount = Case(*(When(pk=ledger_id, then=Value(amounts[ledger_id])) for ledger_id in batch), output_field=MONEY)
+        updates = {
+            'payments_made': F('payments_made') + amount,
+            'outstanding_balance': F('outstanding_balance') - amount,
+            'updated_at': now,
+        }
+        if latest_payments:
+            updates['last_payment_date'] = Case(
+                *(
+                    When(pk=ledger_id, then=Greatest(
+                        Coalesce('last_payment_date', Value(latest_payments[ledger_id])), Value(latest_payments[ledger_id])
+                    ))
+                    for ledger_id in batch if ledger_id in latest_payments
+                ),
+                default=F('last_payment_date'),
+                output_field=DateTimeField(),
+            )
+        StudentLedger.objects.filter(pk__in=batch).update(**updates)
+
+
+def _ledger_totals(ledger_ids, amounts, sign=1):
+    """{ledger_id: signed total of amounts}"""
+    totals = defaultdict(lambda: ZERO)
+    for ledger_id, amount in zip(ledger_ids, amounts):
+        if ledger_id is not None:
+            totals[ledger_id] += sign * amount
+    return dict(totals)
+
+
+def _post(amounts, now, latest_payments=None, todays=None):
+    """
+    _shift_ledgers(), then add each term's share to its collection summary:
+    the amount collected, the ledgers paid off or reopened, and the part
+    collected today (todays, {ledger_id: amount}). Set-based updates skip the
+    per-row summary deltas. Returns {ledger_id: outstanding_balance} as it
+    was before.
+    """
+    todays = todays or {}
+    balances = {}
+    deltas = term_deltas()
+    for ledger_id, year_id, term_id, currency, balance in StudentLedger.objects.filter(id__in=amounts).annotate(
+        currency=fee_currency_expression()
+    ).values_list('id', 'academic_year_id', 'term_id', 'currency', 'outstanding_balance'):
+        balances[ledger_id] = balance
+        deltas[(year_id, term_id, currency)].update(
+            collected=amounts[ledger_id],
+            fully_paid=int(balance - amounts[ledger_id] <= 0) - int(balance <= 0),
+            today_amount=todays.get(ledger_id, ZERO),
+        )
+    _shift_ledgers(amounts, now, latest_payments)
+    record_term_deltas(deltas)
+    return balances
+
+
+def _todays(rows, converted, sign=1):
+    """{ledger_id: signed total of the converted amounts paid today}"""
+    today = timezone.localdate()
+    return _ledger_totals(
+        [row[2] for row in rows],
+        [amount if timezone.localdate(row[5]) == today else ZERO for row, amount in zip(rows, converted)],
+        sign,
+    )
+
+
+def verify_payments(payments, verified_by):
+    """
+    Verify the unverified payments in `payments`: credit their ledgers, issue
+    any missing receipts, allocate them to payment plans and audit them.
+    Returns how many were verified.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            payments.exclude(status='verified').select_for_update(of=('self',)).annotate(
+                has_receipt=Exists(Receipt.objects.filter(payment=OuterRef('pk')))
+            ).values_list('id', 'student_id', 'ledger_id', 'amount', 'currency', 'payment_date', 'has_receipt')
+            .order_by('payment_date', 'id')
+        )
+        if not rows:
+            return 0
+        Payment.objects.filter(id__in=[row[0] for row in rows]).update(
+            status='verified', verified_at=now, verified_by=verified_by
+        )
+
+        ledger_ids = [row[2] for row in rows]
+        converted = in_ledger_currency([(ledger_id, amount, currency, date) for _, _, ledger_id, amount, currency, date, _ in rows])
+        credits = _ledger_totals(ledger_ids, converted)
+        latest = {}
+        for _, _, ledger_id, _, _, payment_date, _ in rows:
+            if ledger_id is not None:
+                latest[ledger_id] = max(latest.get(ledger_id, payment_date), payment_date)
+        balances = _post(credits, now, latest, _todays(rows, converted))
+
+        # Receipts for payments recorded without one, walking each ledger's
+        # balance forward payment by payment
+        receipts = []
+        for row, credited in zip(rows, converted):
+            payment_id, _, ledger_id, amount, _, _, has_receipt = row
+            previous_balance = balances.get(ledger_id, ZERO)
+            balances[ledger_id] = previous_balance - (credited or ZERO)
+            if not has_receipt:
+                receipts.append(Receipt(
+                    payment_id=payment_id, generated_by=verified_by, amount_paid=amount,
+                    previous_balance=previous_balance, new_balance=balances[ledger_id],
+                ))
+        if receipts:
+            first_number = reserve_numbers(now.year, len(receipts))
+            for offset, receipt in enumerate(receipts):
+                receipt.receipt_number = format_receipt_number(now.year, first_number + offset)
+            Receipt.objects.bulk_create(receipts)
+
+        AuditLog.objects.bulk_create([
+            audit_entry(
+                verified_by, 'payment_verified', f'Payment of {currency} {amount} verified',
+                student_id=student_id, amount=amount,
+            )
+            for _, student_id, _, amount, currency, _, _ in rows
+        ])
+        allocate_payments([
+            Payment(id=payment_id, student_id=student_id, amount=amount, status='verified', payment_date=payment_date)
+            for payment_id, student_id, _, amount, _, payment_date, _ in rows
+        ], credited=converted)
+    return len(rows)
+
+
+def reject_payments(payments, rejected_by):
+    """
+    Mark the payments in `payments` failed, taking any that were verified
+    back off their ledgers and their students' payment plans. Returns how
+    many were rejected.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            payments.exclude(status='failed').select_for_update(of=('self',))
+            .values_list('id', 'student_id', 'ledger_id', 'amount', 'currency', 'payment_date', 'status')
+        )
+        if not rows:
+            return 0
+        Payment.objects.filter(id__in=[row[0] for row in rows]).update(status='failed')
+
+        reversed_rows = [row for row in rows if row[6] == 'verified']
+        converted = in_ledger_currency(
+            [(ledger_id, amount, currency, date) for _, _, ledger_id, amount, currency, date, _ in reversed_rows]
+        )
+        debits = _ledger_totals([row[2] for row in reversed_rows], converted, sign=-1)
+        _post(debits, now, todays=_todays(reversed_rows, converted, sign=-1))
+        # Plans the reversed payments went towards are paid by what remains
+        reallocate_payments({row[1] for row in reversed_rows})
+        AuditLog.objects.bulk_create([
+            audit_entry(
+                rejected_by, 'payment_rejected', f'Payment of {currency} {amount} rejected (was {status})',
+                student_id=student_id, amount=amount,
+            )
+            for _, student_id, _, amount, currency, _, status in rows
+        ])
+    return len(rows)
+
+
+def approve_refunds(refunds, approved_by):
+    """
+    Approve the pending refunds in `refunds`, debiting each from the
+    student's current-term ledger. Returns how many were approved.
+    """
+    now = timezone.now()
+    year, term = get_current_period()
+    with transaction.atomic():
+        rows = list(
+            refunds.filter(status='pending').select_for_update(of=('self',)).values_list('id', 'student_id', 'amount')
+        )
+        if not rows:
+            return 0
+        current_ledger = StudentLedger.objects.filter(
+            student=OuterRef('student'), academic_year=year, term=term
+        ).values('id')[:1]
+        approved = Refund.objects.filter(id__in=[row[0] for row in rows])
+        approved.update(status='approved', approved_by=approved_by, approved_at=now, ledger=Subquery(current_ledger))
+
+        debits = defaultdict(lambda: ZERO)
+        for ledger_id, amount in approved.filter(ledger__isnull=False).values_list('ledger_id', 'amount'):
+            debits[ledger_id] -= amount
+        _post(debits, now)
+        AuditLog.objects.bulk_create([
+            audit_entry(approved_by, 'refund_approved', f'Refund of ${amount} approved', student_id=student_id, amount=amount)
+            for _, student_id, amount in rows
+        ])
+    return len(rows)
+
+
+def reject_refunds(refunds, rejected_by):
+    """
+    Reject the pending or approved refunds in `refunds`, crediting approved
+    ones back to their ledgers. Returns how many were rejected.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            refunds.filter(status__in=('pending', 'approved')).select_for_update(of=('self',))
+            .values_list('id', 'student_id', 'ledger_id', 'amount', 'status')
+        )
+        if not rows:
+            return 0
+        Refund.objects.filter(id__in=[row[0] for row in rows]).update(status='rejected')
+
+        credits = defaultdict(lambda: ZERO)
+        for _, _, ledger_id, amount, status in rows:
+            if status == 'approved' and ledger_id is not None:
+                credits[ledger_id] += amount
+        _post(credits, now)
+        AuditLog.objects.bulk_create([
+            audit_entry(rejected_by, 'refund_rejected', f'Refund of ${amount} rejected', student_id=student_id, amount=amount)
+            for _, student_id, _, amount, _ in rows
+        ])
+    return len(rows)
@@ -0,0 +1,194 @@
+"""
+Payment plan schedules, allocation and delinquency.
+
+A plan requested by a parent waits as 'pending' until a bursar approves it;
+approve_plans() then writes one PaymentPlanInstallment per month from the
+start date, the last installment taking any rounding remainder.
+
+allocate_payments() applies incoming payments to their students' open
+installments, earliest due first, loading every affected installment in one
+query and writing them back with one bulk update. Plans are set in the
+ledger's fee currency, so each payment counts for the amount credited to
+its ledger, not its face value.
+
+reallocate_payments() recomputes a student's plans from scratch when
+payments they were paid with are reversed.
+
+scan_delinquent_plans() is the daily job. It marks unpaid installments more
+than PAYMENT_PLAN_GRACE_DAYS past due as overdue with one UPDATE served by
+the (due_date, status) index, then defaults every active plan with an
+overdue installment with a second; no plan is loaded into Python.
+"""
+import calendar
+from collections import defaultdict
+from datetime import timedelta
+from decimal import ROUND_DOWN, Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .exchange import in_ledger_currency
+from .models import Payment, PaymentPlan, PaymentPlanInstallment
+
+CENT = Decimal('0.01')
+OPEN_STATUSES = ('pending', 'partial', 'overdue')
+PLAN_OPEN_STATUSES = ('active', 'defaulted')
+
+
+def add_months(day, months):
+    """`day` moved forward by calendar months, clamped to the end of shorter months"""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def installment_schedule(total_amount, number_of_installments, start_date):
+    """[(due_date, amount)], monthly from start_date; the amounts add up to total_amount"""
+    base = (total_amount / number_of_installments).quantize(CENT, rounding=ROUND_DOWN)
+    last = total_amount - base * (number_of_installments - 1)
+    return [
+        (add_months(start_date, number), last if number == number_of_installments - 1 else base)
+        for number in range(number_of_installments)
+    ]
+
+
+def approve_plans(plans, approved_by, today=None):
+    """
+    Approve the pending plans in `plans` and generate their installments.
+    A plan whose start date has passed starts from `today`. Returns how many
+    were approved.
+    """
+    today = today or timezone.localdate()
+    now = timezone.now()
+    with transaction.atomic():
+        pending = list(plans.filter(status='pending').select_for_update())
+        installments = []
+        for plan in pending:
+            plan.start_date = max(plan.start_date, today)
+            schedule = installment_schedule(plan.total_amount, plan.number_of_installments, plan.start_date)
+            installments.extend(
+                PaymentPlanInstallment(plan=plan, number=number, due_date=due_date, amount=amount)
+                for number, (due_date, amount) in enumerate(schedule, start=1)
+            )
+            plan.installment_amount = schedule[0][1]
+            plan.end_date = schedule[-1][0]
+            plan.status, plan.approved_by, plan.approved_at = 'active', approved_by, now
+        PaymentPlanInstallment.objects.bulk_create(installments)
+        PaymentPlan.objects.bulk_update(
+            pending, ['start_date', 'installment_amount', 'end_date', 'status', 'approved_by', 'approved_at']
+        )
+    return len(pending)
+
+
+def allocate_payments(payments, credited=None):
+    """
+    Apply verified `payments` (Payment objects) to their students' open
+    installments, earliest due first. `credited` lists the amounts the
+    payments were credited to their ledgers with, in the same order; by
+    default they are converted here. A plan whose installments are all paid
+    is completed. Returns the amount allocated.
+    """
+    payments = list(payments)
+    if credited is None:
+        credited = in_ledger_currency([(p.ledger_id, p.amount, p.currency, p.payment_date) for p in payments])
+    # A payment with no ledger counts at face value
+    payments = sorted(
+        ((p, p.amount if amount is None else amount) for p, amount in zip(payments, credited) if p.status == 'verified'),
+        key=lambda pair: (pair[0].payment_date, pair[0].pk or 0),
+    )
+    if not payments:
+        return Decimal('0.00')
+    now = timezone.now()
+    with transaction.atomic():
+        open_installments = defaultdict(list)
+        for installment in PaymentPlanInstallment.objects.select_for_update(of=('self',)).filter(
+            plan__student_id__in={payment.student_id for payment, _ in payments},
+            plan__status__in=PLAN_OPEN_STATUSES,
+            status__in=OPEN_STATUSES,
+        ).annotate(student_id=F('plan__student_id')).order_by('due_date', 'plan_id', 'number'):
+            open_installments[installment.student_id].append(installment)
+        changed = {}
+        allocated = Decimal('0.00')
+        for payment, remaining in payments:
+            queue = open_installments.get(payment.student_id, [])
+            while remaining > 0 and queue:
+                installment = queue[0]
+                share = min(remaining, installment.amount - installment.amount_paid)
+                installment.amount_paid += share
+                remaining -= share
+                allocated += share
+                if installment.amount_paid >= installment.amount:
+                    installment.status, installment.paid_at = 'paid', now
+                    queue.pop(0)
+                elif installment.status == 'pending':
+                    installment.status = 'partial'
+                changed[installment.pk] = installment
+        PaymentPlanInstallment.objects.bulk_update(changed.values(), ['amount_paid', 'status', 'paid_at'])
+
+        still_open = PaymentPlanInstallment.objects.filter(plan=OuterRef('pk')).exclude(status='paid')
+        PaymentPlan.objects.filter(
+            id__in={installment.plan_id for installment in changed.values()}, status__in=PLAN_OPEN_STATUSES
+        ).filter(~Exists(still_open)).update(status='completed')
+    return allocated
+
+
+def reallocate_payments(student_ids, today=None):
+    """
+    Clear the installments of these students' approved plans and allocate
+    their verified payments since each plan's approval again, after some
+    were reversed. A completed plan left with unpaid installments reopens,
+    and installments past the grace period are marked overdue again.
+    Returns the amount allocated.
+    """
+    if not student_ids:
+        return Decimal('0.00')
+    today = today or timezone.localdate()
+    cutoff = today - timedelta(days=getattr(settings, 'PAYMENT_PLAN_GRACE_DAYS', 0))
+    with transaction.atomic():
+        # Plans from before approvals existed start when they were created
+        plans = list(PaymentPlan.objects.select_for_update().filter(
+            student_id__in=student_ids, status__in=(*PLAN_OPEN_STATUSES, 'completed')
+        ).values_list('id', 'student_id', Coalesce('approved_at', 'created_at')))
+        if not plans:
+            return Decimal('0.00')
+        plan_ids = [plan_id for plan_id, _, _ in plans]
+        since = {}
+        for _, student_id, approved_at in plans:
+            since[student_id] = min(since.get(student_id, approved_at), approved_at)
+        PaymentPlanInstallment.objects.filter(plan_id__in=plan_ids).update(amount_paid=0, status='pending', paid_at=None)
+        PaymentPlan.objects.filter(id__in=plan_ids, status='completed').update(status='active')
+
+        payments = Payment.objects.filter(
+            student_id__in=since, status='verified', payment_date__gte=min(since.values())
+        ).only('id', 'student_id', 'ledger_id', 'amount', 'currency', 'payment_date', 'status')
+        allocated = allocate_payments([payment for payment in payments if payment.payment_date >= since[payment.student_id]])
+
+        overdue_installments(cutoff).filter(plan_id__in=plan_ids).update(status='overdue')
+        has_overdue = PaymentPlanInstallment.objects.filter(plan=OuterRef('pk'), status='overdue')
+        PaymentPlan.objects.filter(id__in=plan_ids, status='active').filter(Exists(has_overdue)).update(status='defaulted')
+    return allocated
+
+
+def overdue_installments(cutoff):
+    """Unpaid installments of open plans due before `cutoff`"""
+    return PaymentPlanInstallment.objects.filter(
+        due_date__lt=cutoff, status__in=('pending', 'partial'), plan__status__in=PLAN_OPEN_STATUSES
+    )
+
+
+def scan_delinquent_plans(today=None):
+    """
+    Mark installments unpaid PAYMENT_PLAN_GRACE_DAYS after their due date as
+    overdue and default the active plans that have one. Returns
+    {'overdue': n, 'defaulted': n}.
+    """
+    today = today or timezone.localdate()
+    cutoff = today - timedelta(days=getattr(settings, 'PAYMENT_PLAN_GRACE_DAYS', 0))
+    with transaction.atomic():
+        overdue = overdue_installments(cutoff).update(status='overdue')
+        has_overdue = PaymentPlanInstallment.objects.filter(plan=OuterRef('pk'), status='overdue')
+        defaulted = PaymentPlan.objects.filter(status='active').filter(Exists(has_overdue)).update(status='defaulted')
+    return {'overdue': overdue, 'defaulted': defaulted}
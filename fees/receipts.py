@@ -0,0 +1,205 @@
+"""
+PDF receipts.
+
+A receipt's PDF is rendered once and kept in Receipt.pdf_file; downloads are
+then served straight from storage. Rendering is a pure function of a plain
+dict (receipt_data) so the bulk command can farm it out to worker processes
+without giving them database connections.
+"""
+import hashlib
+import logging
+import re
+from calendar import timegm
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .exchange import fee_currency_expression
+from .models import PaymentMethod, Receipt
+
+logger = logging.getLogger(__name__)
+
+SCHOOL_NAME = 'ZRP Primary School'
+PAGE_WIDTH, PAGE_HEIGHT = 420, 595  # A5 portrait, in points
+
+RECEIPT_DATA_FIELDS = (
+    'id', 'receipt_number', 'generated_at', 'amount_paid', 'previous_balance', 'new_balance', 'ledger_currency',
+    'payment__currency', 'payment__payment_method__name', 'payment__reference_number', 'payment__payment_date',
+    'payment__student__user__first_name', 'payment__student__user__last_name',
+    'payment__student__user__username', 'payment__student__grade__name',
+    'generated_by__first_name', 'generated_by__last_name',
+)
+
+# Background renderer for receipts created during a request
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='receipt-pdf')
+
+
+def receipt_data(queryset):
+    """Plain dicts with everything a receipt PDF shows, one query for the lot"""
+    # The amount paid is in the payment's currency, the balances in the ledger's
+    return queryset.annotate(ledger_currency=fee_currency_expression(
+        year='payment__ledger__academic_year', term='payment__ledger__term', grade='payment__student__grade'
+    )).values(*RECEIPT_DATA_FIELDS)
+
+
+def _escape(text):
+    text = str(text).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return text.encode('latin-1', errors='replace').decode('latin-1')
+
+
+def _pdf(lines):
+    """Build a one-page PDF from (x, y, font_size, bold, text) lines"""
+    stream = ''.join(
+        f"BT /{'F2' if bold else 'F1'} {size} Tf {x} {y} Td ({_escape(text)}) Tj ET\n"
+        for x, y, size, bold, text in lines
+    ).encode('latin-1')
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+         f'/Resources << /Font << /F1 4 0 R /F2 5 0 R >> >> /Contents 6 0 R >>').encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'endstream',
+    ]
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+    xref = len(output)
+    output += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    output += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode()
+    output += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return bytes(output)
+
+
+def render_receipt_pdf(data):
+    """Render one receipt (a receipt_data dict) to PDF bytes"""
+    paid_on = data['payment__payment_date'] or data['generated_at']
+    if paid_on is not None and timezone.is_aware(paid_on):
+        paid_on = timezone.localtime(paid_on)
+    method = dict(PaymentMethod.METHOD_CHOICES).get(
+        data['payment__payment_method__name'], data['payment__payment_method__name']
+    )
+    rows = [
+        ('Receipt number', data['receipt_number']),
+        ('Date', paid_on.strftime('%d %b %Y %H:%M') if paid_on else ''),
+        ('Student', f"{data['payment__student__user__first_name']} {data['payment__student__user__last_name']}"),
+        ('Admission number', data['payment__student__user__username']),
+        ('Grade', data['payment__student__grade__name'] or ''),
+        ('Payment method', method),
+        ('Reference', data['payment__reference_number'] or '-'),
+        ('Previous balance', f"{data['ledger_currency']} {data['previous_balance']}"),
+        ('Amount paid', f"{data['payment__currency']} {data['amount_paid']}"),
+        ('New balance', f"{data['ledger_currency']} {data['new_balance']}"),
+        ('Received by', f"{data['generated_by__first_name']} {data['generated_by__last_name']}".strip()),
+    ]
+    lines = [
+        (40, PAGE_HEIGHT - 60, 18, True, SCHOOL_NAME),
+        (40, PAGE_HEIGHT - 85, 12, False, 'Official fee payment receipt'),
+    ]
+    y = PAGE_HEIGHT - 130
+    for label, value in rows:
+        lines.append((40, y, 10, True, label))
+        lines.append((170, y, 10, False, value))
+        y -= 22
+    lines.append((40, 50, 8, False, 'This receipt was generated electronically and is valid without a signature.'))
+    return _pdf(lines)
+
+
+def receipt_pdf_name(receipt_number):
+    return f'receipts/{receipt_number}.pdf'
+
+
+def store_receipt_pdf(receipt, pdf):
+    """Save rendered bytes to storage and point the receipt at them"""
+    name = receipt.pdf_file.storage.save(receipt_pdf_name(receipt.receipt_number), ContentFile(pdf))
+    Receipt.objects.filter(pk=receipt.pk).update(pdf_file=name)
+    receipt.pdf_file.name = name
+    return name
+
+
+def ensure_receipt_pdf(receipt):
+    """Render and store the receipt's PDF unless it already has one"""
+    if receipt.pdf_file and receipt.pdf_file.storage.exists(receipt.pdf_file.name):
+        return receipt.pdf_file.name
+    data = receipt_data(Receipt.objects.filter(pk=receipt.pk)).get()
+    return store_receipt_pdf(receipt, render_receipt_pdf(data))
+
+
+def _render_in_background(receipt_id):
+    try:
+        receipt = Receipt.objects.filter(pk=receipt_id).first()
+        if receipt is not None:
+            ensure_receipt_pdf(receipt)
+    except Exception:
+        logger.exception('Rendering PDF for receipt %s failed', receipt_id)
+    finally:
+        connection.close()
+
+
+def schedule_receipt_pdf(receipt_id):
+    """Pre-render a receipt's PDF off the request thread"""
+    _executor.submit(_render_in_background, receipt_id)
+
+
+# Serving
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def _read_range(file, length):
+    while length > 0:
+        chunk = file.read(min(RANGE_CHUNK_SIZE, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+    file.close()
+
+
+def _ranged_response(request, field_file, filename, etag, content_type):
+    """FileResponse, or a 206 for a single satisfiable Range request"""
+    size = field_file.size
+    match = RANGE_RE.match(request.headers.get('Range', '').strip())
+    if_range = request.headers.get('If-Range')
+    if match and match.group(0) != 'bytes=-' and (not if_range or if_range == etag):
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last) if last else size - 1, size - 1)
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+        if start > end or start >= size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        file = field_file.open('rb')
+        file.seek(start)
+        response = StreamingHttpResponse(_read_range(file, end - start + 1), status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+        return response
+    return FileResponse(field_file.open('rb'), filename=filename, content_type=content_type)
+
+
+def receipt_pdf_response(request, receipt):
+    """Serve a stored receipt PDF with ETag/Last-Modified and Range support"""
+    etag = quote_etag(hashlib.md5(f'{receipt.receipt_number}:{receipt.pdf_file.name}'.encode()).hexdigest())
+    last_modified = timegm(receipt.generated_at.utctimetuple())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _ranged_response(request, receipt.pdf_file, f'{receipt.receipt_number}.pdf', etag, 'application/pdf')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
@@ -0,0 +1,208 @@
+"""
+Bank statement reconciliation.
+
+Statement lines are matched against verified Payments in two passes. First
+by reference: the period's payments are indexed in a dict keyed on the
+normalised reference_number, so each line is one lookup. Then, for lines
+still unmatched, by amount within a date window: the remaining payments are
+grouped by amount and sorted by date once, and each line bisects its
+window. The whole match is O(n log n) in the statement and payment counts,
+with a single query to load the payments and one for the book total.
+
+A line with exactly one candidate is matched; more than one makes it
+ambiguous (left for a person to decide); none leaves it unmatched. Payments
+already matched by an earlier reconciliation are not matched again.
+"""
+import csv
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Sum
+
+from .models import BankReconciliation, BankStatementLine, Payment
+from .statements import StatementImportError, parse_amount, parse_date, resolve_columns
+
+STATEMENT_COLUMNS = {
+    'date': ('date', 'transaction_date', 'value_date', 'posting_date'),
+    'amount': ('amount', 'credit', 'paid_in'),
+    'reference': ('reference', 'reference_number', 'ref', 'transaction_id'),
+    'description': ('description', 'narrative', 'details', 'notes'),
+}
+DEFAULT_WINDOW_DAYS = 3
+INSERT_BATCH_SIZE = 2000
+
+
+class StatementLine:
+    def __init__(self, line_number, date, amount, reference='', description=''):
+        self.line_number = line_number
+        self.date = date
+        self.amount = amount
+        self.reference = reference
+        self.description = description
+        self.status = 'unmatched'
+        self.match_type = ''
+        self.payment_id = None
+        self.candidates = []
+
+    def match(self, payment_id, match_type):
+        self.status, self.payment_id, self.match_type = 'matched', payment_id, match_type
+
+    def ambiguous(self, candidates):
+        self.status, self.candidates = 'ambiguous', sorted(candidates)
+
+
+class ReconciliationReport:
+    def __init__(self, lines, unmatched_payments, book_total):
+        self.lines = lines
+        self.unmatched_payments = unmatched_payments  # Payment ids in the period not on the statement
+        self.book_total = book_total
+        self.reconciliation = None
+
+    def _with_status(self, status):
+        return [line for line in self.lines if line.status == status]
+
+    @property
+    def matched(self):
+        return self._with_status('matched')
+
+    @property
+    def ambiguous(self):
+        return self._with_status('ambiguous')
+
+    @property
+    def unmatched(self):
+        return self._with_status('unmatched')
+
+    @property
+    def statement_total(self):
+        return sum((line.amount for line in self.lines), Decimal('0.00'))
+
+    def __str__(self):
+        return (
+            f'{len(self.matched)} matched, {len(self.ambiguous)} ambiguous, {len(self.unmatched)} unmatched '
+            f'of {len(self.lines)} lines; {len(self.unmatched_payments)} book payment(s) not on the statement'
+        )
+
+
+def _normalise(reference):
+    return reference.strip().upper()
+
+
+def parse_statement(csv_file):
+    """StatementLines for the credit rows of a CSV bank statement"""
+    reader = csv.DictReader(csv_file)
+    columns = resolve_columns(reader.fieldnames, STATEMENT_COLUMNS, required=('date', 'amount'))
+    lines = []
+    for index, row in enumerate(reader):
+        line_number = index + 2  # Header is line 1
+        try:
+            amount = parse_amount(row.get(columns['amount']))
+            date = parse_date(row.get(columns['date']) or '')
+        except ValueError as e:
+            raise StatementImportError(f'Line {line_number}: {e}')
+        if amount <= 0:
+            continue  # Debits are not fee payments
+        lines.append(StatementLine(
+            line_number, date, amount.quantize(Decimal('0.01')),
+            reference=(row.get(columns['reference']) or '').strip() if 'reference' in columns else '',
+            description=(row.get(columns['description']) or '').strip()[:255] if 'description' in columns else '',
+        ))
+    return lines
+
+
+def match_lines(lines, window_days=DEFAULT_WINDOW_DAYS):
+    """Match StatementLines against verified payments; returns a ReconciliationReport"""
+    if not lines:
+        return ReconciliationReport([], [], Decimal('0.00'))
+    window = timedelta(days=window_days)
+    first, last = min(line.date for line in lines), max(line.date for line in lines)
+    already_matched = BankStatementLine.objects.filter(payment=OuterRef('pk'), status='matched')
+    payments = Payment.objects.filter(
+        status='verified', payment_date__gte=first - window, payment_date__lt=last + window + timedelta(days=1)
+    ).filter(~Exists(already_matched))
+    rows = list(payments.values_list('id', 'reference_number', 'amount', 'payment_date'))
+    used = set()
+
+    # Pass 1: exact reference
+    by_reference = defaultdict(list)
+    for payment_id, reference, amount, _ in rows:
+        if reference:
+            by_reference[_normalise(reference)].append((payment_id, amount))
+    for line in lines:
+        if not line.reference:
+            continue
+        candidates = [
+            payment_id for payment_id, amount in by_reference.get(_normalise(line.reference), ())
+            if amount == line.amount and payment_id not in used
+        ]
+        if len(candidates) == 1:
+            line.match(candidates[0], 'reference')
+            used.add(candidates[0])
+        elif candidates:
+            line.ambiguous(candidates)
+
+    # Pass 2: same amount within the date window, by bisection on sorted dates
+    by_amount = defaultdict(list)
+    for payment_id, _, amount, payment_date in sorted(rows, key=lambda row: (row[3], row[0])):
+        if payment_id not in used:
+            by_amount[amount].append((payment_date, payment_id))
+    for line in sorted(lines, key=lambda line: (line.date, line.line_number)):
+        if line.status != 'unmatched':
+            continue
+        bucket = by_amount.get(line.amount)
+        if not bucket:
+            continue
+        start = bisect_left(bucket, (line.date - window,))
+        end = bisect_right(bucket, (line.date + window + timedelta(days=1),))
+        candidates = [payment_id for _, payment_id in bucket[start:end] if payment_id not in used]
+        if len(candidates) == 1:
+            line.match(candidates[0], 'amount_date')
+            used.add(candidates[0])
+        elif candidates:
+            line.ambiguous(candidates)
+
+    in_period = [
+        payment_id for payment_id, _, _, payment_date in rows
+        if first <= payment_date < last + timedelta(days=1) and payment_id not in used
+    ]
+    book_total = Payment.objects.filter(
+        status='verified', payment_date__gte=first, payment_date__lt=last + timedelta(days=1)
+    ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+    return ReconciliationReport(lines, in_period, book_total.quantize(Decimal('0.01')))
+
+
+def reconcile_statement(csv_file, reconciled_by, window_days=DEFAULT_WINDOW_DAYS, bank_balance=None, dry_run=False):
+    """
+    Parse, match and (unless dry_run) save a statement as a BankReconciliation
+    with one BankStatementLine per line. Returns the ReconciliationReport.
+    """
+    lines = parse_statement(csv_file)
+    if not lines:
+        raise StatementImportError('The statement has no credit lines.')
+    report = match_lines(lines, window_days)
+    if dry_run:
+        return report
+
+    bank_balance = report.statement_total if bank_balance is None else bank_balance
+    with transaction.atomic():
+        report.reconciliation = BankReconciliation.objects.create(
+            date=max(line.date for line in lines).date(),
+            bank_balance=bank_balance,
+            book_balance=report.book_total,
+            difference=bank_balance - report.book_total,
+            reconciled_by=reconciled_by,
+            notes=str(report),
+        )
+        BankStatementLine.objects.bulk_create([
+            BankStatementLine(
+                reconciliation=report.reconciliation, line_number=line.line_number, date=line.date,
+                amount=line.amount, reference=line.reference[:100], description=line.description,
+                status=line.status, match_type=line.match_type, payment_id=line.payment_id,
+                candidates=','.join(str(payment_id) for payment_id in line.candidates)[:255],
+            )
+            for line in lines
+        ], batch_size=INSERT_BATCH_SIZE)
+    return report
@@ -0,0 +1,237 @@
+"""
+Fee reminder pipeline.
+
+queue_reminders() picks the target ledgers for a reminder type in one query,
+renders each message from templates/fees/reminders/<type>.txt and inserts
+the FeeReminder rows in bulk; nothing is sent on the request thread.
+
+send_pending_reminders() is the worker side (the send_fee_reminders command).
+It claims queued reminders in batches, leasing them so several workers can
+share the queue, and delivers them over one SMTP connection and one SMS
+backend connection per run, each throttled to its own rate. Every message
+keeps a per-channel status; failed channels are retried with exponential
+backoff until REMINDER_MAX_ATTEMPTS, then marked failed.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .exchange import fee_currency_expression
+from .models import FeeReminder, FeeStructure, StudentLedger
+from .sms import get_sms_backend
+
+SCHOOL_NAME = 'ZRP Primary School'
+REMINDER_SUBJECTS = {
+    'payment_due': 'School fees due soon',
+    'overdue': 'School fees overdue',
+    'final_notice': 'Final notice: outstanding school fees',
+}
+INSERT_BATCH_SIZE = 1000
+DEFAULT_BATCH_SIZE = 200
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# Queueing
+
+def reminder_targets(reminder_type, academic_year, term, today=None, ledger_ids=None):
+    """
+    Ledgers owing money that are due a `reminder_type` reminder: payment_due
+    within REMINDER_DUE_SOON_DAYS before the deadline, overdue after it and
+    final_notice REMINDER_FINAL_NOTICE_DAYS after it. Students reminded of
+    the same type within REMINDER_REPEAT_DAYS are left out. With ledger_ids
+    only those ledgers are considered and the deadline windows are ignored.
+    """
+    today = today or timezone.localdate()
+    deadline = FeeStructure.objects.filter(
+        academic_year=academic_year, term=term, grade=OuterRef('student__grade'), is_day_scholar=True
+    ).values('payment_deadline')[:1]
+    recent = FeeReminder.objects.filter(
+        student=OuterRef('student'), reminder_type=reminder_type,
+        sent_at__gte=timezone.now() - timedelta(days=_setting('REMINDER_REPEAT_DAYS', 7)),
+    )
+    ledgers = StudentLedger.objects.filter(
+        academic_year=academic_year, term=term, outstanding_balance__gt=0
+    ).annotate(deadline=Subquery(deadline), currency=fee_currency_expression()).filter(~Exists(recent))
+
+    if ledger_ids is not None:
+        return ledgers.filter(id__in=ledger_ids)
+    final_after = today - timedelta(days=_setting('REMINDER_FINAL_NOTICE_DAYS', 30))
+    if reminder_type == 'payment_due':
+        return ledgers.filter(deadline__gte=today, deadline__lte=today + timedelta(days=_setting('REMINDER_DUE_SOON_DAYS', 7)))
+    if reminder_type == 'overdue':
+        return ledgers.filter(deadline__lt=today, deadline__gt=final_after)
+    if reminder_type == 'final_notice':
+        return ledgers.filter(deadline__lte=final_after)
+    raise ValueError(f'Unknown reminder type "{reminder_type}"')
+
+
+def queue_reminders(reminder_type, academic_year, term, sent_by=None, today=None, ledger_ids=None):
+    """Render and queue reminders for every target ledger; returns how many were queued"""
+    template = get_template(f'fees/reminders/{reminder_type}.txt')
+    rows = reminder_targets(reminder_type, academic_year, term, today, ledger_ids).values_list(
+        'student_id', 'student__user__first_name', 'student__user__last_name', 'student__user__username',
+        'student__user__email', 'student__guardian_phone', 'currency', 'outstanding_balance', 'deadline',
+    ).order_by('id')
+
+    queued = 0
+    batch = []
+    for student_id, first_name, last_name, username, email, phone, currency, balance, deadline in rows.iterator(chunk_size=INSERT_BATCH_SIZE):
+        message = template.render({
+            'school_name': SCHOOL_NAME, 'student_name': f'{first_name} {last_name}', 'admission_number': username,
+            'currency': currency, 'balance': balance, 'deadline': deadline, 'term': term,
+        }).strip()
+        batch.append(FeeReminder(
+            student_id=student_id, reminder_type=reminder_type, subject=REMINDER_SUBJECTS[reminder_type],
+            message=message, sent_by=sent_by,
+            email_to=email or '', email_status='pending' if email else 'skipped',
+            sms_to=phone or '', sms_status='pending' if phone else 'skipped',
+            status='queued' if email or phone else 'done',
+        ))
+        if len(batch) >= INSERT_BATCH_SIZE:
+            FeeReminder.objects.bulk_create(batch)
+            queued += len(batch)
+            batch = []
+    if batch:
+        FeeReminder.objects.bulk_create(batch)
+        queued += len(batch)
+    return queued
+
+
+# Delivery
+
+class RateLimiter:
+    """Token bucket allowing `per_second` sends, with bursts of up to one second's worth"""
+
+    def __init__(self, per_second):
+        self.per_second = per_second
+        self.tokens = per_second
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.per_second:
+            return
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.per_second, self.tokens + (now - self.updated) * self.per_second)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.per_second)
+
+
+def _claim(batch_size):
+    """Lease a batch of due reminders to this worker"""
+    now = timezone.now()
+    due = Q(status='queued') & (Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+    # A worker that died mid-batch leaves 'sending' rows whose lease runs out
+    expired = Q(status='sending', next_attempt_at__lte=now)
+    with transaction.atomic():
+        ids = list(
+            FeeReminder.objects.filter(due | expired).select_for_update(skip_locked=True)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        FeeReminder.objects.filter(id__in=ids).update(status='sending', next_attempt_at=now + CLAIM_LEASE)
+    return list(FeeReminder.objects.filter(id__in=ids).order_by('id'))
+
+
+class _Channels:
+    """The pooled connections and rate limiters shared by a worker run"""
+
+    def __init__(self):
+        self.email = get_connection()
+        self.sms = get_sms_backend()
+        self.email_limit = RateLimiter(_setting('REMINDER_EMAIL_RATE', 10))
+        self.sms_limit = RateLimiter(_setting('REMINDER_SMS_RATE', 5))
+
+    def send_email(self, reminder):
+        self.email_limit.wait()
+        message = EmailMessage(reminder.subject, reminder.message, to=[reminder.email_to], connection=self.email)
+        try:
+            # Opened here rather than by send(), which would close it again
+            self.email.open()
+            message.send()
+        except Exception:
+            # Reconnect on the next message
+            self.email.close()
+            raise
+
+    def send_sms(self, reminder):
+        self.sms_limit.wait()
+        self.sms.send(reminder.sms_to, reminder.message)
+
+    def close(self):
+        self.email.close()
+        self.sms.close()
+
+
+def _deliver(reminder, channels):
+    now = timezone.now()
+    reminder.attempts += 1
+    errors = []
+    if reminder.email_status == 'pending':
+        try:
+            channels.send_email(reminder)
+            reminder.email_status, reminder.sent_via_email = 'sent', True
+        except Exception as e:
+            errors.append(f'email: {e}')
+    if reminder.sms_status == 'pending':
+        try:
+            channels.send_sms(reminder)
+            reminder.sms_status, reminder.sent_via_sms = 'sent', True
+        except Exception as e:
+            errors.append(f'sms: {e}')
+
+    reminder.last_error = '; '.join(errors)
+    if errors and reminder.attempts < _setting('REMINDER_MAX_ATTEMPTS', 5):
+        delay = _setting('REMINDER_RETRY_DELAY', 60) * 2 ** (reminder.attempts - 1)
+        reminder.status, reminder.next_attempt_at = 'queued', now + timedelta(seconds=delay)
+        return
+    if reminder.email_status == 'pending':
+        reminder.email_status = 'failed'
+    if reminder.sms_status == 'pending':
+        reminder.sms_status = 'failed'
+    reminder.status, reminder.next_attempt_at = 'done', None
+    if reminder.sent_via_email or reminder.sent_via_sms:
+        reminder.delivered_at = now
+
+
+def send_pending_reminders(batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """Deliver due reminders until the queue is empty; returns {'sent': n, 'retrying': n, 'failed': n}"""
+    counts = {'sent': 0, 'retrying': 0, 'failed': 0}
+    channels = _Channels()
+    batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            reminders = _claim(batch_size)
+            if not reminders:
+                break
+            batches += 1
+            for reminder in reminders:
+                _deliver(reminder, channels)
+                if reminder.status == 'queued':
+                    counts['retrying'] += 1
+                elif 'failed' in (reminder.email_status, reminder.sms_status):
+                    counts['failed'] += 1
+                else:
+                    counts['sent'] += 1
+            FeeReminder.objects.bulk_update(reminders, [
+                'status', 'email_status', 'sms_status', 'sent_via_email', 'sent_via_sms',
+                'attempts', 'next_attempt_at', 'last_error', 'delivered_at',
+            ])
+    finally:
+        channels.close()
+    return counts
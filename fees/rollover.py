@@ -0,0 +1,158 @@
+"""
+Term rollover: open the next term's ledgers for every student.
+
+New ledgers are created in batches of students, each batch being one SELECT
+(with the previous balance and the grade's fee as subqueries) and one bulk
+INSERT in its own transaction. Students who already have a ledger in the
+target term are skipped, so the rollover can be rerun or resumed after an
+interruption without duplicating anything; a batch that collides with a
+ledger opened meanwhile is rolled back and read again. Each batch adds its ledgers to
+the term summary with one UPDATE rather than rebuilding it.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, DecimalField, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from students.models import Student
+
+from .current import clear_current_period
+from .discounts import price_ledgers
+from .exchange import fee_currency_expression, reporting_currency
+from .models import AcademicYear, FeeStructure, StudentLedger, Term
+from .summary import add_ledger_changes, record_term_deltas, term_deltas
+
+DEFAULT_BATCH_SIZE = 5000
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+
+
+def next_term_after(term):
+    """The term that starts after `term`, in the same or a later academic year"""
+    return Term.objects.filter(start_date__gt=term.start_date).select_related('academic_year').order_by('start_date').first()
+
+
+def _opening_balance(from_term, student_ref='pk'):
+    # Match the whole (student, academic_year, term) unique key so each
+    # lookup is a single index probe
+    previous = StudentLedger.objects.filter(
+        student=OuterRef(student_ref), academic_year=from_term.academic_year_id, term=from_term
+    ).values('outstanding_balance')[:1]
+    return Coalesce(Subquery(previous, output_field=MONEY), Value(Decimal('0.00')), output_field=MONEY)
+
+
+def _structure(to_term, **grade_match):
+    # Students carry no boarding flag yet, so day-scholar fees apply
+    return FeeStructure.objects.filter(
+        term=to_term, academic_year=to_term.academic_year, is_day_scholar=True, **grade_match
+    ).order_by('-id')
+
+
+def _term_fee(to_term, **grade_match):
+    structure = _structure(to_term, **grade_match).values('total_fee')[:1]
+    return Coalesce(Subquery(structure, output_field=MONEY), Value(Decimal('0.00')), output_field=MONEY)
+
+
+def _term_currency(to_term, **grade_match):
+    structure = _structure(to_term, **grade_match).values('currency')[:1]
+    return Coalesce(Subquery(structure), Value(reporting_currency()), output_field=CharField())
+
+
+def rollover_term(from_term, to_term, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Create `to_term` ledgers for all students, carrying each student's
+    `from_term` outstanding balance as the opening balance and charging the
+    grade's FeeStructure total less any active discounts. Returns
+    {'created': n, 'assessed': n}.
+    """
+    if to_term.start_date <= from_term.start_date:
+        raise ValueError(f'{to_term} does not come after {from_term}')
+
+    already_open = StudentLedger.objects.filter(term=to_term, academic_year=to_term.academic_year).values('student_id')
+    term_key = (to_term.academic_year_id, to_term.id)
+    created = 0
+    last_id = 0
+    while True:
+        try:
+            with transaction.atomic():
+                batch = list(
+                    Student.objects.filter(id__gt=last_id).exclude(id__in=already_open).annotate(
+                        opening=_opening_balance(from_term),
+                        fee=_term_fee(to_term, grade=OuterRef('grade')),
+                        currency=_term_currency(to_term, grade=OuterRef('grade')),
+                    ).order_by('id').values_list('id', 'opening', 'fee', 'currency')[:batch_size]
+                )
+                if not batch:
+                    break
+                # Every row is inserted or none is, so the deltas below are
+                # exactly the ledgers created
+                StudentLedger.objects.bulk_create([
+                    StudentLedger(
+                        student_id=student_id,
+                        academic_year=to_term.academic_year,
+                        term=to_term,
+                        opening_balance=opening,
+                        term_fees=fee,
+                        total_required=opening + fee,
+                        outstanding_balance=opening + fee,
+                    )
+                    for student_id, opening, fee, _ in batch
+                ])
+                # bulk_create skips the per-row summary deltas
+                record_term_deltas(add_ledger_changes(term_deltas(), (
+                    (None, (*term_key, currency, opening + fee, opening + fee)) for _, opening, fee, currency in batch
+                )))
+        except IntegrityError:
+            # A ledger was opened for one of these students (e.g. by
+            # record_payment) after the batch was read; read it again
+            continue
+        created += len(batch)
+        last_id = batch[-1][0]
+        if progress:
+            progress(created)
+
+    # Ledgers opened early (e.g. by record_payment) with nothing assessed yet
+    with transaction.atomic():
+        unassessed = list(StudentLedger.objects.select_for_update().filter(
+            term=to_term, academic_year=to_term.academic_year,
+            opening_balance=0, term_fees=0, total_required=0,
+        ).annotate(currency=fee_currency_expression()).values_list('id', 'currency', 'total_required', 'outstanding_balance'))
+        assessed = len(unassessed)
+        if unassessed:
+            # Only the rows assessed here; the rest of the term is already right
+            ledgers = StudentLedger.objects.filter(id__in=[ledger_id for ledger_id, _, _, _ in unassessed])
+            ledgers.update(
+                opening_balance=_opening_balance(from_term, student_ref='student'),
+                term_fees=_term_fee(to_term, grade__student=OuterRef('student')),
+                updated_at=timezone.now(),
+            )
+            ledgers.update(
+                total_required=F('opening_balance') + F('term_fees') + F('adjustments'),
+                outstanding_balance=F('opening_balance') + F('term_fees') + F('adjustments') - F('payments_made'),
+            )
+            after = {
+                ledger_id: (required, balance)
+                for ledger_id, required, balance in ledgers.values_list('id', 'total_required', 'outstanding_balance')
+            }
+            # update() skips the per-row summary deltas
+            record_term_deltas(add_ledger_changes(term_deltas(), (
+                ((*term_key, currency, required, balance), (*term_key, currency, *after[ledger_id]))
+                for ledger_id, currency, required, balance in unassessed
+            )))
+
+    # Take discounts off the structure fees just charged
+    price_ledgers(to_term.academic_year, to_term)
+    return {'created': created, 'assessed': assessed}
+
+
+def make_current(term):
+    """Flag `term` and its academic year as current, and no others"""
+    with transaction.atomic():
+        Term.objects.exclude(pk=term.pk).filter(is_current=True).update(is_current=False)
+        Term.objects.filter(pk=term.pk).update(is_current=True)
+        AcademicYear.objects.exclude(pk=term.academic_year_id).filter(is_current=True).update(is_current=False)
+        AcademicYear.objects.filter(pk=term.academic_year_id).update(is_current=True)
+        # update() sends no post_save
+        clear_current_period()
+        transaction.on_commit(clear_current_period)
@@ -0,0 +1,108 @@
+"""
+Receipt number allocation.
+
+Numbers come from a per-year ReceiptSequence row that is bumped with a single
+UPDATE, so allocation costs the same no matter how many receipts exist and
+two workers can never be handed the same number.
+
+RECEIPT_NUMBERS_GAP_FREE (default True) takes one number per receipt inside
+the caller's transaction: a rolled back payment rolls its number back too, at
+the price of serialising receipt inserts on the sequence row until commit.
+
+With RECEIPT_NUMBERS_GAP_FREE = False each process may reserve
+RECEIPT_NUMBER_BLOCK_SIZE numbers at a time and hand them out from memory.
+Numbers left over when a worker exits are never issued, so the series can
+have gaps.
+"""
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ReceiptSequence
+
+# year -> [next_number, last_number] reserved by this process
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def _numbering_settings():
+    gap_free = getattr(settings, 'RECEIPT_NUMBERS_GAP_FREE', True)
+    block_size = getattr(settings, 'RECEIPT_NUMBER_BLOCK_SIZE', 1)
+    if block_size < 1:
+        raise ImproperlyConfigured('RECEIPT_NUMBER_BLOCK_SIZE must be at least 1.')
+    if gap_free and block_size > 1:
+        raise ImproperlyConfigured(
+            'RECEIPT_NUMBER_BLOCK_SIZE > 1 reserves numbers per worker and '
+            'needs RECEIPT_NUMBERS_GAP_FREE = False.'
+        )
+    return gap_free, block_size
+
+
+def format_receipt_number(year, number):
+    return f'RCP-{year}-{number:06d}'
+
+
+def reserve_numbers(year, count):
+    """Reserve `count` consecutive numbers for `year` and return the first one"""
+    with transaction.atomic():
+        # UPDATE first so the row lock (or SQLite's write lock) is taken
+        # before the counter is read back
+        updated = ReceiptSequence.objects.filter(year=year).update(
+            last_number=F('last_number') + count
+        )
+        if not updated:
+            try:
+                with transaction.atomic():
+                    ReceiptSequence.objects.create(year=year, last_number=count)
+                return 1
+            except IntegrityError:
+                # Another worker created this year's row first
+                ReceiptSequence.objects.filter(year=year).update(
+                    last_number=F('last_number') + count
+                )
+        last_number = ReceiptSequence.objects.values_list('last_number', flat=True).get(year=year)
+    return last_number - count + 1
+
+
+def _take_from_block(year):
+    with _blocks_lock:
+        block = _blocks.get(year)
+        if block and block[0] <= block[1]:
+            number = block[0]
+            block[0] += 1
+            return number
+    return None
+
+
+def _store_block(year, first, last):
+    with _blocks_lock:
+        _blocks[year] = [first, last]
+
+
+def next_receipt_number(year=None):
+    """Allocate the next RCP-YYYY-NNNNNN receipt number"""
+    year = year or timezone.now().year
+    gap_free, block_size = _numbering_settings()
+
+    if gap_free or block_size == 1:
+        return format_receipt_number(year, reserve_numbers(year, 1))
+
+    number = _take_from_block(year)
+    if number is None:
+        number = reserve_numbers(year, block_size)
+        last = number + block_size - 1
+        if number < last:
+            # Only hand out the rest of the block once the reservation is
+            # committed; a rollback returns the whole block to the sequence
+            transaction.on_commit(lambda: _store_block(year, number + 1, last))
+    return format_receipt_number(year, number)
+
+
+def reset_reserved_blocks():
+    """Forget numbers reserved by this process (used by tests)"""
+    with _blocks_lock:
+        _blocks.clear()
@@ -0,0 +1,105 @@
+"""
+Agent settlement runs.
+
+settle_agents() settles every verified, unsettled AgentPayment collected in
+a period, one AgentSettlement per agent, in a fixed number of queries
+however many agents and collections there are:
+
+1. the distinct agents with collections to settle,
+2. one bulk INSERT of their (empty) settlements,
+3. one UPDATE linking each collection to its agent's settlement, marking it
+   paid and recomputing its commission in SQL,
+4. one aggregate of the linked collections per settlement,
+5. one bulk UPDATE of the settlement totals, and one bulk INSERT of audit
+   entries.
+
+All of it runs in one transaction, and the totals are taken from the rows
+that were actually linked, so a collection verified mid-run is either fully
+in a settlement or left for the next one.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from .audit import audit_entry
+from .models import AgentPayment, AgentSettlement, AuditLog
+from .summary import day_bounds
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+COMMISSION = Round(F('amount') * F('commission_rate') / 100, 2, output_field=MONEY)
+
+
+def settle_agents(settled_by, period_start, period_end, payments=None):
+    """
+    Settle verified collections from period_start to period_end (inclusive
+    dates), optionally limited to the `payments` queryset. Returns the new
+    AgentSettlements.
+    """
+    payments = AgentPayment.objects.all() if payments is None else payments
+    eligible = payments.filter(
+        status='verified', settlement__isnull=True,
+        collected_at__gte=day_bounds(period_start)[0], collected_at__lt=day_bounds(period_end)[1],
+    )
+    now = timezone.now()
+
+    with transaction.atomic():
+        agents = list(eligible.values_list('agent_name', 'agent_phone').distinct().order_by('agent_name', 'agent_phone'))
+        if not agents:
+            return []
+        settlements = AgentSettlement.objects.bulk_create([
+            AgentSettlement(
+                agent_name=name, agent_phone=phone, period_start=period_start, period_end=period_end,
+                settled_by=settled_by, settled_at=now,
+            )
+            for name, phone in agents
+        ])
+        settlement_ids = [settlement.id for settlement in settlements]
+
+        this_run = AgentSettlement.objects.filter(
+            id__in=settlement_ids, agent_name=OuterRef('agent_name'), agent_phone=OuterRef('agent_phone')
+        ).values('id')[:1]
+        eligible.update(
+            settlement=Subquery(this_run), status='paid', commission_amount=COMMISSION,
+        )
+
+        totals = {
+            row['settlement']: row
+            for row in AgentPayment.objects.filter(settlement__in=settlement_ids).values('settlement').annotate(
+                count=Count('id'), collected=Sum('amount'), commission=Sum('commission_amount'),
+            )
+        }
+        settled, empty = [], []
+        for settlement in settlements:
+            row = totals.get(settlement.id)
+            if row is None:
+                # Another run took this agent's collections first
+                empty.append(settlement.id)
+                continue
+            settlement.payment_count = row['count']
+            settlement.total_collected = row['collected'].quantize(Decimal('0.01'))
+            settlement.total_commission = row['commission'].quantize(Decimal('0.01'))
+            settlement.net_payable = settlement.total_collected - settlement.total_commission
+            settled.append(settlement)
+        if empty:
+            AgentSettlement.objects.filter(id__in=empty).delete()
+        AgentSettlement.objects.bulk_update(
+            settled, ['payment_count', 'total_collected', 'total_commission', 'net_payable']
+        )
+
+        AuditLog.objects.bulk_create([
+            audit_entry(
+                user=settled_by,
+                action_type='agent_settled',
+                description=(
+                    f'Settled {settlement.payment_count} collection(s) for agent {settlement.agent_name} '
+                    f'({settlement.period_start} to {settlement.period_end}): commission ${settlement.total_commission}, '
+                    f'net ${settlement.net_payable}'
+                ),
+                amount=settlement.net_payable,
+            )
+            for settlement in settled
+        ])
+    return settled
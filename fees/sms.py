@@ -0,0 +1,91 @@
+"""
+SMS backends, shaped like Django's email backends: open() once, send many
+messages over the same connection, close().
+
+SMS_BACKEND picks the class. HttpBackend posts JSON to SMS_GATEWAY_URL over
+one keep-alive connection; ConsoleBackend prints; LocmemBackend collects
+messages in `outbox` for tests.
+"""
+import http.client
+import json
+import sys
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+outbox = []
+
+
+class SMSError(Exception):
+    """Raised when the gateway refuses or fails to take a message"""
+
+
+class BaseBackend:
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, phone, text):
+        raise NotImplementedError
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConsoleBackend(BaseBackend):
+    def send(self, phone, text):
+        sys.stdout.write(f'SMS to {phone}: {text}\n')
+
+
+class LocmemBackend(BaseBackend):
+    def send(self, phone, text):
+        outbox.append((phone, text))
+
+
+class HttpBackend(BaseBackend):
+    """POST {"to", "message", "sender"} to SMS_GATEWAY_URL with an optional bearer token"""
+
+    def __init__(self):
+        self.url = urlsplit(settings.SMS_GATEWAY_URL)
+        self.token = getattr(settings, 'SMS_GATEWAY_TOKEN', '')
+        self.sender = getattr(settings, 'SMS_SENDER_ID', '')
+        self.timeout = getattr(settings, 'SMS_GATEWAY_TIMEOUT', 10)
+        self.connection = None
+
+    def open(self):
+        if self.connection is None:
+            connection_class = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+            self.connection = connection_class(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def send(self, phone, text):
+        self.open()
+        body = json.dumps({'to': phone, 'message': text, 'sender': self.sender})
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        try:
+            self.connection.request('POST', self.url.path or '/', body=body, headers=headers)
+            response = self.connection.getresponse()
+            detail = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            # Drop the connection so the next send reconnects
+            self.close()
+            raise SMSError(f'SMS gateway unreachable: {e}') from e
+        if response.status >= 300:
+            raise SMSError(f'SMS gateway returned {response.status}: {detail[:200].decode(errors="replace")}')
+
+
+def get_sms_backend():
+    return import_string(getattr(settings, 'SMS_BACKEND', 'fees.sms.ConsoleBackend'))()
@@ -0,0 +1,60 @@
+"""
+Parsing shared by the CSV statement readers: the payment statement import
+(fees.imports) and bank reconciliation (fees.reconciliation).
+
+Headers are matched case-insensitively against each column's accepted
+spellings, dates against DATE_FORMATS (made aware in the current time
+zone), and amounts may carry thousands separators.
+"""
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d/%m/%Y', '%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S')
+
+
+class StatementImportError(Exception):
+    """Raised when a statement cannot be imported at all"""
+
+
+def resolve_columns(fieldnames, column_aliases, required):
+    """
+    {column: header} for the columns in `column_aliases` ({column: accepted
+    spellings}) found among the CSV headers; raises StatementImportError if
+    a `required` column is missing
+    """
+    headers = {name.strip().lower().replace(' ', '_'): name for name in fieldnames or []}
+    columns = {}
+    for column, aliases in column_aliases.items():
+        for alias in aliases:
+            if alias in headers:
+                columns[column] = headers[alias]
+                break
+    missing = set(required) - set(columns)
+    if missing:
+        raise StatementImportError(f"Statement is missing column(s): {', '.join(sorted(missing))}")
+    return columns
+
+
+def parse_date(value):
+    """Aware datetime from a statement cell; ValueError if no format fits"""
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return timezone.make_aware(parsed)
+    raise ValueError(f'unrecognised date "{value}"')
+
+
+def parse_amount(value):
+    """Decimal from a statement cell such as "1,250.00"; ValueError if it is not a finite number"""
+    try:
+        amount = Decimal((value or '').replace(',', '').strip())
+    except InvalidOperation:
+        raise ValueError(f'invalid amount "{value}"')
+    if not amount.is_finite():
+        raise ValueError(f'invalid amount "{value}"')
+    return amount
@@ -0,0 +1,400 @@
+"""
+Incrementally maintained TermCollectionSummary rows, one per academic year,
+term and fee currency.
+
+StudentLedger and Payment apply their own deltas from save()/delete() inside
+the same transaction as the write. Set-based writes that skip those gather
+their changes per term and hand them to record_term_deltas(), or call
+record_payment_status_change() before a bulk status update.
+rebuild_summaries() recomputes every row from scratch and reports any drift,
+for writes that bypass both (raw SQL, queryset.delete(), cascades).
+
+Each ledger is counted in the row for its fee currency, and so are the
+collections credited to it: a payment made in another currency is
+converted at its own day's rate, as the ledger itself was credited, so
+collected plus outstanding always adds up to expected. Approved refunds are
+debited from the ledgers they were paid out of, so they come off the
+collected total as well (but not off the day's collections).
+reporting_totals() converts a term's rows into the reporting currency at
+the current rate for dashboards.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .exchange import (
+    fee_currencies, fee_currency, fee_currency_expression, get_rate_table, reporting_currency, to_ledger_currency,
+)
+from .models import Payment, Refund, StudentLedger, TermCollectionSummary
+
+ZERO = Decimal('0.00')
+# Refund statuses that have been debited from a ledger
+REFUNDED_STATUSES = ('approved', 'processed')
+SUMMARY_FIELDS = ('total_expected', 'total_collected', 'total_outstanding', 'ledger_count', 'fully_paid_count', 'todays_collections')
+MONEY_FIELDS = ('total_expected', 'total_collected', 'total_outstanding', 'todays_collections')
+
+
+def day_bounds(day):
+    """Aware [start, end) datetimes covering a local calendar day"""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _money(value):
+    return (value or ZERO).quantize(ZERO)
+
+
+def _blank():
+    return {field: 0 if field.endswith('_count') else ZERO for field in SUMMARY_FIELDS}
+
+
+def _is_today(moment):
+    return moment is not None and timezone.localdate(moment) == timezone.localdate()
+
+
+def _collections(payments):
+    """
+    {(year_id, term_id, fee currency): [collected, collected today]} for
+    verified `payments`, each converted into its ledger's fee currency at
+    its own day's rate, from one query grouped by term, grade, currency and
+    day
+    """
+    groups = payments.annotate(day=TruncDate('payment_date')).values_list(
+        'ledger__academic_year_id', 'ledger__term_id', 'ledger__student__grade_id', 'currency', 'day'
+    ).annotate(total=Sum('amount')).order_by()
+
+    totals = defaultdict(lambda: [ZERO, ZERO])
+    currencies = table = None
+    today = timezone.localdate()
+    for year_id, term_id, grade_id, currency, day, amount in groups:
+        if currencies is None:
+            currencies = fee_currencies()
+        target = fee_currency(currencies, year_id, term_id, grade_id)
+        if currency != target:
+            table = table or get_rate_table()
+            amount = table.convert(amount, currency, target, day)
+        values = totals[(year_id, term_id, target)]
+        values[0] += amount
+        if day == today:
+            values[1] += amount
+    return totals
+
+
+def _apply(academic_year_id, term_id, currency, expected=ZERO, collected=ZERO, ledgers=0, fully_paid=0, today_amount=ZERO):
+    """Add deltas to a term's summary row for `currency`, building the term's rows if it is missing"""
+    if academic_year_id is None or term_id is None:
+        return
+    updates = {}
+    if expected or collected:
+        updates['total_expected'] = F('total_expected') + expected
+        updates['total_collected'] = F('total_collected') + collected
+        updates['total_outstanding'] = F('total_outstanding') + (expected - collected)
+    if ledgers:
+        updates['ledger_count'] = F('ledger_count') + ledgers
+    if fully_paid:
+        updates['fully_paid_count'] = F('fully_paid_count') + fully_paid
+    if today_amount:
+        today = timezone.localdate()
+        updates['todays_collections'] = Case(
+            When(collections_date=today, then=F('todays_collections') + today_amount),
+            default=Value(max(today_amount, ZERO)),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+        updates['collections_date'] = today
+    if not updates:
+        return
+
+    updated = TermCollectionSummary.objects.filter(
+        academic_year_id=academic_year_id, term_id=term_id, currency=currency
+    ).update(**updates)
+    if not updated:
+        # The write that triggered this is already saved, so a fresh build
+        # includes it; the term's other currencies get their own deltas
+        rebuild_summaries(academic_year_id=academic_year_id, term_id=term_id, currency=currency)
+
+
+def term_deltas():
+    """
+    An empty {(year_id, term_id, fee currency): Counter} for a set-based
+    write that skips the per-row deltas to gather its changes in; the
+    counted fields are _apply()'s expected, collected, ledgers, fully_paid
+    and today_amount
+    """
+    return defaultdict(Counter)
+
+
+def record_term_deltas(deltas):
+    """Apply deltas gathered per term and currency, one UPDATE each"""
+    for key, values in deltas.items():
+        _apply(*key, **values)
+
+
+def _refunded(refunds):
+    """{(year_id, term_id, fee currency): total} of the refunds debited from ledgers"""
+    totals = defaultdict(lambda: ZERO)
+    currencies = None
+    for year_id, term_id, grade_id, total in refunds.filter(status__in=REFUNDED_STATUSES).values_list(
+        'ledger__academic_year_id', 'ledger__term_id', 'ledger__student__grade_id'
+    ).annotate(total=Sum('amount')).order_by():
+        if currencies is None:
+            currencies = fee_currencies()
+        totals[(year_id, term_id, fee_currency(currencies, year_id, term_id, grade_id))] += total
+    return totals
+
+
+# Ledger deltas
+
+def ledger_snapshot(ledger, currency):
+    """A ledger's (year_id, term_id, fee currency, total_required, outstanding_balance)"""
+    return (ledger.academic_year_id, ledger.term_id, currency, ledger.total_required, ledger.outstanding_balance)
+
+
+def stored_ledger_snapshot(pk):
+    row = StudentLedger.objects.filter(pk=pk).annotate(currency=fee_currency_expression()).values_list(
+        'academic_year_id', 'term_id', 'currency', 'total_required', 'outstanding_balance'
+    ).first()
+    return tuple(row) if row else None
+
+
+def record_ledger_change(before, after):
+    """Apply the difference between two ledger snapshots (None = no row)"""
+    if before == after:
+        return
+    if before and after and before[:3] == after[:3]:
+        _apply(
+            *before[:3],
+            expected=after[3] - before[3],
+            fully_paid=int(after[4] <= 0) - int(before[4] <= 0),
+        )
+        return
+    if before:
+        _apply(*before[:3], expected=-before[3], ledgers=-1, fully_paid=-int(before[4] <= 0))
+    if after:
+        _apply(*after[:3], expected=after[3], ledgers=1, fully_paid=int(after[4] <= 0))
+
+
+def add_ledger_changes(deltas, changes):
+    """Add the differences of (before, after) ledger snapshot pairs to term_deltas()"""
+    for before, after in changes:
+        if before == after:
+            continue
+        for snapshot, sign in ((before, -1), (after, 1)):
+            if snapshot:
+                deltas[snapshot[:3]].update(
+                    expected=sign * snapshot[3], ledgers=sign, fully_paid=sign * int(snapshot[4] <= 0)
+                )
+    return deltas
+
+
+def record_ledger_payments_removed(ledger):
+    """
+    Take a ledger's verified payments, less its refunds, out of the summary
+    before it is deleted
+    """
+    payments = Payment.objects.filter(ledger=ledger, status='verified')
+    for key, (collected, today) in _collections(payments).items():
+        _apply(*key, collected=-collected, today_amount=-today)
+    for key, refunded in _refunded(Refund.objects.filter(ledger=ledger)).items():
+        _apply(*key, collected=refunded)
+
+
+# Payment deltas
+
+def payment_snapshot(payment):
+    if payment.ledger_id is None:
+        year_id = term_id = None
+    else:
+        year_id, term_id = payment.ledger.academic_year_id, payment.ledger.term_id
+    return (
+        year_id, term_id, payment.status == 'verified', payment.ledger_id,
+        payment.amount, payment.currency, payment.payment_date,
+    )
+
+
+def stored_payment_snapshot(pk):
+    row = Payment.objects.filter(pk=pk).values_list(
+        'ledger__academic_year_id', 'ledger__term_id', 'status', 'ledger_id', 'amount', 'currency', 'payment_date'
+    ).first()
+    if not row:
+        return None
+    year_id, term_id, status, *rest = row
+    return (year_id, term_id, status == 'verified', *rest)
+
+
+def record_payment_change(before, after):
+    """Apply the difference between two payment snapshots (None = no row)"""
+    if before == after:
+        return
+    # (term and ledger currency, amount credited to the ledger, part of it
+    # collected today)
+    counted = [snapshot for snapshot in (before, after) if snapshot and snapshot[2] and snapshot[3] is not None]
+    credited = dict(zip(counted, to_ledger_currency([snapshot[3:] for snapshot in counted])))
+
+    def collected_by(snapshot):
+        if snapshot not in credited:
+            return None
+        currency, amount = credited[snapshot]
+        return (*snapshot[:2], currency), amount, amount if _is_today(snapshot[6]) else ZERO
+
+    old, new = collected_by(before), collected_by(after)
+    if old and new and old[0] == new[0]:
+        _apply(*new[0], collected=new[1] - old[1], today_amount=new[2] - old[2])
+        return
+    if old:
+        _apply(*old[0], collected=-old[1], today_amount=-old[2])
+    if new:
+        _apply(*new[0], collected=new[1], today_amount=new[2])
+
+
+def record_payment_status_change(payments, verified):
+    """
+    Apply a bulk status change before it is written with queryset.update().
+    `payments` is the queryset about to change; `verified` is whether the new
+    status counts as collected.
+    """
+    changing = payments.exclude(status='verified') if verified else payments.filter(status='verified')
+    sign = 1 if verified else -1
+    for key, (collected, today) in _collections(changing.filter(ledger__isnull=False)).items():
+        _apply(*key, collected=sign * collected, today_amount=sign * today)
+
+
+# Full rebuild
+
+def compute_summaries(academic_year_id=None, term_id=None):
+    """
+    Recompute summary values from StudentLedger, Payment and Refund, keyed by
+    (year_id, term_id, fee currency)
+    """
+    ledgers = StudentLedger.objects.filter(academic_year__isnull=False, term__isnull=False)
+    payments = Payment.objects.filter(
+        status='verified', ledger__academic_year__isnull=False, ledger__term__isnull=False
+    )
+    refunds = Refund.objects.filter(ledger__academic_year__isnull=False, ledger__term__isnull=False)
+    if academic_year_id is not None:
+        ledgers = ledgers.filter(academic_year_id=academic_year_id)
+        payments = payments.filter(ledger__academic_year_id=academic_year_id)
+        refunds = refunds.filter(ledger__academic_year_id=academic_year_id)
+    if term_id is not None:
+        ledgers = ledgers.filter(term_id=term_id)
+        payments = payments.filter(ledger__term_id=term_id)
+        refunds = refunds.filter(ledger__term_id=term_id)
+
+    summaries = {}
+    currencies = fee_currencies()
+    for row in ledgers.values('academic_year_id', 'term_id', 'student__grade_id').annotate(
+        expected=Sum('total_required'),
+        count=Count('id'),
+        fully_paid=Count('id', filter=Q(outstanding_balance__lte=0)),
+    ).order_by():
+        year_id, term_id = row['academic_year_id'], row['term_id']
+        values = summaries.setdefault(
+            (year_id, term_id, fee_currency(currencies, year_id, term_id, row['student__grade_id'])), _blank()
+        )
+        values['total_expected'] += _money(row['expected'])
+        values['ledger_count'] += row['count']
+        values['fully_paid_count'] += row['fully_paid']
+
+    for key, (collected, today) in _collections(payments).items():
+        values = summaries.setdefault(key, _blank())
+        values['total_collected'] = _money(collected)
+        values['todays_collections'] = _money(today)
+
+    for key, refunded in _refunded(refunds).items():
+        values = summaries.setdefault(key, _blank())
+        values['total_collected'] = _money(values['total_collected'] - refunded)
+
+    if academic_year_id is not None and term_id is not None and not summaries:
+        # A term with no ledgers yet still gets an (empty) row
+        summaries[(academic_year_id, term_id, reporting_currency())] = _blank()
+    for values in summaries.values():
+        values['total_outstanding'] = values['total_expected'] - values['total_collected']
+    return summaries
+
+
+def rebuild_summaries(academic_year_id=None, term_id=None, dry_run=False, currency=None):
+    """
+    Rebuild summary rows (just those in `currency`, if given) from scratch
+    and return the drift found as a list of (summary_key, field, stored,
+    actual) tuples.
+    """
+    with transaction.atomic():
+        actual = compute_summaries(academic_year_id, term_id)
+        stored_rows = TermCollectionSummary.objects.select_for_update()
+        if academic_year_id is not None:
+            stored_rows = stored_rows.filter(academic_year_id=academic_year_id)
+        if term_id is not None:
+            stored_rows = stored_rows.filter(term_id=term_id)
+        if currency is not None:
+            actual = {key: values for key, values in actual.items() if key[2] == currency}
+            stored_rows = stored_rows.filter(currency=currency)
+        stored = {(row.academic_year_id, row.term_id, row.currency): row for row in stored_rows}
+
+        today = timezone.localdate()
+        drift = []
+        for key in sorted(set(actual) | set(stored)):
+            row = stored.get(key)
+            values = actual.get(key) or _blank()
+            if row is None:
+                drift.append((key, None, None, None))
+            else:
+                stored_values = {field: getattr(row, field) for field in SUMMARY_FIELDS}
+                if row.collections_date != today:
+                    stored_values['todays_collections'] = ZERO
+                drift.extend(
+                    (key, field, stored_values[field], values[field])
+                    for field in SUMMARY_FIELDS if stored_values[field] != values[field]
+                )
+            if dry_run:
+                continue
+            if row is None:
+                try:
+                    with transaction.atomic():
+                        TermCollectionSummary.objects.create(
+                            academic_year_id=key[0], term_id=key[1], currency=key[2], collections_date=today, **values
+                        )
+                    continue
+                except IntegrityError:
+                    # Built concurrently by another writer; overwrite it below
+                    pass
+            TermCollectionSummary.objects.filter(academic_year_id=key[0], term_id=key[1], currency=key[2]).update(
+                collections_date=today, rebuilt_at=timezone.now(), **values
+            )
+    return drift
+
+
+def get_term_summaries(academic_year, term):
+    """A term's summary rows, one per fee currency, built on first use"""
+    if academic_year is None or term is None:
+        return []
+    summaries = list(TermCollectionSummary.objects.filter(academic_year=academic_year, term=term))
+    if not summaries:
+        rebuild_summaries(academic_year_id=academic_year.id, term_id=term.id)
+        summaries = list(TermCollectionSummary.objects.filter(academic_year=academic_year, term=term))
+    return summaries
+
+
+def reporting_totals(summaries, to_currency=None, day=None):
+    """
+    The summed values of summary rows, money converted into to_currency
+    (default REPORTING_CURRENCY) at the rate on `day` (default today); the
+    rate table is only loaded when a row is in another currency
+    """
+    to_currency = to_currency or reporting_currency()
+    day = day or timezone.localdate()
+    totals = _blank()
+    table = None
+    for summary in summaries:
+        values = {field: getattr(summary, field) for field in SUMMARY_FIELDS}
+        values['todays_collections'] = summary.collections_today()
+        for field in SUMMARY_FIELDS:
+            value = values[field]
+            if field in MONEY_FIELDS and summary.currency != to_currency:
+                table = table or get_rate_table()
+                value = table.convert(value, summary.currency, to_currency, day)
+            totals[field] += value
+    return totals
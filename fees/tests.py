@@ -1,3 +1,1621 @@
-from django.test import TestCase
+import json
+import multiprocessing
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
-# Create your tests here.
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from classes.models import Grade
+from students.models import Student
+from students.testing import make_student
+
+from .models import (
+    AcademicYear, AgentPayment, AuditLog, AuditLogArchive, Discount, ExchangeRate, FeeAdjustment, FeeReminder, FeeStructure,
+    Payment, PaymentMethod, PaymentPlan, Receipt, ReceiptSequence, Refund, StudentLedger, Term, TermCollectionSummary
+)
+from . import sms
+from .adjustments import assess_fee_adjustments
+from .audit import archive_audit_log, audit, audit_batch, client_ip
+from .current import VERSION_KEY, clear_current_period, get_current_period, get_current_term
+from .discounts import price_ledgers
+from .exchange import ExchangeRateError, clear_rate_table, converted_totals, get_rate_table
+from .exports import openpyxl
+from .filters import filter_arrears, filter_payments, payment_totals
+from .imports import StatementImportError, import_statement
+from .ledgers import verify_ledgers, verify_ledgers_in_parallel
+from .pagination import KeysetPaginator
+from .payment_actions import approve_refunds, reject_payments, reject_refunds, verify_payments
+from .payment_plans import add_months, allocate_payments, approve_plans, overdue_installments, scan_delinquent_plans
+from .receipts import receipt_data, render_receipt_pdf
+from .reconciliation import reconcile_statement
+from .reminders import queue_reminders, send_pending_reminders
+from .rollover import make_current, rollover_term
+from .sequences import next_receipt_number, reserve_numbers, reset_reserved_blocks
+from .settlements import settle_agents
+from .summary import (
+    compute_summaries, day_bounds, get_term_summaries, rebuild_summaries, record_payment_status_change, reporting_totals,
+)
+
+
+def make_term(name='term1', year_name='2025'):
+    year = AcademicYear.objects.get_or_create(
+        name=year_name, defaults={'start_date': '2025-01-01', 'end_date': '2025-12-31', 'is_current': True}
+    )[0]
+    term = Term.objects.create(
+        name=name, academic_year=year, start_date='2025-01-01', end_date='2025-04-30', is_current=True
+    )
+    return year, term
+
+
+def make_receipt(student, method, clerk, amount=Decimal('10.00')):
+    payment = Payment.objects.create(
+        student=student, amount=amount, payment_method=method,
+        recorded_by=clerk, status='verified'
+    )
+    return Receipt.objects.create(
+        payment=payment, amount_paid=amount, previous_balance=amount,
+        new_balance=0, generated_by=clerk
+    )
+
+
+def _post_receipts_in_process(count, student_id, method_id, clerk_id, queue):
+    # Runs in a forked child: drop the parent's connections first
+    connections.close_all()
+    student = Student.objects.get(id=student_id)
+    method = PaymentMethod.objects.get(id=method_id)
+    clerk = User.objects.get(id=clerk_id)
+    numbers = [make_receipt(student, method, clerk).receipt_number for _ in range(count)]
+    connections.close_all()
+    queue.put(numbers)
+
+
+class ReceiptNumberTests(TestCase):
+    def setUp(self):
+        reset_reserved_blocks()
+        self.clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        self.method = PaymentMethod.objects.create(name='cash')
+        self.student = make_student()
+
+    def test_numbers_are_sequential_per_year(self):
+        self.assertEqual(next_receipt_number(2031), 'RCP-2031-000001')
+        self.assertEqual(next_receipt_number(2031), 'RCP-2031-000002')
+        self.assertEqual(next_receipt_number(2032), 'RCP-2032-000001')
+
+    def test_receipt_save_allocates_number(self):
+        first = make_receipt(self.student, self.method, self.clerk)
+        second = make_receipt(self.student, self.method, self.clerk)
+        self.assertTrue(first.receipt_number.endswith('-000001'))
+        self.assertTrue(second.receipt_number.endswith('-000002'))
+
+    def test_allocation_does_not_scan_receipts(self):
+        make_receipt(self.student, self.method, self.clerk)
+        # Savepoint, UPDATE + SELECT on the sequence row, release; whatever
+        # the receipt count
+        with self.assertNumQueries(4):
+            next_receipt_number()
+
+    def test_reserve_numbers_returns_start_of_block(self):
+        self.assertEqual(reserve_numbers(2040, 50), 1)
+        self.assertEqual(reserve_numbers(2040, 50), 51)
+        self.assertEqual(ReceiptSequence.objects.get(year=2040).last_number, 100)
+
+    @override_settings(RECEIPT_NUMBERS_GAP_FREE=False, RECEIPT_NUMBER_BLOCK_SIZE=10)
+    def test_block_reservation_serves_numbers_from_memory(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(next_receipt_number(2050), 'RCP-2050-000001')
+        with self.assertNumQueries(0):
+            self.assertEqual(next_receipt_number(2050), 'RCP-2050-000002')
+        self.assertEqual(ReceiptSequence.objects.get(year=2050).last_number, 10)
+
+    @override_settings(RECEIPT_NUMBERS_GAP_FREE=True, RECEIPT_NUMBER_BLOCK_SIZE=10)
+    def test_gap_free_rejects_block_size(self):
+        with self.assertRaises(ImproperlyConfigured):
+            next_receipt_number()
+
+
+class ReceiptNumberConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    RECEIPTS_PER_WORKER = 250
+
+    def setUp(self):
+        reset_reserved_blocks()
+        self.clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        self.method = PaymentMethod.objects.create(name='cash')
+        self.student = make_student()
+
+    def _post_from_threads(self):
+        numbers, errors = [], []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                mine = [
+                    make_receipt(self.student, self.method, self.clerk).receipt_number
+                    for _ in range(self.RECEIPTS_PER_WORKER)
+                ]
+                with lock:
+                    numbers.extend(mine)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return numbers
+
+    def test_parallel_threads_get_unique_gap_free_numbers(self):
+        numbers = self._post_from_threads()
+        total = self.THREADS * self.RECEIPTS_PER_WORKER
+        self.assertEqual(len(set(numbers)), total)
+        self.assertEqual(
+            sorted(int(n.split('-')[-1]) for n in numbers),
+            list(range(1, total + 1))
+        )
+
+    @override_settings(RECEIPT_NUMBERS_GAP_FREE=False, RECEIPT_NUMBER_BLOCK_SIZE=20)
+    def test_parallel_threads_with_blocks_get_unique_numbers(self):
+        numbers = self._post_from_threads()
+        self.assertEqual(len(set(numbers)), self.THREADS * self.RECEIPTS_PER_WORKER)
+        self.assertEqual(Receipt.objects.count(), len(numbers))
+
+    def test_parallel_processes_get_unique_numbers(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Forked workers cannot share an in-memory SQLite database')
+        queue = multiprocessing.get_context('fork').Queue()
+        connections.close_all()
+        workers = [
+            multiprocessing.get_context('fork').Process(
+                target=_post_receipts_in_process,
+                args=(self.RECEIPTS_PER_WORKER, self.student.id, self.method.id, self.clerk.id, queue)
+            )
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        numbers = []
+        for _ in workers:
+            numbers.extend(queue.get(timeout=120))
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(set(numbers)), 4 * self.RECEIPTS_PER_WORKER)
+
+
+class TermCollectionSummaryTests(TestCase):
+    def setUp(self):
+        self.clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        self.method = PaymentMethod.objects.create(name='cash')
+        self.year, self.term = make_term()
+        self.students = [make_student(f'pupil{i}@school.com') for i in range(3)]
+        self.ledgers = []
+        for student in self.students:
+            ledger = StudentLedger.objects.create(student=student, academic_year=self.year, term=self.term, term_fees=Decimal('100.00'))
+            ledger.update_balances()
+            self.ledgers.append(ledger)
+
+    def pay(self, ledger, amount, status='verified'):
+        payment = Payment.objects.create(
+            student=ledger.student, ledger=ledger, amount=Decimal(amount),
+            payment_method=self.method, recorded_by=self.clerk, status=status
+        )
+        if status == 'verified':
+            ledger.payments_made += Decimal(amount)
+            ledger.update_balances()
+        return payment
+
+    def assertSummaryMatchesScratch(self):
+        summary = TermCollectionSummary.objects.get(academic_year=self.year, term=self.term)
+        actual = compute_summaries(self.year.id, self.term.id)[(self.year.id, self.term.id, summary.currency)]
+        for field, value in actual.items():
+            self.assertEqual(getattr(summary, field), value, field)
+        return summary
+
+    def test_writes_keep_summary_current(self):
+        self.pay(self.ledgers[0], '100.00')
+        self.pay(self.ledgers[1], '40.00')
+        self.pay(self.ledgers[2], '25.00', status='pending')
+        summary = self.assertSummaryMatchesScratch()
+        self.assertEqual(summary.total_expected, Decimal('300.00'))
+        self.assertEqual(summary.total_collected, Decimal('140.00'))
+        self.assertEqual(summary.total_outstanding, Decimal('160.00'))
+        self.assertEqual(summary.fully_paid_count, 1)
+        self.assertEqual(summary.collections_today(), Decimal('140.00'))
+
+    def test_bulk_status_change_and_delete(self):
+        pending = self.pay(self.ledgers[2], '25.00', status='pending')
+        verified = self.pay(self.ledgers[1], '40.00')
+        payments = Payment.objects.filter(pk=pending.pk)
+        record_payment_status_change(payments, verified=True)
+        payments.update(status='verified')
+        self.assertEqual(TermCollectionSummary.objects.get(term=self.term).total_collected, Decimal('65.00'))
+        verified.delete()
+        self.assertEqual(TermCollectionSummary.objects.get(term=self.term).total_collected, Decimal('25.00'))
+
+    def test_foreign_currency_payments_count_at_the_ledger_currency(self):
+        clear_rate_table()
+        ExchangeRate.objects.create(from_currency='ZAR', to_currency='USD', rate=Decimal('0.0500'), date=date(2025, 1, 1))
+        payment = Payment.objects.create(
+            student=self.students[0], ledger=self.ledgers[0], amount=Decimal('200.00'), currency='ZAR',
+            payment_method=self.method, recorded_by=self.clerk, status='verified',
+        )
+        summary = self.assertSummaryMatchesScratch()
+        self.assertEqual((summary.total_collected, summary.total_outstanding), (Decimal('10.00'), Decimal('290.00')))
+        self.assertEqual(summary.collections_today(), Decimal('10.00'))
+
+        payments = Payment.objects.filter(pk=payment.pk)
+        record_payment_status_change(payments, verified=False)
+        payments.update(status='failed')
+        summary = self.assertSummaryMatchesScratch()
+        self.assertEqual((summary.total_collected, summary.total_outstanding), (Decimal('0.00'), Decimal('300.00')))
+
+    def test_dashboard_reads_one_summary_row(self):
+        self.pay(self.ledgers[0], '100.00')
+        get_term_summaries(self.year, self.term)
+        with self.assertNumQueries(1):
+            get_term_summaries(self.year, self.term)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_each_fee_currency_has_its_own_row_and_totals_are_converted(self):
+        clear_rate_table()
+        ExchangeRate.objects.create(from_currency='ZWL', to_currency='USD', rate=Decimal('0.0100'), date=date(2025, 1, 1))
+        grade = Grade.objects.create(name='Grade 6')
+        FeeStructure.objects.create(
+            academic_year=self.year, term=self.term, grade=grade, tuition_fee=Decimal('3000.00'), currency='ZWL',
+        )
+        ledger = StudentLedger.objects.create(
+            student=make_student('zwl@school.com', grade), academic_year=self.year, term=self.term,
+            term_fees=Decimal('3000.00'),
+        )
+        ledger.update_balances()
+        self.pay(self.ledgers[0], '100.00')
+        Payment.objects.create(
+            student=ledger.student, ledger=ledger, amount=Decimal('10.00'), currency='USD',
+            payment_method=self.method, recorded_by=self.clerk, status='verified',
+        )
+
+        summaries = {summary.currency: summary for summary in get_term_summaries(self.year, self.term)}
+        self.assertEqual(
+            {currency: (summary.total_expected, summary.total_collected) for currency, summary in summaries.items()},
+            {'USD': (Decimal('300.00'), Decimal('100.00')), 'ZWL': (Decimal('3000.00'), Decimal('1000.00'))},
+        )
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+        totals = reporting_totals(summaries.values())
+        self.assertEqual(
+            (totals['total_expected'], totals['total_collected'], totals['total_outstanding'], totals['ledger_count']),
+            (Decimal('330.00'), Decimal('110.00'), Decimal('220.00'), 4),
+        )
+
+        self.client.force_login(self.clerk)
+        response = self.client.get(reverse('fees:fee_management_dashboard'))
+        self.assertContains(response, 'USD 330.00')
+        self.assertContains(response, 'USD 110.00')
+
+    def test_rebuild_command_reports_and_repairs_drift(self):
+        self.pay(self.ledgers[0], '100.00')
+        TermCollectionSummary.objects.update(total_collected=Decimal('1.00'))
+        out = StringIO()
+        call_command('rebuild_collection_summary', '--dry-run', stdout=out)
+        self.assertIn('total_collected stored 1.00, actual 100.00', out.getvalue())
+        call_command('rebuild_collection_summary', stdout=StringIO())
+        self.assertSummaryMatchesScratch()
+
+    def test_rebuild_command_rejects_unknown_year(self):
+        with self.assertRaisesMessage(CommandError, 'No academic year named 1999'):
+            call_command('rebuild_collection_summary', '--year', '1999', stdout=StringIO())
+
+
+class StatementImportTests(TestCase):
+    def setUp(self):
+        self.clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        self.ecocash = PaymentMethod.objects.create(name='ecocash', requires_reference=True)
+        self.year, self.term = make_term()
+        self.students = [make_student(f'pupil{i}@school.com') for i in range(3)]
+        ledger = StudentLedger.objects.create(student=self.students[0], academic_year=self.year, term=self.term, term_fees=Decimal('100.00'))
+        ledger.update_balances()
+
+    def statement(self):
+        return StringIO(
+            'admission_number,amount,date,reference\n'
+            'pupil0@school.com,60.00,2025-02-01,MP1\n'
+            'pupil0@school.com,15.50,02/02/2025,MP2\n'
+            'pupil1@school.com,20,2025-02-03,MP3\n'
+            'nobody@school.com,20,2025-02-03,MP4\n'
+            'pupil2@school.com,abc,2025-02-03,MP5\n'
+            'pupil2@school.com,10,2025-02-03,MP1\n'
+            'pupil2@school.com,NaN,2025-02-03,MP6\n'
+            'pupil2@school.com,Infinity,2025-02-03,MP7\n'
+        )
+
+    def test_import_posts_valid_rows_and_reports_errors(self):
+        result = import_statement(self.statement(), self.clerk, payment_method=self.ecocash)
+        self.assertEqual(result.posted, 3)
+        self.assertEqual([line for line, _ in result.errors], [5, 6, 7, 8, 9])
+        self.assertEqual(result.errors[-1], (9, 'invalid amount "Infinity"'))
+
+        ledger = StudentLedger.objects.get(student=self.students[0], term=self.term)
+        self.assertEqual(ledger.payments_made, Decimal('75.50'))
+        self.assertEqual(ledger.outstanding_balance, Decimal('24.50'))
+        self.assertEqual(Receipt.objects.count(), 3)
+        self.assertEqual(
+            list(Receipt.objects.filter(payment__student=self.students[0]).order_by('receipt_number').values_list('new_balance', flat=True)),
+            [Decimal('40.00'), Decimal('24.50')]
+        )
+        summary = TermCollectionSummary.objects.get(term=self.term)
+        self.assertEqual(summary.total_collected, Decimal('95.50'))
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+
+    def test_rows_keep_their_currency_and_are_credited_in_the_ledger_currency(self):
+        clear_rate_table()
+        ExchangeRate.objects.create(from_currency='ZAR', to_currency='USD', rate=Decimal('0.0500'), date=date(2025, 1, 1))
+        statement = StringIO(
+            'admission_number,amount,currency,date,reference\n'
+            'pupil0@school.com,200.00,zar,2025-02-01,Z1\n'
+            'pupil1@school.com,10,,2025-02-01,Z2\n'
+            'pupil2@school.com,5,XYZ,2025-02-01,Z3\n'
+        )
+        result = import_statement(statement, self.clerk, payment_method=self.ecocash)
+        self.assertEqual((result.posted, result.errors), (2, [(4, 'unknown currency "XYZ"')]))
+        self.assertIn('(USD 10.00, ZAR 200.00)', str(result))
+
+        payment = Payment.objects.get(reference_number='Z1')
+        self.assertEqual((payment.amount, payment.currency), (Decimal('200.00'), 'ZAR'))
+        self.assertEqual(payment.receipt.new_balance, Decimal('90.00'))
+        ledger = StudentLedger.objects.get(student=self.students[0], term=self.term)
+        self.assertEqual((ledger.payments_made, ledger.outstanding_balance), (Decimal('10.00'), Decimal('90.00')))
+        self.assertEqual(verify_ledgers(), [])
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+
+    def test_chunks_add_their_collections_to_the_summary(self):
+        today = timezone.localdate().isoformat()
+        statement = StringIO(
+            'admission_number,amount,date,reference\n'
+            f'pupil0@school.com,100.00,{today},T1\n'
+            f'pupil1@school.com,20,{today},T2\n'
+            'pupil2@school.com,5,2025-02-03,T3\n'
+        )
+        import_statement(statement, self.clerk, payment_method=self.ecocash, chunk_size=2)
+        summary = TermCollectionSummary.objects.get(term=self.term)
+        self.assertEqual(
+            (summary.total_collected, summary.ledger_count, summary.fully_paid_count, summary.collections_today()),
+            (Decimal('125.00'), 3, 3, Decimal('120.00')),
+        )
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+
+    def test_dry_run_and_reimport_post_nothing(self):
+        result = import_statement(self.statement(), self.clerk, payment_method=self.ecocash, dry_run=True)
+        self.assertEqual(result.posted, 3)
+        self.assertEqual(Payment.objects.count(), 0)
+
+        import_statement(self.statement(), self.clerk, payment_method=self.ecocash)
+        again = import_statement(self.statement(), self.clerk, payment_method=self.ecocash)
+        self.assertEqual(again.posted, 0)
+        self.assertEqual(Payment.objects.count(), 3)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        method = PaymentMethod.objects.create(name='cash')
+        student = make_student()
+        moment = timezone.now()
+        # Repeated timestamps so the id tie-breaker matters
+        for i in range(23):
+            Payment.objects.create(
+                student=student, amount=Decimal(i + 1), payment_method=method,
+                recorded_by=clerk, payment_date=moment - timezone.timedelta(hours=i // 3)
+            )
+
+    def test_walks_forwards_and_backwards_without_gaps(self):
+        expected = list(Payment.objects.order_by('-payment_date', '-id').values_list('id', flat=True))
+        paginator = KeysetPaginator(Payment.objects.all(), ('-payment_date', '-id'), 5)
+
+        seen, pages, page = [], [], paginator.get_page()
+        while True:
+            pages.append(page)
+            seen.extend(payment.id for payment in page)
+            if not page.has_next():
+                break
+            page = paginator.get_page(page.next_cursor)
+        self.assertEqual(seen, expected)
+        self.assertFalse(pages[0].has_previous())
+
+        back = paginator.get_page(pages[-1].previous_cursor)
+        self.assertEqual([p.id for p in back], [p.id for p in pages[-2]])
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        paginator = KeysetPaginator(Payment.objects.all(), ('-payment_date', '-id'), 5)
+        self.assertEqual(len(paginator.get_page('not-a-cursor')), 5)
+
+    def test_totals_are_one_query_then_cached(self):
+        cache.clear()
+        with self.assertNumQueries(1):
+            totals = payment_totals({'start_date': '2000-01-01'})
+        self.assertEqual(totals['payment_count'], 23)
+        with self.assertNumQueries(0):
+            payment_totals({'start_date': '2000-01-01'})
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        method = PaymentMethod.objects.create(name='cash')
+        self.student = make_student()
+        Payment.objects.create(student=self.student, amount=Decimal('12.50'), payment_method=method, recorded_by=self.clerk, reference_number='R1')
+        Payment.objects.create(
+            student=self.student, amount=Decimal('7.00'), payment_method=method, recorded_by=self.clerk,
+            payment_date=timezone.now() - timezone.timedelta(days=40)
+        )
+        self.client.force_login(self.clerk)
+
+    def test_payment_export_streams_filtered_csv(self):
+        start = (timezone.localdate() - timezone.timedelta(days=1)).isoformat()
+        response = self.client.get(reverse('fees:export_payments'), {'start_date': start})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'Date')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('12.50,USD', lines[1])
+        self.assertIn('R1', lines[1])
+
+    @skipUnless(openpyxl, 'openpyxl is not installed')
+    def test_payment_export_streams_xlsx_from_a_file(self):
+        with mock.patch('fees.exports.EXPORT_FILE_BLOCK_SIZE', 1024):
+            response = self.client.get(reverse('fees:export_payments'), {'format': 'xlsx'})
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 1024 for chunk in chunks))
+        body = b''.join(chunks)
+        self.assertEqual(int(response['Content-Length']), len(body))
+
+        sheet = openpyxl.load_workbook(BytesIO(body), read_only=True).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(rows[0][:2], ('Date', 'Receipt'))
+        self.assertEqual(sorted(row[6] for row in rows[1:]), [7, 12.5])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='receipts-test-'))
+class ReceiptPdfTests(TestCase):
+    def setUp(self):
+        self.clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        self.method = PaymentMethod.objects.create(name='cash')
+        self.student = make_student()
+        self.receipt = make_receipt(self.student, self.method, self.clerk)
+        self.client.force_login(self.student.user)
+        self.url = reverse('fees:download_receipt', args=(self.receipt.id,))
+
+    def test_download_renders_once_and_serves_from_storage(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        body = b''.join(response.streaming_content)
+        self.assertTrue(body.startswith(b'%PDF-1.4'))
+        self.assertIn(self.receipt.receipt_number.encode(), body)
+
+        self.receipt.refresh_from_db()
+        self.assertTrue(self.receipt.pdf_file.name.startswith('receipts/'))
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_range_request_returns_partial_content(self):
+        full = b''.join(self.client.get(self.url).streaming_content)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-7')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), full[:8])
+        self.assertEqual(response['Content-Range'], f'bytes 0-7/{len(full)}')
+
+    def test_bulk_command_renders_missing_pdfs(self):
+        call_command('render_receipt_pdfs', '--workers', '2', stdout=StringIO())
+        self.receipt.refresh_from_db()
+        self.assertTrue(self.receipt.pdf_file.name.endswith('.pdf'))
+
+    def test_amounts_show_payment_and_ledger_currencies(self):
+        clear_rate_table()
+        ExchangeRate.objects.create(from_currency='USD', to_currency='ZWL', rate=Decimal('100.0000'), date=date(2025, 1, 1))
+        grade = Grade.objects.create(name='Grade 6')
+        year, term = make_term()
+        FeeStructure.objects.create(academic_year=year, term=term, grade=grade, tuition_fee=Decimal('3000.00'), currency='ZWL')
+        student = make_student('zwl@school.com', grade)
+        ledger = StudentLedger.objects.create(student=student, academic_year=year, term=term, term_fees=Decimal('3000.00'))
+        payment = Payment.objects.create(
+            student=student, ledger=ledger, amount=Decimal('5.00'), currency='USD', payment_method=self.method,
+            recorded_by=self.clerk, status='verified',
+        )
+        receipt = Receipt.objects.create(
+            payment=payment, amount_paid=Decimal('5.00'), previous_balance=Decimal('3000.00'),
+            new_balance=Decimal('2500.00'), generated_by=self.clerk,
+        )
+        pdf = render_receipt_pdf(receipt_data(Receipt.objects.filter(pk=receipt.pk)).get())
+        self.assertIn(b'(ZWL 3000.00)', pdf)
+        self.assertIn(b'(USD 5.00)', pdf)
+        self.assertIn(b'(ZWL 2500.00)', pdf)
+
+
+class TermRolloverTests(TestCase):
+    def setUp(self):
+        self.grade1 = Grade.objects.create(name='Grade 1')
+        self.grade2 = Grade.objects.create(name='Grade 2')
+        self.year, self.term1 = make_term()
+        self.term2 = Term.objects.create(
+            name='term2', academic_year=self.year, start_date='2025-05-01', end_date='2025-08-31'
+        )
+        FeeStructure.objects.create(academic_year=self.year, term=self.term2, grade=self.grade1, tuition_fee=Decimal('200.00'))
+        FeeStructure.objects.create(academic_year=self.year, term=self.term2, grade=self.grade2, tuition_fee=Decimal('250.00'))
+
+        self.owing = make_student('owing@school.com', self.grade1)
+        self.paid = make_student('paid@school.com', self.grade2)
+        self.new = make_student('new@school.com', self.grade2)
+        ledger = StudentLedger.objects.create(student=self.owing, academic_year=self.year, term=self.term1, term_fees=Decimal('100.00'), payments_made=Decimal('60.00'))
+        ledger.update_balances()
+        ledger = StudentLedger.objects.create(student=self.paid, academic_year=self.year, term=self.term1, term_fees=Decimal('100.00'), payments_made=Decimal('110.00'))
+        ledger.update_balances()
+
+    def test_rollover_carries_arrears_and_charges_fee_structure(self):
+        result = rollover_term(self.term1, self.term2, batch_size=2)
+        self.assertEqual(result['created'], 3)
+        rows = {
+            ledger.student_id: (ledger.opening_balance, ledger.term_fees, ledger.outstanding_balance)
+            for ledger in StudentLedger.objects.filter(term=self.term2)
+        }
+        self.assertEqual(rows[self.owing.id], (Decimal('40.00'), Decimal('200.00'), Decimal('240.00')))
+        self.assertEqual(rows[self.paid.id], (Decimal('-10.00'), Decimal('250.00'), Decimal('240.00')))
+        self.assertEqual(rows[self.new.id], (Decimal('0.00'), Decimal('250.00'), Decimal('250.00')))
+        self.assertEqual(TermCollectionSummary.objects.get(term=self.term2).total_expected, Decimal('730.00'))
+
+    def test_rollover_is_idempotent_and_assesses_early_ledgers(self):
+        StudentLedger.objects.create(student=self.owing, academic_year=self.year, term=self.term2)
+        first = rollover_term(self.term1, self.term2)
+        second = rollover_term(self.term1, self.term2)
+        self.assertEqual((first['created'], first['assessed']), (2, 1))
+        self.assertEqual((second['created'], second['assessed']), (0, 0))
+        self.assertEqual(StudentLedger.objects.filter(term=self.term2).count(), 3)
+        early = StudentLedger.objects.get(student=self.owing, term=self.term2)
+        self.assertEqual(early.outstanding_balance, Decimal('240.00'))
+        summary = TermCollectionSummary.objects.get(term=self.term2)
+        self.assertEqual((summary.total_expected, summary.ledger_count, summary.fully_paid_count), (Decimal('730.00'), 3, 0))
+        self.assertEqual(rebuild_summaries(self.year.id, self.term2.id, dry_run=True), [])
+
+    def test_batch_colliding_with_a_new_ledger_is_read_again(self):
+        real_bulk_create = StudentLedger.objects.bulk_create
+        attempts = []
+
+        def collide_once(objs, *args, **kwargs):
+            attempts.append(len(objs))
+            if len(attempts) == 1:
+                StudentLedger.objects.create(student=self.new, academic_year=self.year, term=self.term2)
+            return real_bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(StudentLedger.objects, 'bulk_create', side_effect=collide_once):
+            result = rollover_term(self.term1, self.term2)
+        self.assertEqual(attempts, [3, 3])
+        self.assertEqual(result['created'], 3)
+        summary = TermCollectionSummary.objects.get(term=self.term2)
+        self.assertEqual((summary.total_expected, summary.ledger_count), (Decimal('730.00'), 3))
+        self.assertEqual(rebuild_summaries(self.year.id, self.term2.id, dry_run=True), [])
+
+    def test_only_unassessed_ledgers_are_recomputed(self):
+        rollover_term(self.term1, self.term2)
+        # A stale ledger the rollover did not assess is left for verify_ledgers
+        StudentLedger.objects.filter(student=self.paid, term=self.term2).update(outstanding_balance=Decimal('1.00'))
+        StudentLedger.objects.create(student=make_student('late@school.com', self.grade1), academic_year=self.year, term=self.term2)
+        self.assertEqual(rollover_term(self.term1, self.term2)['assessed'], 1)
+        self.assertEqual(StudentLedger.objects.get(student=self.paid, term=self.term2).outstanding_balance, Decimal('1.00'))
+
+
+@skipUnless(os.environ.get('ROLLOVER_BENCHMARK_STUDENTS'), 'set ROLLOVER_BENCHMARK_STUDENTS to run the rollover benchmark')
+class RolloverBenchmarkTests(TestCase):
+    """
+    Time rollover_term over a school of ROLLOVER_BENCHMARK_STUDENTS students
+    (50000 for the published figures), e.g.
+    ROLLOVER_BENCHMARK_STUDENTS=50000 python manage.py test fees.tests.RolloverBenchmarkTests
+    """
+
+    def setUp(self):
+        count = int(os.environ['ROLLOVER_BENCHMARK_STUDENTS'])
+        grades = [Grade.objects.create(name=f'Grade {number}') for number in range(1, 8)]
+        self.year, self.term1 = make_term()
+        self.term2 = Term.objects.create(name='term2', academic_year=self.year, start_date='2025-05-01', end_date='2025-08-31')
+        for number, grade in enumerate(grades):
+            FeeStructure.objects.create(academic_year=self.year, term=self.term2, grade=grade, tuition_fee=Decimal(200 + 10 * number))
+        users = User.objects.bulk_create(
+            [User(username=f'bench{n}', email=f'bench{n}@school.com', role='student') for n in range(count)], batch_size=5000
+        )
+        students = Student.objects.bulk_create(
+            [Student(user=user, grade=grades[n % len(grades)]) for n, user in enumerate(users)], batch_size=5000
+        )
+        # Three in four students have a first-term ledger, some still owing
+        StudentLedger.objects.bulk_create([
+            StudentLedger(
+                student=student, academic_year=self.year, term=self.term1, term_fees=Decimal('100.00'),
+                total_required=Decimal('100.00'), payments_made=Decimal(n % 120), outstanding_balance=Decimal(100 - n % 120),
+            )
+            for n, student in enumerate(students) if n % 4
+        ], batch_size=5000)
+        self.count = count
+
+    def test_rollover_timing(self):
+        started = time.perf_counter()
+        result = rollover_term(self.term1, self.term2)
+        elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        rerun = rollover_term(self.term1, self.term2)
+        rerun_elapsed = time.perf_counter() - started
+        print(f'\nrollover_term: {self.count} students in {elapsed:.2f}s, rerun in {rerun_elapsed:.2f}s')
+
+        self.assertEqual((result['created'], rerun['created']), (self.count, 0))
+        self.assertEqual(TermCollectionSummary.objects.get(term=self.term2).ledger_count, self.count)
+        self.assertEqual(rebuild_summaries(self.year.id, self.term2.id, dry_run=True), [])
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN the fee hot-path queries and fail on a full table scan"""
+
+    def setUp(self):
+        self.year, self.term = make_term()
+        self.clerk = User.objects.create_user(username='planclerk', email='planclerk@school.com', password='pw', is_staff=True)
+        self.method = PaymentMethod.objects.create(name='cash')
+        self.student = make_student()
+        for student in (self.student, make_student('second@school.com')):
+            ledger = StudentLedger.objects.create(student=student, academic_year=self.year, term=self.term, term_fees=Decimal('100.00'))
+            ledger.update_balances()
+            make_receipt(student, self.method, self.clerk)
+
+    def assertIndexed(self, queryset, table, ordering_only=False):
+        """
+        Filtered lookups must seek into an index (SEARCH); walking a whole
+        index in order is only accepted for unfiltered `ordering_only` reads
+        """
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+            self.assertNotIn(f'Seq Scan on {table}', plan, plan)
+            if not ordering_only:
+                self.assertIn('Index Cond', plan, plan)
+        elif connection.vendor == 'sqlite':
+            plan = queryset.explain()
+            details = [line.split(' ', 3)[-1] for line in plan.splitlines()]
+            for detail in details:
+                if detail.startswith(f'SCAN {table}') and not (ordering_only and 'USING' in detail):
+                    self.fail(f'Scan of {table}:\n{plan}')
+            if not ordering_only:
+                self.assertTrue(any(detail.startswith(f'SEARCH {table}') for detail in details), plan)
+
+    def assertPagesIndexed(self, queryset, ordering, table, ordering_only=False):
+        paginator = KeysetPaginator(queryset, ordering, 1)
+        first, _ = paginator.page_queryset()
+        self.assertIndexed(first, table, ordering_only)
+        next_cursor = paginator.get_page().next_cursor
+        previous_cursor = paginator.get_page(next_cursor).previous_cursor
+        self.assertIsNotNone(previous_cursor)
+        for cursor in (next_cursor, previous_cursor):
+            page, _ = paginator.page_queryset(cursor)
+            self.assertIndexed(page, table, ordering_only)
+
+    def test_arrears_pages(self):
+        ledgers = filter_arrears({'min_amount': '10'}, self.year, self.term)
+        self.assertPagesIndexed(ledgers, ('-outstanding_balance', '-id'), 'fees_studentledger')
+
+    def test_payment_history_pages(self):
+        today = timezone.localdate().isoformat()
+        payments = filter_payments({'start_date': today, 'end_date': today})
+        self.assertPagesIndexed(payments, ('-payment_date', '-id'), 'fees_payment')
+
+    def test_delinquency_scan(self):
+        # As the scanner's UPDATE runs it, without the model's default ordering
+        self.assertIndexed(overdue_installments(timezone.localdate()).order_by(), 'fees_paymentplaninstallment')
+
+    def test_verified_payments_in_range(self):
+        start, end = day_bounds(timezone.localdate())
+        self.assertIndexed(
+            Payment.objects.filter(status='verified', payment_date__gte=start, payment_date__lt=end), 'fees_payment'
+        )
+
+    def test_student_payment_history(self):
+        self.assertIndexed(Payment.objects.filter(student=self.student).order_by('-payment_date')[:5], 'fees_payment')
+
+    def test_dashboard_recent_payments(self):
+        self.assertIndexed(Payment.objects.order_by('-payment_date')[:10], 'fees_payment', ordering_only=True)
+
+    def test_term_ledger_aggregate(self):
+        ledgers = StudentLedger.objects.filter(academic_year=self.year, term=self.term, outstanding_balance__lte=0)
+        self.assertIndexed(ledgers.values('academic_year'), 'fees_studentledger')
+
+
+class CurrentPeriodTests(TestCase):
+    def setUp(self):
+        clear_current_period()
+        self.year, self.term = make_term()
+        self.addCleanup(clear_current_period)
+
+    def test_cached_until_year_or_term_saved(self):
+        self.assertEqual(get_current_period(), (self.year, self.term))
+        with self.assertNumQueries(0):
+            get_current_period()
+        self.term.is_current = False
+        self.term.save()
+        self.assertEqual(get_current_period(), (self.year, None))
+
+    def test_make_current_invalidates(self):
+        term2 = Term.objects.create(name='term2', academic_year=self.year, start_date='2025-05-01', end_date='2025-08-31')
+        get_current_period()
+        make_current(term2)
+        self.assertEqual(get_current_term(), term2)
+
+    @override_settings(CURRENT_PERIOD_CACHE='default')
+    def test_shared_cache_version_reloads_other_processes(self):
+        cache.delete(VERSION_KEY)
+        get_current_period()
+        with self.assertNumQueries(0):
+            get_current_period()
+        Term.objects.filter(pk=self.term.pk).update(is_current=False)
+        # Another process bumping the version
+        cache.incr(VERSION_KEY)
+        self.assertIsNone(get_current_term())
+
+    def test_middleware_sets_request_current_term(self):
+        self.client.force_login(User.objects.create_user(username='bursar', email='bursar@school.com', password='pw', is_staff=True))
+        get_current_period()
+        response = self.client.get(reverse('fees:export_ledgers'))
+        self.assertEqual(response.wsgi_request.current_term, self.term)
+        self.assertEqual(response.wsgi_request.current_year, self.year)
+
+
+class BatchFeeInfoTests(TestCase):
+    def setUp(self):
+        clear_current_period()
+        self.addCleanup(clear_current_period)
+        self.year, self.term = make_term()
+        self.owing = make_student('owing@school.com')
+        self.fresh = make_student('fresh@school.com')
+        self.ledger = StudentLedger.objects.create(student=self.owing, academic_year=self.year, term=self.term, term_fees=Decimal('150.00'))
+        self.ledger.update_balances()
+        self.client.force_login(User.objects.create_user(username='cashier', email='cashier@school.com', password='pw', is_staff=True))
+        self.url = reverse('fees:student_fee_info_batch')
+
+    def test_batch_by_id_and_admission_number(self):
+        response = self.client.get(self.url, {'ids': f'{self.owing.id},999999', 'admission_numbers': self.fresh.user.username})
+        data = response.json()
+        self.assertEqual([row['student_id'] for row in data['students']], [self.owing.id, self.fresh.id])
+        self.assertEqual(data['students'][0]['outstanding'], '150.00')
+        self.assertEqual(data['students'][1]['outstanding'], '0')
+        self.assertEqual(data['not_found'], ['999999'])
+
+    def test_if_none_match_until_a_ledger_changes(self):
+        params = {'ids': f'{self.owing.id},{self.fresh.id}'}
+        etag = self.client.get(self.url, params)['ETag']
+        self.assertEqual(self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.ledger.payments_made = Decimal('50.00')
+        self.ledger.update_balances()
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_none_match_until_a_name_or_grade_changes(self):
+        params = {'ids': f'{self.owing.id},{self.fresh.id}'}
+        etag = self.client.get(self.url, params)['ETag']
+
+        user = self.fresh.user
+        user.first_name = 'Tendai'
+        user.save()
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['students'][1]['student_name'], 'Tendai ')
+
+        etag = response['ETag']
+        grade = self.owing.grade
+        grade.name = 'Grade One'
+        grade.save()
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['students'][0]['class'], 'Grade One')
+
+    def test_rejects_empty_batch(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+
+class DiscountPricingTests(TestCase):
+    def setUp(self):
+        clear_current_period()
+        self.addCleanup(clear_current_period)
+        self.grade = Grade.objects.create(name='Grade 3')
+        self.year, self.term = make_term()
+        FeeStructure.objects.create(academic_year=self.year, term=self.term, grade=self.grade, tuition_fee=Decimal('200.00'))
+        self.clerk = User.objects.create_user(username='bursar', email='bursar@school.com', password='pw', is_staff=True)
+        self.students = [make_student(f'pupil{n}@school.com', self.grade) for n in range(3)]
+        for student in self.students:
+            ledger = StudentLedger.objects.create(student=student, academic_year=self.year, term=self.term, term_fees=Decimal('200.00'), payments_made=Decimal('20.00'))
+            ledger.update_balances()
+
+    def discount(self, student, **fields):
+        fields.setdefault('discount_type', 'sibling')
+        return Discount.objects.create(student=student, approved_by=self.clerk, reason='test', **fields)
+
+    def ledger(self, student):
+        return StudentLedger.objects.get(student=student, term=self.term)
+
+    def test_discounts_combine_and_only_discounted_ledgers_change(self):
+        sibling, scholar, _ = self.students
+        self.discount(sibling, percentage=Decimal('10'))
+        self.discount(sibling, discount_type='hardship', fixed_amount=Decimal('15.00'))
+        self.discount(scholar, discount_type='full_scholarship')
+
+        self.assertEqual(price_ledgers(self.year, self.term), 2)
+        ledger = self.ledger(sibling)
+        self.assertEqual((ledger.term_fees, ledger.discount_amount, ledger.outstanding_balance), (Decimal('165.00'), Decimal('35.00'), Decimal('145.00')))
+        self.assertEqual(self.ledger(scholar).outstanding_balance, Decimal('-20.00'))
+        summary = TermCollectionSummary.objects.get(term=self.term)
+        self.assertEqual((summary.total_expected, summary.ledger_count, summary.fully_paid_count), (Decimal('365.00'), 3, 1))
+        # Nothing left to do on a rerun
+        self.assertEqual(price_ledgers(self.year, self.term), 0)
+
+    def test_changing_a_discount_reprices_that_student(self):
+        student = self.students[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            discount = self.discount(student, percentage=Decimal('25'))
+        self.assertEqual(self.ledger(student).term_fees, Decimal('150.00'))
+
+        discount.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            discount.save()
+        ledger = self.ledger(student)
+        self.assertEqual((ledger.term_fees, ledger.discount_amount), (Decimal('200.00'), Decimal('0.00')))
+
+
+class FeeAdjustmentTests(TestCase):
+    def setUp(self):
+        self.grade = Grade.objects.create(name='Grade 4')
+        self.year, self.term = make_term()
+        FeeStructure.objects.create(
+            academic_year=self.year, term=self.term, grade=self.grade, tuition_fee=Decimal('200.00'),
+            payment_deadline='2025-02-15', late_payment_penalty=Decimal('10'), early_payment_discount=Decimal('5'),
+        )
+        self.late = make_student('late@school.com', self.grade)
+        self.early = make_student('early@school.com', self.grade)
+        for student, paid, paid_on in ((self.late, '50.00', None), (self.early, '200.00', '2025-02-01T09:00:00Z')):
+            ledger = StudentLedger.objects.create(
+                student=student, academic_year=self.year, term=self.term, term_fees=Decimal('200.00'),
+                payments_made=Decimal(paid), last_payment_date=paid_on,
+            )
+            ledger.update_balances()
+
+    def test_penalty_and_credit_are_applied_once(self):
+        self.assertEqual(assess_fee_adjustments(self.year, self.term, today=date(2025, 2, 14)), {'penalised': 0, 'credited': 0})
+
+        after_deadline = date(2025, 3, 1)
+        self.assertEqual(assess_fee_adjustments(self.year, self.term, today=after_deadline), {'penalised': 1, 'credited': 1})
+        self.assertEqual(assess_fee_adjustments(self.year, self.term, today=after_deadline), {'penalised': 0, 'credited': 0})
+
+        late = StudentLedger.objects.get(student=self.late)
+        self.assertEqual((late.adjustments, late.total_required, late.outstanding_balance), (Decimal('15.00'), Decimal('215.00'), Decimal('165.00')))
+        early = StudentLedger.objects.get(student=self.early)
+        self.assertEqual((early.adjustments, early.outstanding_balance), (Decimal('-10.00'), Decimal('-10.00')))
+        self.assertEqual(FeeAdjustment.objects.count(), 2)
+        summary = TermCollectionSummary.objects.get(term=self.term)
+        self.assertEqual((summary.total_expected, summary.fully_paid_count), (Decimal('405.00'), 1))
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+
+        # Later balance recalculations keep the adjustment
+        late.update_balances()
+        self.assertEqual(late.outstanding_balance, Decimal('165.00'))
+
+    def test_each_structure_adjusts_only_its_own_ledgers(self):
+        for name in ('Grade 5', 'Grade 6'):
+            grade = Grade.objects.create(name=name)
+            FeeStructure.objects.create(
+                academic_year=self.year, term=self.term, grade=grade, tuition_fee=Decimal('100.00'),
+                payment_deadline='2025-02-15', late_payment_penalty=Decimal('10'),
+            )
+            ledger = StudentLedger.objects.create(
+                student=make_student(f'{name}@school.com', grade), academic_year=self.year, term=self.term,
+                term_fees=Decimal('100.00'),
+            )
+            ledger.update_balances()
+
+        self.assertEqual(assess_fee_adjustments(self.year, self.term, today=date(2025, 3, 1)), {'penalised': 3, 'credited': 1})
+        late = StudentLedger.objects.get(student=self.late)
+        self.assertEqual((late.adjustments, late.outstanding_balance), (Decimal('15.00'), Decimal('165.00')))
+        for ledger in StudentLedger.objects.filter(student__grade__name__in=('Grade 5', 'Grade 6')):
+            self.assertEqual((ledger.adjustments, ledger.outstanding_balance), (Decimal('10.00'), Decimal('110.00')))
+        self.assertEqual(FeeAdjustment.objects.filter(kind='late_penalty').count(), 3)
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+
+
+class FailingSMSBackend(sms.BaseBackend):
+    def send(self, phone, text):
+        raise sms.SMSError('gateway down')
+
+
+class SMSGatewayStub(BaseHTTPRequestHandler):
+    received = []
+
+    def do_POST(self):
+        self.received.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        self.send_response(202)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class SMTPServerStub(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept messages, counting the connections made"""
+    connections = 0
+    received = []
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        type(self).connections += 1
+        self.reply('220 stub ESMTP')
+        for line in self.rfile:
+            verb = line[:4].decode().upper()
+            if verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                message = []
+                for data in self.rfile:
+                    if data == b'.\r\n':
+                        break
+                    message.append(data)
+                self.received.append(b''.join(message).decode())
+                self.reply('250 Queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+@override_settings(
+    SMS_BACKEND='fees.sms.LocmemBackend', REMINDER_EMAIL_RATE=0, REMINDER_SMS_RATE=0, REMINDER_MAX_ATTEMPTS=2,
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+)
+class FeeReminderTests(TestCase):
+    def setUp(self):
+        sms.outbox.clear()
+        self.grade = Grade.objects.create(name='Grade 5')
+        self.year, self.term = make_term()
+        FeeStructure.objects.create(
+            academic_year=self.year, term=self.term, grade=self.grade, tuition_fee=Decimal('100.00'), currency='ZAR',
+            payment_deadline='2025-02-15',
+        )
+        self.owing = make_student('owing@school.com', self.grade)
+        self.owing.guardian_phone = '+263771000000'
+        self.owing.save()
+        self.paid = make_student('paid@school.com', self.grade)
+        for student, paid in ((self.owing, Decimal('0.00')), (self.paid, Decimal('100.00'))):
+            ledger = StudentLedger.objects.create(student=student, academic_year=self.year, term=self.term, term_fees=Decimal('100.00'), payments_made=paid)
+            ledger.update_balances()
+
+    def test_queue_selects_owing_ledgers_once(self):
+        today = date(2025, 3, 1)
+        self.assertEqual(queue_reminders('overdue', self.year, self.term, today=today), 1)
+        self.assertEqual(queue_reminders('overdue', self.year, self.term, today=today), 0)
+        self.assertEqual(queue_reminders('payment_due', self.year, self.term, today=today), 0)
+        reminder = FeeReminder.objects.get()
+        self.assertIn('ZAR 100.00', reminder.message)
+        self.assertEqual((reminder.status, reminder.email_status, reminder.sms_status), ('queued', 'pending', 'pending'))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_worker_delivers_both_channels(self):
+        queue_reminders('overdue', self.year, self.term, today=date(2025, 3, 1))
+        self.assertEqual(send_pending_reminders(), {'sent': 1, 'retrying': 0, 'failed': 0})
+        self.assertEqual(mail.outbox[0].to, ['owing@school.com'])
+        self.assertEqual(sms.outbox[0][0], '+263771000000')
+        reminder = FeeReminder.objects.get()
+        self.assertEqual((reminder.status, reminder.sent_via_email, reminder.sent_via_sms), ('done', True, True))
+        self.assertEqual(send_pending_reminders(), {'sent': 0, 'retrying': 0, 'failed': 0})
+
+    @override_settings(SMS_BACKEND='fees.tests.FailingSMSBackend', REMINDER_RETRY_DELAY=0)
+    def test_failed_channel_is_retried_then_marked_failed(self):
+        queue_reminders('overdue', self.year, self.term, today=date(2025, 3, 1))
+        self.assertEqual(send_pending_reminders(max_batches=1), {'sent': 0, 'retrying': 1, 'failed': 0})
+        reminder = FeeReminder.objects.get()
+        self.assertEqual((reminder.status, reminder.email_status, reminder.sms_status), ('queued', 'sent', 'pending'))
+
+        self.assertEqual(send_pending_reminders(), {'sent': 0, 'retrying': 0, 'failed': 1})
+        reminder.refresh_from_db()
+        self.assertEqual((reminder.status, reminder.sms_status, reminder.attempts), ('done', 'failed', 2))
+        self.assertIn('gateway down', reminder.last_error)
+        # The email went out once, not on every attempt
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_emails_go_out_over_one_smtp_connection(self):
+        for number in range(2):
+            student = make_student(f'owing{number}@school.com', self.grade)
+            ledger = StudentLedger.objects.create(student=student, academic_year=self.year, term=self.term, term_fees=Decimal('100.00'))
+            ledger.update_balances()
+        queue_reminders('overdue', self.year, self.term, today=date(2025, 3, 1))
+
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPServerStub)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        SMTPServerStub.connections, SMTPServerStub.received = 0, []
+        with override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=server.server_address[1], EMAIL_USE_TLS=False, EMAIL_HOST_USER='',
+        ):
+            self.assertEqual(send_pending_reminders(), {'sent': 3, 'retrying': 0, 'failed': 0})
+        self.assertEqual(SMTPServerStub.connections, 1)
+        self.assertEqual(
+            sorted(next(line for line in message.splitlines() if line.startswith('To: ')) for message in SMTPServerStub.received),
+            ['To: owing0@school.com', 'To: owing1@school.com', 'To: owing@school.com'],
+        )
+
+    def test_http_backend_reuses_one_connection(self):
+        server = HTTPServer(('127.0.0.1', 0), SMSGatewayStub)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        SMSGatewayStub.received = []
+        with override_settings(SMS_GATEWAY_URL=f'http://127.0.0.1:{server.server_port}/send'):
+            with sms.HttpBackend() as backend:
+                backend.send('+263771000001', 'one')
+                connection_used = backend.connection
+                backend.send('+263771000002', 'two')
+                self.assertIs(backend.connection, connection_used)
+        self.assertEqual([message['to'] for message in SMSGatewayStub.received], ['+263771000001', '+263771000002'])
+
+
+class BankReconciliationTests(TestCase):
+    def setUp(self):
+        self.clerk = User.objects.create_user(username='bursar', email='bursar@school.com', password='pw', is_staff=True)
+        self.method = PaymentMethod.objects.create(name='bank_transfer')
+        self.student = make_student()
+
+    def pay(self, amount, when, reference=''):
+        return Payment.objects.create(
+            student=self.student, amount=Decimal(amount), payment_method=self.method, reference_number=reference,
+            payment_date=timezone.make_aware(timezone.datetime.fromisoformat(when)), recorded_by=self.clerk, status='verified',
+        )
+
+    def test_reference_then_amount_and_date_matching(self):
+        by_reference = self.pay('120.00', '2025-03-03 10:00', reference='FT2503')
+        by_amount = self.pay('75.00', '2025-03-05 09:00')
+        self.pay('40.00', '2025-03-10 09:00')
+        self.pay('40.00', '2025-03-11 09:00')
+        missing = self.pay('15.00', '2025-03-12 09:00')
+        statement = StringIO(
+            'Date,Amount,Reference,Description\n'
+            '2025-03-04,120.00,ft2503 ,Transfer\n'
+            '2025-03-06,75.00,,Cash deposit\n'
+            '2025-03-10,40.00,,Deposit\n'
+            '2025-03-20,99.00,XYZ,Unknown\n'
+            '2025-03-21,-50.00,,Bank charges\n'
+        )
+        report = reconcile_statement(statement, self.clerk)
+        self.assertEqual([(line.line_number, line.payment_id, line.match_type) for line in report.matched],
+                         [(2, by_reference.id, 'reference'), (3, by_amount.id, 'amount_date')])
+        self.assertEqual([line.line_number for line in report.ambiguous], [4])
+        self.assertEqual(len(report.ambiguous[0].candidates), 2)
+        self.assertEqual([line.line_number for line in report.unmatched], [5])
+        self.assertIn(missing.id, report.unmatched_payments)
+
+        reconciliation = report.reconciliation
+        self.assertEqual((reconciliation.bank_balance, reconciliation.book_balance), (Decimal('334.00'), Decimal('170.00')))
+        self.assertEqual(reconciliation.lines.filter(status='matched').count(), 2)
+
+        # Payments matched once are not matched again by a later statement
+        again = reconcile_statement(StringIO('Date,Amount,Reference\n2025-03-04,120.00,FT2503\n'), self.clerk, dry_run=True)
+        self.assertEqual(len(again.unmatched), 1)
+
+    def test_bad_statement_is_rejected(self):
+        with self.assertRaises(StatementImportError):
+            reconcile_statement(StringIO('Date,Reference\n2025-03-04,FT1\n'), self.clerk)
+        with self.assertRaises(StatementImportError):
+            reconcile_statement(StringIO('Date,Amount\n2025-03-04,lots\n'), self.clerk)
+
+
+class AgentSettlementTests(TestCase):
+    def setUp(self):
+        self.clerk = User.objects.create_user(username='bursar', email='bursar@school.com', password='pw', is_staff=True)
+        self.student = make_student()
+
+    def collect(self, agent, amount, day, status='verified', rate=Decimal('5.00')):
+        return AgentPayment.objects.create(
+            agent_name=agent, agent_phone=f'+26377{len(agent)}', student=self.student, amount=Decimal(amount),
+            reference=f'{agent}-{amount}-{day}', collected_at=timezone.make_aware(timezone.datetime(2025, 3, day, 12)),
+            recorded_by=self.clerk, status=status, commission_rate=rate,
+        )
+
+    def test_settles_per_agent_in_a_fixed_number_of_queries(self):
+        for day in range(1, 11):
+            self.collect('Chipo', '100.00', day)
+            self.collect('Tendai', '33.33', day, rate=Decimal('2.50'))
+        pending = self.collect('Chipo', '50.00', 5, status='pending')
+        later = self.collect('Chipo', '70.00', 31)
+        AgentPayment.objects.update(commission_amount=0)  # as left by bulk loads
+
+        with self.assertNumQueries(8):
+            settlements = settle_agents(self.clerk, date(2025, 3, 1), date(2025, 3, 30))
+        by_agent = {s.agent_name: (s.payment_count, s.total_collected, s.total_commission, s.net_payable) for s in settlements}
+        self.assertEqual(by_agent, {
+            'Chipo': (10, Decimal('1000.00'), Decimal('50.00'), Decimal('950.00')),
+            'Tendai': (10, Decimal('333.30'), Decimal('8.30'), Decimal('325.00')),
+        })
+        self.assertEqual(AgentPayment.objects.filter(status='paid', settlement__isnull=False).count(), 20)
+        pending.refresh_from_db()
+        later.refresh_from_db()
+        self.assertEqual((pending.status, later.status), ('pending', 'verified'))
+        self.assertEqual(AuditLog.objects.filter(action_type='agent_settled').count(), 2)
+
+        # Nothing is settled twice
+        self.assertEqual(settle_agents(self.clerk, date(2025, 3, 1), date(2025, 3, 30)), [])
+
+
+class ExchangeRateTests(TestCase):
+    def setUp(self):
+        clear_rate_table()
+        cache.clear()
+        ExchangeRate.objects.create(from_currency='ZAR', to_currency='USD', rate=Decimal('0.0500'), date=date(2025, 1, 1))
+        ExchangeRate.objects.create(from_currency='ZAR', to_currency='USD', rate=Decimal('0.0550'), date=date(2025, 2, 1))
+        ExchangeRate.objects.create(from_currency='USD', to_currency='ZWL', rate=Decimal('25.0000'), date=date(2025, 1, 1))
+
+    def test_rate_as_of_date(self):
+        table = get_rate_table()
+        self.assertEqual(table.rate('ZAR', 'USD', date(2025, 1, 31)), Decimal('0.0500'))
+        self.assertEqual(table.rate('ZAR', 'USD', date(2025, 2, 1)), Decimal('0.0550'))
+        self.assertEqual(table.convert(Decimal('100.00'), 'USD', 'ZAR', date(2025, 1, 15)), Decimal('2000.00'))
+        self.assertEqual(table.convert(Decimal('100.00'), 'ZAR', 'ZWL', date(2025, 3, 1)), Decimal('137.50'))
+        with self.assertRaises(ExchangeRateError):
+            table.rate('ZAR', 'USD', date(2024, 12, 31))
+
+    def test_saving_a_rate_invalidates_the_table(self):
+        get_rate_table()
+        with self.assertNumQueries(0):
+            get_rate_table()
+        ExchangeRate.objects.create(from_currency='ZAR', to_currency='USD', rate=Decimal('0.0600'), date=date(2025, 3, 1))
+        self.assertEqual(get_rate_table().rate('ZAR', 'USD', date(2025, 3, 2)), Decimal('0.0600'))
+
+    def test_totals_convert_each_payment_at_its_own_date(self):
+        clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        method = PaymentMethod.objects.create(name='cash')
+        student = make_student()
+        for day in (date(2025, 1, 20), date(2025, 2, 20)):
+            for currency, amount in (('USD', '10.00'), ('ZAR', '200.00')) * 10:
+                Payment.objects.create(
+                    student=student, amount=Decimal(amount), currency=currency, payment_method=method,
+                    recorded_by=clerk, payment_date=timezone.make_aware(timezone.datetime.combine(day, timezone.datetime.min.time())),
+                )
+        payments = Payment.objects.all()
+
+        with self.assertNumQueries(2):  # the rates, then one grouped sum
+            total, count = converted_totals(payments)
+        # Each day: 100 USD and 2000 ZAR, at 0.05 in January and 0.055 in February
+        self.assertEqual((total, count), (Decimal('410.00'), 40))
+
+        with self.assertNumQueries(1):  # nothing to convert, so no rates
+            self.assertEqual(converted_totals(payments.filter(currency='USD')), (Decimal('200.00'), 20))
+
+
+class PaymentPlanTests(TestCase):
+    def setUp(self):
+        self.year, self.term = make_term()
+        self.bursar = User.objects.create_user(username='bursar', email='bursar@school.com', password='pw', is_staff=True)
+        self.method = PaymentMethod.objects.create(name='cash')
+        self.student = make_student()
+        self.client.force_login(self.student.user)
+        clear_current_period()
+        self.client.post(reverse('fees:request_payment_plan'), {'total_amount': '100.00', 'installments': '3'})
+        self.plan = PaymentPlan.objects.get()
+
+    def pay(self, amount, student=None):
+        return Payment.objects.create(
+            student=student or self.student, amount=Decimal(amount), payment_method=self.method,
+            recorded_by=self.bursar, status='verified',
+        )
+
+    def test_request_waits_for_approval_then_schedules_installments(self):
+        self.assertEqual(self.plan.status, 'pending')
+        self.assertEqual(self.plan.end_date, add_months(self.plan.start_date, 2))
+        self.assertFalse(self.plan.installments.exists())
+
+        self.assertEqual(approve_plans(PaymentPlan.objects.all(), self.bursar, today=date(2025, 1, 31)), 1)
+        self.plan.refresh_from_db()
+        self.assertEqual((self.plan.status, self.plan.approved_by), ('active', self.bursar))
+        schedule = list(self.plan.installments.values_list('number', 'due_date', 'amount'))
+        start = self.plan.start_date
+        self.assertEqual(schedule, [
+            (1, start, Decimal('33.33')), (2, add_months(start, 1), Decimal('33.33')), (3, add_months(start, 2), Decimal('33.34')),
+        ])
+        self.assertEqual(add_months(date(2025, 1, 31), 1), date(2025, 2, 28))
+        # Approving again does nothing
+        self.assertEqual(approve_plans(PaymentPlan.objects.all(), self.bursar), 0)
+
+    def test_payments_fill_installments_earliest_first(self):
+        approve_plans(PaymentPlan.objects.all(), self.bursar)
+        other = make_student('other@school.com')
+        allocated = allocate_payments([self.pay('40.00'), self.pay('10.00'), self.pay('5.00', student=other)])
+        self.assertEqual(allocated, Decimal('50.00'))
+        self.assertEqual(
+            list(self.plan.installments.values_list('status', 'amount_paid')),
+            [('paid', Decimal('33.33')), ('partial', Decimal('16.67')), ('pending', Decimal('0.00'))],
+        )
+
+        allocate_payments([self.pay('60.00')])
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.status, 'completed')
+        self.assertFalse(self.plan.installments.exclude(status='paid').exists())
+
+    def test_payments_count_at_the_amount_credited_to_the_ledger(self):
+        approve_plans(PaymentPlan.objects.all(), self.bursar)
+        clear_rate_table()
+        ExchangeRate.objects.create(from_currency='ZAR', to_currency='USD', rate=Decimal('0.0500'), date=date(2025, 1, 1))
+        ledger = StudentLedger.objects.create(student=self.student, academic_year=self.year, term=self.term)
+        payment = Payment.objects.create(
+            student=self.student, ledger=ledger, amount=Decimal('400.00'), currency='ZAR',
+            payment_method=self.method, recorded_by=self.bursar, status='verified',
+        )
+        self.assertEqual(allocate_payments([payment]), Decimal('20.00'))
+        self.assertEqual(
+            list(self.plan.installments.values_list('status', 'amount_paid'))[0], ('partial', Decimal('20.00'))
+        )
+
+    def test_rejected_payments_come_off_the_plan(self):
+        approve_plans(PaymentPlan.objects.all(), self.bursar)
+        payments = [self.pay('60.00'), self.pay('40.00')]
+        allocate_payments(payments)
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.status, 'completed')
+
+        self.assertEqual(reject_payments(Payment.objects.filter(pk=payments[0].pk), self.bursar), 1)
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.status, 'active')
+        self.assertEqual(
+            list(self.plan.installments.values_list('status', 'amount_paid')),
+            [('paid', Decimal('33.33')), ('partial', Decimal('6.67')), ('pending', Decimal('0.00'))],
+        )
+
+    @override_settings(PAYMENT_PLAN_GRACE_DAYS=3)
+    def test_scanner_defaults_plans_with_overdue_installments(self):
+        approve_plans(PaymentPlan.objects.all(), self.bursar)
+        start = self.plan.start_date
+        allocate_payments([self.pay('33.33')])
+
+        self.assertEqual(scan_delinquent_plans(today=add_months(start, 1) + timedelta(days=3)), {'overdue': 0, 'defaulted': 0})
+        with self.assertNumQueries(4):  # savepoint, two UPDATEs, release
+            result = scan_delinquent_plans(today=add_months(start, 1) + timedelta(days=4))
+        self.assertEqual(result, {'overdue': 1, 'defaulted': 1})
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.status, 'defaulted')
+        self.assertEqual(
+            list(self.plan.installments.values_list('status', flat=True)), ['paid', 'overdue', 'pending']
+        )
+        # Late payments still count against the installments
+        allocate_payments([self.pay('33.33')])
+        self.assertEqual(self.plan.installments.get(number=2).status, 'paid')
+
+
+class AuditLogTests(TestCase):
+    def setUp(self):
+        self.clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        self.student = make_student()
+
+    def test_entries_are_written_together_once_committed(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.7', HTTP_USER_AGENT='Firefox')
+        with audit_batch(request) as buffer:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for amount in ('1.00', '2.00', '3.00'):
+                        audit(self.clerk, 'payment_recorded', 'Payment', student=self.student, amount=Decimal(amount))
+                try:
+                    with transaction.atomic():
+                        audit(self.clerk, 'payment_recorded', 'Rolled back')
+                        raise ValueError
+                except ValueError:
+                    pass
+            self.assertEqual(len(buffer.entries), 3)
+            self.assertFalse(AuditLog.objects.exists())
+            with self.assertNumQueries(1):
+                buffer.flush()
+        self.assertEqual(
+            set(AuditLog.objects.values_list('ip_address', 'user_agent', 'description')),
+            {('10.0.0.7', 'Firefox', 'Payment')},
+        )
+        self.assertEqual(AuditLog.objects.count(), 3)
+
+    def test_forwarded_address_only_when_trusted(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='196.1.2.3, 10.0.0.1')
+        self.assertEqual(client_ip(request), '10.0.0.1')
+        with override_settings(AUDIT_TRUST_X_FORWARDED_FOR=True):
+            self.assertEqual(client_ip(request), '196.1.2.3')
+
+    def test_recorded_payment_is_audited_with_request_details(self):
+        make_term()
+        clear_current_period()
+        method = PaymentMethod.objects.create(name='cash')
+        self.client.force_login(self.clerk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('fees:record_payment'),
+                {'student': self.student.id, 'amount': '25.00', 'payment_method': method.id, 'currency': 'USD'},
+                REMOTE_ADDR='10.0.0.9', HTTP_USER_AGENT='Chrome',
+            )
+        entry = AuditLog.objects.get(action_type='payment_recorded')
+        self.assertEqual((entry.ip_address, entry.user_agent, entry.amount), ('10.0.0.9', 'Chrome', Decimal('25.00')))
+
+    def test_unknown_currency_is_rejected_before_recording(self):
+        make_term()
+        clear_current_period()
+        method = PaymentMethod.objects.create(name='cash')
+        self.client.force_login(self.clerk)
+        response = self.client.post(
+            reverse('fees:record_payment'),
+            {'student': self.student.id, 'amount': '25.00', 'payment_method': method.id, 'currency': 'EUR'},
+        )
+        self.assertRedirects(response, reverse('fees:record_payment'), fetch_redirect_response=False)
+        self.assertEqual(
+            [str(message) for message in get_messages(response.wsgi_request)],
+            ['Unknown currency EUR; payments can be recorded in USD, ZWL, ZAR.'],
+        )
+        self.assertFalse(Payment.objects.exists())
+
+    def test_closed_months_move_to_archive_tables(self):
+        for month, count in ((1, 3), (2, 2), (3, 1)):
+            for _ in range(count):
+                entry = AuditLog.objects.create(user=self.clerk, action_type='ledger_edited', description=f'month {month}')
+                AuditLog.objects.filter(pk=entry.pk).update(timestamp=timezone.make_aware(timezone.datetime(2024, month, 15)))
+        recent = AuditLog.objects.create(user=self.clerk, action_type='ledger_edited', description='now')
+
+        moved = archive_audit_log(before=date(2024, 3, 1))
+        self.assertEqual(moved, {date(2024, 1, 1): 3, date(2024, 2, 1): 2})
+        self.assertEqual(set(AuditLog.objects.values_list('description', flat=True)), {'month 3', 'now'})
+        self.assertEqual(list(AuditLogArchive.objects.values_list('table_name', 'row_count')), [
+            ('fees_auditlog_2024_02', 2), ('fees_auditlog_2024_01', 3),
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT description FROM fees_auditlog_2024_01')
+            self.assertEqual([row[0] for row in cursor.fetchall()], ['month 1'] * 3)
+
+        # Nothing left to move
+        self.assertEqual(archive_audit_log(before=date(2024, 3, 1)), {})
+        self.assertTrue(AuditLog.objects.filter(pk=recent.pk).exists())
+
+
+class LedgerVerificationTests(TestCase):
+    def setUp(self):
+        clear_rate_table()
+        self.year, self.term = make_term()
+        self.clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        self.method = PaymentMethod.objects.create(name='cash')
+        self.ledgers = []
+        for index, grade_name in enumerate(('Grade 1', 'Grade 2')):
+            grade = Grade.objects.get_or_create(name=grade_name)[0]
+            for pupil in range(2):
+                ledger = StudentLedger.objects.create(
+                    student=make_student(f'pupil{index}{pupil}@school.com', grade),
+                    academic_year=self.year, term=self.term, term_fees=Decimal('100.00'),
+                )
+                ledger.update_balances()
+                self.ledgers.append(ledger)
+        ExchangeRate.objects.create(from_currency='ZAR', to_currency='USD', rate=Decimal('0.0500'), date=date(2025, 1, 1))
+
+    def pay(self, ledger, amount, currency='USD', status='verified'):
+        # As the admin status actions do: the ledger counters are not touched
+        return Payment.objects.create(
+            student=ledger.student, ledger=ledger, amount=Decimal(amount), currency=currency,
+            payment_method=self.method, recorded_by=self.clerk, status=status,
+        )
+
+    def test_reports_and_repairs_drift(self):
+        first, second = self.ledgers[:2]
+        self.pay(first, '40.00')
+        latest = self.pay(first, '200.00', currency='ZAR')
+        self.pay(second, '30.00', status='pending')
+
+        drift = verify_ledgers()
+        self.assertEqual(
+            {(ledger_id, field): actual for ledger_id, field, _, actual in drift},
+            {
+                (first.id, 'payments_made'): Decimal('50.00'),
+                (first.id, 'outstanding_balance'): Decimal('50.00'),
+                (first.id, 'last_payment_date'): latest.payment_date,
+            },
+        )
+        first.refresh_from_db()
+        self.assertEqual(first.payments_made, Decimal('0.00'))
+
+        verify_ledgers(repair=True)
+        first.refresh_from_db()
+        self.assertEqual((first.payments_made, first.outstanding_balance), (Decimal('50.00'), Decimal('50.00')))
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+        self.assertEqual(verify_ledgers(), [])
+
+    def test_queries_do_not_grow_with_ledgers(self):
+        for ledger in self.ledgers:
+            self.pay(ledger, '10.00')
+        get_rate_table()
+        # Savepoint, fee currencies, ledger currencies, GROUP BYs of payments and refunds, ledgers, release
+        with self.assertNumQueries(7):
+            drift = verify_ledgers(grade_ids=[self.ledgers[0].student.grade_id])
+        self.assertEqual(len({ledger_id for ledger_id, *_ in drift}), 2)
+
+
+class ParallelLedgerVerificationTests(TransactionTestCase):
+    def test_grades_are_repaired_in_worker_processes(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Forked workers cannot share an in-memory SQLite database')
+        year, term = make_term()
+        clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        method = PaymentMethod.objects.create(name='cash')
+        ledgers = []
+        for grade_name in ('Grade 1', 'Grade 2', 'Grade 3'):
+            grade = Grade.objects.create(name=grade_name)
+            ledger = StudentLedger.objects.create(
+                student=make_student(f'{grade_name}@school.com'.replace(' ', ''), grade),
+                academic_year=year, term=term, term_fees=Decimal('100.00'),
+            )
+            ledger.update_balances()
+            Payment.objects.create(
+                student=ledger.student, ledger=ledger, amount=Decimal('25.00'),
+                payment_method=method, recorded_by=clerk, status='verified',
+            )
+            ledgers.append(ledger)
+
+        drift = verify_ledgers_in_parallel(3, repair=True)
+        self.assertEqual(len({ledger_id for ledger_id, *_ in drift}), 3)
+        self.assertEqual(
+            set(StudentLedger.objects.values_list('payments_made', 'outstanding_balance')),
+            {(Decimal('25.00'), Decimal('75.00'))},
+        )
+        self.assertEqual(verify_ledgers(), [])
+
+
+class BulkPaymentActionTests(TestCase):
+    def setUp(self):
+        clear_rate_table()
+        clear_current_period()
+        self.year, self.term = make_term()
+        self.clerk = User.objects.create_user(username='clerk@school.com', email='clerk@school.com', password='x', is_staff=True)
+        self.method = PaymentMethod.objects.create(name='cash')
+        self.ledgers = []
+        for pupil in range(3):
+            ledger = StudentLedger.objects.create(
+                student=make_student(f'pupil{pupil}@school.com'),
+                academic_year=self.year, term=self.term, term_fees=Decimal('100.00'),
+            )
+            ledger.update_balances()
+            self.ledgers.append(ledger)
+        ExchangeRate.objects.create(from_currency='ZAR', to_currency='USD', rate=Decimal('0.0500'), date=date(2025, 1, 1))
+
+    def pay(self, ledger, amount, currency='USD', status='pending'):
+        return Payment.objects.create(
+            student=ledger.student, ledger=ledger, amount=Decimal(amount), currency=currency,
+            payment_method=self.method, recorded_by=self.clerk, status=status,
+        )
+
+    def balances(self):
+        return [
+            StudentLedger.objects.values_list('payments_made', 'outstanding_balance').get(pk=ledger.pk)
+            for ledger in self.ledgers
+        ]
+
+    def test_verify_credits_ledgers_and_issues_missing_receipts(self):
+        first, second, _ = self.ledgers
+        self.pay(first, '30.00')
+        self.pay(first, '200.00', currency='ZAR')
+        receipted = self.pay(second, '25.00')
+        Receipt.objects.create(
+            payment=receipted, amount_paid=Decimal('25.00'), previous_balance=Decimal('100.00'),
+            new_balance=Decimal('75.00'), generated_by=self.clerk,
+        )
+        already = self.pay(second, '5.00', status='verified')
+
+        self.assertEqual(verify_payments(Payment.objects.all(), self.clerk), 3)
+        self.assertEqual(self.balances()[:2], [
+            (Decimal('40.00'), Decimal('60.00')), (Decimal('25.00'), Decimal('75.00')),
+        ])
+        self.assertFalse(Receipt.objects.filter(payment=already).exists())
+        self.assertEqual(Receipt.objects.filter(payment=receipted).count(), 1)
+        self.assertEqual(
+            list(Receipt.objects.filter(payment__ledger=first).order_by('payment__payment_date').values_list(
+                'previous_balance', 'new_balance'
+            )),
+            [(Decimal('100.00'), Decimal('70.00')), (Decimal('70.00'), Decimal('60.00'))],
+        )
+        self.assertEqual(AuditLog.objects.filter(action_type='payment_verified').count(), 3)
+        self.assertEqual(Payment.objects.filter(status='verified', verified_by=self.clerk).count(), 3)
+        # The stored 5.00 was never credited; everything verified here was
+        self.assertEqual(
+            [(ledger_id, field) for ledger_id, field, *_ in verify_ledgers() if field == 'payments_made'],
+            [(second.id, 'payments_made')],
+        )
+
+    def test_reject_reverses_verified_payments(self):
+        first = self.ledgers[0]
+        verified = self.pay(first, '30.00')
+        self.pay(first, '10.00')
+        verify_payments(Payment.objects.filter(pk=verified.pk), self.clerk)
+
+        self.assertEqual(reject_payments(Payment.objects.all(), self.clerk), 2)
+        self.assertEqual(self.balances()[0], (Decimal('0.00'), Decimal('100.00')))
+        self.assertEqual(AuditLog.objects.filter(action_type='payment_rejected').count(), 2)
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+        self.assertEqual(reject_payments(Payment.objects.all(), self.clerk), 0)
+
+    def test_refunds_debit_the_current_term_ledger(self):
+        first, second, _ = self.ledgers
+        verify_payments(Payment.objects.filter(pk__in=[self.pay(first, '60.00').pk, self.pay(second, '50.00').pk]), self.clerk)
+        for ledger in (first, second):
+            Refund.objects.create(
+                student=ledger.student, amount=Decimal('20.00'), reason='Overpaid',
+                refund_method=self.method, requested_by=self.clerk,
+            )
+
+        self.assertEqual(approve_refunds(Refund.objects.all(), self.clerk), 2)
+        self.assertEqual(set(Refund.objects.values_list('ledger_id', 'status')), {(first.id, 'approved'), (second.id, 'approved')})
+        self.assertEqual(self.balances()[:2], [
+            (Decimal('40.00'), Decimal('60.00')), (Decimal('30.00'), Decimal('70.00')),
+        ])
+        self.assertEqual(verify_ledgers(), [])
+        summary = get_term_summaries(self.year, self.term)[0]
+        self.assertEqual((summary.total_collected, summary.total_outstanding), (Decimal('70.00'), Decimal('230.00')))
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+
+        self.assertEqual(reject_refunds(Refund.objects.filter(ledger=first), self.clerk), 1)
+        self.assertEqual(self.balances()[0], (Decimal('60.00'), Decimal('40.00')))
+        self.assertEqual(verify_ledgers(), [])
+        summary.refresh_from_db()
+        self.assertEqual(summary.total_collected, Decimal('90.00'))
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+        self.assertEqual(AuditLog.objects.filter(action_type__in=('refund_approved', 'refund_rejected')).count(), 3)
+
+    def test_queries_do_not_grow_with_payments(self):
+        for ledger in self.ledgers:
+            self.pay(ledger, '10.00')
+        get_rate_table()
+        ReceiptSequence.objects.create(year=timezone.now().year)
+        # Savepoint, locked select, status update, fee structures, ledger currencies,
+        # balances, ledger update, summary update, receipt numbers (savepoint,
+        # update, release), receipts, audit rows, plan allocation (savepoint,
+        # installments, release), release
+        with self.assertNumQueries(18):
+            verify_payments(Payment.objects.all(), self.clerk)
+        for ledger in self.ledgers:
+            for _ in range(20):
+                self.pay(ledger, '1.00')
+        with self.assertNumQueries(18):
+            verify_payments(Payment.objects.all(), self.clerk)
+        self.assertEqual(self.balances()[0], (Decimal('30.00'), Decimal('70.00')))
+        self.assertEqual(verify_ledgers(), [])
+        self.assertEqual(rebuild_summaries(self.year.id, self.term.id, dry_run=True), [])
+
+    def test_admin_actions_use_the_bulk_services(self):
+        admin_user = User.objects.create_superuser(username='admin@school.com', email='admin@school.com', password='x')
+        self.client.force_login(admin_user)
+        payment = self.pay(self.ledgers[0], '45.00')
+        response = self.client.post(
+            reverse('admin:fees_payment_changelist'),
+            {'action': 'verify_payments', '_selected_action': [payment.pk]},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.balances()[0], (Decimal('45.00'), Decimal('55.00')))
+        self.assertTrue(Receipt.objects.filter(payment=payment).exists())
@@ -10,6 +10,9 @@ urlpatterns = [
     path('admin/student/<int:student_id>/ledger/', views.student_ledger, name='student_ledger'),
     path('admin/arrears/', views.arrears_list, name='arrears_list'),
     path('admin/payment-history/', views.payment_history, name='payment_history'),
+    path('admin/export/payments/', views.export_payments, name='export_payments'),
+    path('admin/export/ledgers/', views.export_ledgers, name='export_ledgers'),
+    path('admin/export/arrears/', views.export_arrears, name='export_arrears'),
 
     # Student/Parent URLs
     path('student/dashboard/', views.student_fee_dashboard, name='student_fee_dashboard'),
@@ -19,4 +22,5 @@ urlpatterns = [
 
     # API URLs
     path('api/student/<int:student_id>/fee-info/', views.get_student_fee_info, name='student_fee_info'),
+    path('api/students/fee-info/', views.get_student_fee_info_batch, name='student_fee_info_batch'),
 ]
\ No newline at end of file
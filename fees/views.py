@@ -1,19 +1,32 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db import transaction
 from django.db.models import Sum, Count, Q
 from django.utils import timezone
 from django.http import JsonResponse, HttpResponse
 from django.template.loader import get_template
-from django.core.paginator import Paginator
-from decimal import Decimal
+from django.utils.cache import get_conditional_response
+from decimal import Decimal, InvalidOperation
 import json
 
 from .models import (
     FeeStructure, StudentLedger, Payment, Receipt, FeeReminder,
-    AcademicYear, Term, PaymentMethod, Discount, PaymentPlan,
-    Refund, AuditLog, AgentPayment
+    PaymentMethod, Discount, PaymentPlan,
+    Refund, AgentPayment, CURRENCY_CHOICES
 )
+from .audit import audit
+from .exchange import ExchangeRateError, convert, reporting_currency
+from .exports import LEDGER_COLUMNS, PAYMENT_COLUMNS, export_response
+from .fee_info import MAX_BATCH_SIZE, fee_info_etag, parse_student_keys, student_fee_info
+from .filters import (
+    ARREARS_FILTERS, PAYMENT_FILTERS, filter_arrears, filter_payments,
+    filter_querystring, payment_totals
+)
+from .pagination import KeysetPaginator
+from .payment_plans import allocate_payments, installment_schedule
+from .receipts import ensure_receipt_pdf, receipt_pdf_response, schedule_receipt_pdf
+from .summary import get_term_summaries, reporting_totals
 from students.models import Student
 from accounts.models import User
 
@@ -23,46 +36,31 @@ from accounts.models import User
 def fee_management_dashboard(request):
     """Main fee management dashboard for admins"""
     if not request.user.is_staff:
-        return redirect('student_fee_dashboard')
+        return redirect('fees:student_fee_dashboard')
 
     # Get current academic year and term
-    current_year = AcademicYear.objects.filter(is_current=True).first()
-    current_term = Term.objects.filter(is_current=True).first()
-
-    # Financial overview
-    total_expected = StudentLedger.objects.filter(
-        academic_year=current_year,
-        term=current_term
-    ).aggregate(total=Sum('total_required'))['total'] or 0
-
-    total_collected = Payment.objects.filter(
-        ledger__academic_year=current_year,
-        ledger__term=current_term,
-        status='verified'
-    ).aggregate(total=Sum('amount'))['total'] or 0
+    current_year, current_term = request.current_year, request.current_term
 
-    total_outstanding = total_expected - total_collected
+    # Financial overview, maintained incrementally by fee writes per fee
+    # currency and converted into the reporting currency at today's rate
+    summaries = get_term_summaries(current_year, current_term)
+    try:
+        totals = reporting_totals(summaries)
+    except ExchangeRateError as e:
+        messages.warning(request, f'Only fees set in {reporting_currency()} are shown: {e}')
+        totals = reporting_totals([summary for summary in summaries if summary.currency == reporting_currency()])
+    total_expected = totals['total_expected']
+    total_collected = totals['total_collected']
+    total_outstanding = totals['total_outstanding']
+    todays_collections = totals['todays_collections']
+    total_students = totals['ledger_count']
+    fully_paid_students = totals['fully_paid_count']
 
     # Calculate collection rate
     collection_rate = 0
     if total_expected > 0:
         collection_rate = (total_collected / total_expected) * 100
 
-    # Today's collections
-    today = timezone.now().date()
-    todays_collections = Payment.objects.filter(
-        payment_date__date=today,
-        status='verified'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-
-    # Student payment status
-    total_students = Student.objects.count()
-    fully_paid_students = StudentLedger.objects.filter(
-        academic_year=current_year,
-        term=current_term,
-        outstanding_balance__lte=0
-    ).count()
-
     # Recent payments
     recent_payments = Payment.objects.select_related(
         'student__user', 'recorded_by', 'payment_method'
@@ -85,6 +83,7 @@ def fee_management_dashboard(request):
         'fee_structures': fee_structures,
         'current_year': current_year,
         'current_term': current_term,
+        'reporting_currency': reporting_currency(),
     }
 
     return render(request, 'admin/fee_management.html', context)
@@ -93,67 +92,82 @@ def fee_management_dashboard(request):
 def record_payment(request):
     """Record a new payment"""
     if not request.user.is_staff:
-        return redirect('student_fee_dashboard')
+        return redirect('fees:student_fee_dashboard')
 
     if request.method == 'POST':
         student_id = request.POST.get('student')
         amount = Decimal(request.POST.get('amount'))
+        currency = request.POST.get('currency') or reporting_currency()
         payment_method_id = request.POST.get('payment_method')
         reference = request.POST.get('reference', '')
         notes = request.POST.get('notes', '')
 
+        currencies = [code for code, _ in CURRENCY_CHOICES]
+        if currency not in currencies:
+            messages.error(request, f"Unknown currency {currency}; payments can be recorded in {', '.join(currencies)}.")
+            return redirect('fees:record_payment')
+
         try:
             student = Student.objects.get(id=student_id)
             payment_method = PaymentMethod.objects.get(id=payment_method_id)
 
-            # Get or create current ledger
-            current_year = AcademicYear.objects.filter(is_current=True).first()
-            current_term = Term.objects.filter(is_current=True).first()
-
-            ledger, created = StudentLedger.objects.get_or_create(
-                student=student,
-                academic_year=current_year,
-                term=current_term,
-                defaults={'term_fees': 0, 'payments_made': 0}
-            )
-
-            # Create payment
-            payment = Payment.objects.create(
-                student=student,
-                ledger=ledger,
-                amount=amount,
-                payment_method=payment_method,
-                reference_number=reference,
-                recorded_by=request.user,
-                notes=notes,
-                status='verified'  # Auto-verify for admin recorded payments
-            )
-
-            # Update ledger
-            ledger.payments_made += amount
-            ledger.last_payment_date = timezone.now()
-            ledger.update_balances()
-
-            # Create receipt
-            Receipt.objects.create(
-                payment=payment,
-                amount_paid=amount,
-                previous_balance=ledger.outstanding_balance + amount,
-                new_balance=ledger.outstanding_balance,
-                generated_by=request.user
-            )
-
-            # Log audit
-            AuditLog.objects.create(
-                user=request.user,
-                action_type='payment_recorded',
-                description=f"Payment of ${amount} recorded for {student}",
-                student=student,
-                amount=amount
-            )
+            with transaction.atomic():
+                # Get or create current ledger
+                current_year, current_term = request.current_year, request.current_term
+
+                ledger, created = StudentLedger.objects.get_or_create(
+                    student=student,
+                    academic_year=current_year,
+                    term=current_term,
+                    defaults={'term_fees': 0, 'payments_made': 0}
+                )
+
+                # The ledger is kept in the currency its fees were set in
+                ledger_currency = FeeStructure.objects.filter(
+                    academic_year=current_year, term=current_term, grade=student.grade_id, is_day_scholar=True
+                ).values_list('currency', flat=True).first() or reporting_currency()
+                credited = convert(amount, currency, ledger_currency)
+
+                # Create payment
+                payment = Payment.objects.create(
+                    student=student,
+                    ledger=ledger,
+                    amount=amount,
+                    currency=currency,
+                    payment_method=payment_method,
+                    reference_number=reference,
+                    recorded_by=request.user,
+                    notes=notes,
+                    status='verified'  # Auto-verify for admin recorded payments
+                )
+
+                # Update ledger
+                ledger.payments_made += credited
+                ledger.last_payment_date = payment.payment_date
+                ledger.update_balances()
+                allocate_payments([payment], credited=[credited])
+
+                # Create receipt, pre-rendering its PDF once committed
+                receipt = Receipt.objects.create(
+                    payment=payment,
+                    amount_paid=amount,
+                    previous_balance=ledger.outstanding_balance + credited,
+                    new_balance=ledger.outstanding_balance,
+                    generated_by=request.user
+                )
+                transaction.on_commit(lambda: schedule_receipt_pdf(receipt.id))
+
+                # Log audit, written with the request's other entries on commit
+                audit(
+                    user=request.user,
+                    action_type='payment_recorded',
+                    description=f"Payment of {currency} {amount} recorded for {student}",
+                    student=student,
+                    amount=amount
+                )
 
             messages.success(request, f'Payment recorded successfully. Receipt: {payment.receipt.receipt_number}')
-            return redirect('fee_management_dashboard')
+            return redirect('fees:fee_management_dashboard')
 
         except Exception as e:
             messages.error(request, f'Error recording payment: {str(e)}')
@@ -165,6 +179,8 @@ def record_payment(request):
     context = {
         'students': students,
         'payment_methods': payment_methods,
+        'currencies': [code for code, _ in CURRENCY_CHOICES],
+        'reporting_currency': reporting_currency(),
     }
 
     return render(request, 'admin/record_payment.html', context)
@@ -173,13 +189,12 @@ def record_payment(request):
 def student_ledger(request, student_id):
     """View detailed student ledger"""
     if not request.user.is_staff:
-        return redirect('student_fee_dashboard')
+        return redirect('fees:student_fee_dashboard')
 
     student = get_object_or_404(Student, id=student_id)
 
     # Get current ledger
-    current_year = AcademicYear.objects.filter(is_current=True).first()
-    current_term = Term.objects.filter(is_current=True).first()
+    current_year, current_term = request.current_year, request.current_term
 
     ledger = StudentLedger.objects.filter(
         student=student,
@@ -206,31 +221,21 @@ def student_ledger(request, student_id):
 def arrears_list(request):
     """List of students with outstanding fees"""
     if not request.user.is_staff:
-        return redirect('student_fee_dashboard')
+        return redirect('fees:student_fee_dashboard')
 
-    current_year = AcademicYear.objects.filter(is_current=True).first()
-    current_term = Term.objects.filter(is_current=True).first()
+    current_year, current_term = request.current_year, request.current_term
 
-    # Filter parameters
-    grade_filter = request.GET.get('grade')
-    min_amount = request.GET.get('min_amount', 0)
+    ledgers = filter_arrears(request.GET, current_year, current_term).select_related(
+        'student__user', 'student__grade'
+    )
 
-    ledgers = StudentLedger.objects.filter(
-        academic_year=current_year,
-        term=current_term,
-        outstanding_balance__gt=min_amount
-    ).select_related('student__user', 'student__grade')
-
-    if grade_filter:
-        ledgers = ledgers.filter(student__grade_id=grade_filter)
-
-    # Pagination
-    paginator = Paginator(ledgers, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination, largest balances first
+    paginator = KeysetPaginator(ledgers, ('-outstanding_balance', '-id'), 25)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     context = {
         'page_obj': page_obj,
+        'filter_query': filter_querystring(request.GET, ARREARS_FILTERS),
         'current_year': current_year,
         'current_term': current_term,
     }
@@ -241,38 +246,28 @@ def arrears_list(request):
 def payment_history(request):
     """Complete payment history"""
     if not request.user.is_staff:
-        return redirect('student_fee_dashboard')
-
-    # Filters
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    payment_method = request.GET.get('payment_method')
-    recorded_by = request.GET.get('recorded_by')
+        return redirect('fees:student_fee_dashboard')
 
-    payments = Payment.objects.select_related(
+    payments = filter_payments(request.GET).select_related(
         'student__user', 'payment_method', 'recorded_by'
-    ).order_by('-payment_date')
-
-    if start_date:
-        payments = payments.filter(payment_date__date__gte=start_date)
-    if end_date:
-        payments = payments.filter(payment_date__date__lte=end_date)
-    if payment_method:
-        payments = payments.filter(payment_method_id=payment_method)
-    if recorded_by:
-        payments = payments.filter(recorded_by_id=recorded_by)
-
-    # Pagination
-    paginator = Paginator(payments, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
-    # Summary stats
-    total_amount = payments.aggregate(total=Sum('amount'))['total'] or 0
-    payment_count = payments.count()
+    )
+
+    # Keyset pagination, newest first
+    paginator = KeysetPaginator(payments, ('-payment_date', '-id'), 50)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
+    # Summary stats, cached per filter set
+    try:
+        totals = payment_totals(request.GET)
+    except ExchangeRateError as e:
+        messages.warning(request, f'Total not available: {e}')
+        totals = {'total_amount': None, 'payment_count': payments.count()}
+    total_amount = totals['total_amount']
+    payment_count = totals['payment_count']
 
     context = {
         'page_obj': page_obj,
+        'filter_query': filter_querystring(request.GET, PAYMENT_FILTERS),
         'total_amount': total_amount,
         'payment_count': payment_count,
         'payment_methods': PaymentMethod.objects.filter(is_active=True),
@@ -281,6 +276,40 @@ def payment_history(request):
 
     return render(request, 'admin/payment_history.html', context)
 
+@login_required
+def export_payments(request):
+    """Stream the payment_history filter set as CSV or XLSX"""
+    if not request.user.is_staff:
+        return redirect('fees:student_fee_dashboard')
+
+    payments = filter_payments(request.GET).order_by('-payment_date', '-id')
+    return export_response(payments, PAYMENT_COLUMNS, 'payments', request.GET.get('format', 'csv'))
+
+@login_required
+def export_ledgers(request):
+    """Stream the current term's ledgers as CSV or XLSX"""
+    if not request.user.is_staff:
+        return redirect('fees:student_fee_dashboard')
+
+    current_year, current_term = request.current_year, request.current_term
+
+    ledgers = StudentLedger.objects.filter(academic_year=current_year, term=current_term)
+    if request.GET.get('grade', '').isdigit():
+        ledgers = ledgers.filter(student__grade_id=request.GET['grade'])
+    ledgers = ledgers.order_by('student__grade__name', 'student__user__last_name', 'id')
+    return export_response(ledgers, LEDGER_COLUMNS, 'ledgers', request.GET.get('format', 'csv'))
+
+@login_required
+def export_arrears(request):
+    """Stream the arrears_list filter set as CSV or XLSX"""
+    if not request.user.is_staff:
+        return redirect('fees:student_fee_dashboard')
+
+    current_year, current_term = request.current_year, request.current_term
+
+    ledgers = filter_arrears(request.GET, current_year, current_term).order_by('-outstanding_balance', '-id')
+    return export_response(ledgers, LEDGER_COLUMNS, 'arrears', request.GET.get('format', 'csv'))
+
 # Student/Parent Views
 
 @login_required
@@ -293,8 +322,7 @@ def student_fee_dashboard(request):
         return redirect('dashboard')
 
     # Get current ledger
-    current_year = AcademicYear.objects.filter(is_current=True).first()
-    current_term = Term.objects.filter(is_current=True).first()
+    current_year, current_term = request.current_year, request.current_term
 
     ledger = StudentLedger.objects.filter(
         student=student,
@@ -363,17 +391,10 @@ def download_receipt(request, receipt_id):
         messages.error(request, 'Student profile not found.')
         return redirect('dashboard')
 
-    # In a real implementation, you'd generate a PDF here
-    # For now, just return the receipt data as JSON
-    data = {
-        'receipt_number': receipt.receipt_number,
-        'student': str(receipt.payment.student),
-        'amount': str(receipt.amount_paid),
-        'date': receipt.generated_at.strftime('%Y-%m-%d'),
-        'method': receipt.payment.payment_method.name,
-    }
-
-    return JsonResponse(data)
+    # Rendered once and kept in storage; normally already done in the
+    # background when the payment was recorded
+    ensure_receipt_pdf(receipt)
+    return receipt_pdf_response(request, receipt)
 
 @login_required
 def request_payment_plan(request):
@@ -385,22 +406,34 @@ def request_payment_plan(request):
         return redirect('dashboard')
 
     if request.method == 'POST':
-        total_amount = Decimal(request.POST.get('total_amount'))
-        installments = int(request.POST.get('installments'))
-
-        # Create payment plan request
+        try:
+            total_amount = Decimal(request.POST.get('total_amount', '')).quantize(Decimal('0.01'))
+            installments = int(request.POST.get('installments', ''))
+        except (InvalidOperation, ValueError):
+            total_amount, installments = Decimal('0'), 0
+        if total_amount <= 0 or installments < 1:
+            messages.error(request, 'Enter an amount and the number of installments.')
+            return render(request, 'student/request_payment_plan.html')
+
+        # Create payment plan request; the installments are scheduled on approval
+        start_date = timezone.localdate()
+        schedule = installment_schedule(total_amount, installments, start_date)
         PaymentPlan.objects.create(
             student=student,
+            ledger=StudentLedger.objects.filter(
+                student=student, academic_year=request.current_year, term=request.current_term
+            ).first(),
             total_amount=total_amount,
             number_of_installments=installments,
-            installment_amount=total_amount / installments,
-            start_date=timezone.now().date(),
-            status='pending',  # Would need admin approval
+            installment_amount=schedule[0][1],
+            start_date=start_date,
+            end_date=schedule[-1][0],
+            status='pending',
             created_by=request.user
         )
 
         messages.success(request, 'Payment plan request submitted. Awaiting approval.')
-        return redirect('student_fee_dashboard')
+        return redirect('fees:student_fee_dashboard')
 
     return render(request, 'student/request_payment_plan.html')
 
@@ -411,9 +444,8 @@ def get_student_fee_info(request, student_id):
     if not request.user.is_staff:
         return JsonResponse({'error': 'Unauthorized'}, status=403)
 
-    student = get_object_or_404(Student, id=student_id)
-    current_year = AcademicYear.objects.filter(is_current=True).first()
-    current_term = Term.objects.filter(is_current=True).first()
+    student = get_object_or_404(Student.objects.select_related('user', 'grade'), id=student_id)
+    current_year, current_term = request.current_year, request.current_term
 
     ledger = StudentLedger.objects.filter(
         student=student,
@@ -431,3 +463,30 @@ def get_student_fee_info(request, student_id):
     }
 
     return JsonResponse(data)
+
+def get_student_fee_info_batch(request):
+    """API endpoint for many students' fee information, with ETag revalidation"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
+
+    ids, admission_numbers = parse_student_keys(request.GET)
+    if not ids and not admission_numbers:
+        return JsonResponse({'error': 'Pass ids and/or admission_numbers.'}, status=400)
+    if len(ids) + len(admission_numbers) > MAX_BATCH_SIZE:
+        return JsonResponse({'error': f'At most {MAX_BATCH_SIZE} students per request.'}, status=400)
+
+    current_year, current_term = request.current_year, request.current_term
+    etag = fee_info_etag(ids, admission_numbers, current_year, current_term)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        students = student_fee_info(ids, admission_numbers, current_year, current_term)
+        found = {student['student_id'] for student in students} | {student['admission_number'] for student in students}
+        response = JsonResponse({
+            'academic_year': str(current_year) if current_year else None,
+            'term': current_term.name if current_term else None,
+            'students': students,
+            'not_found': sorted(str(key) for key in ids | admission_numbers if key not in found),
+        })
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -50,11 +50,17 @@ AUTH_USER_MODEL = 'accounts.User'
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',   # <-- ADD THIS
+    # Compress pages on the way out; ConditionalGet sits inside it so ETags
+    # are computed on (and 304s returned for) the uncompressed page
+    'django.middleware.gzip.GZipMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
 
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'fees.middleware.CurrentTermMiddleware',
+    'fees.middleware.AuditMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -86,6 +92,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # File-backed test database so concurrency tests can share it
+        # between threads and worker processes
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -141,3 +152,63 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGOUT_REDIRECT_URL = '/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Receipt numbering (see fees/sequences.py). Gap-free numbering takes one
+# number per receipt inside the payment transaction; set GAP_FREE to False
+# to let each worker reserve blocks of BLOCK_SIZE numbers instead.
+RECEIPT_NUMBERS_GAP_FREE = True
+RECEIPT_NUMBER_BLOCK_SIZE = 1
+
+# Current academic year/term cache (see fees/current.py). Set
+# CURRENT_PERIOD_CACHE to a shared cache alias when running several
+# worker processes so a change in one is seen by all.
+CURRENT_PERIOD_CACHE = None
+CURRENT_PERIOD_TTL = 300
+
+# Exchange rates (see fees/exchange.py). Dashboards and reports convert
+# payments into REPORTING_CURRENCY at the rate on each payment's date.
+# EXCHANGE_RATE_CACHE works like CURRENT_PERIOD_CACHE.
+REPORTING_CURRENCY = 'USD'
+EXCHANGE_RATE_CACHE = None
+EXCHANGE_RATE_TTL = 3600
+
+# Fee reminders (see fees/reminders.py). Delivery is done by the
+# send_fee_reminders worker; rates are messages per second per channel.
+SMS_BACKEND = 'fees.sms.ConsoleBackend'
+SMS_GATEWAY_URL = ''
+REMINDER_EMAIL_RATE = 10
+REMINDER_SMS_RATE = 5
+REMINDER_MAX_ATTEMPTS = 5
+REMINDER_RETRY_DELAY = 60
+
+# Payment plans (see fees/payment_plans.py): days after an installment's due
+# date before the daily scan marks it overdue and defaults its plan.
+PAYMENT_PLAN_GRACE_DAYS = 3
+
+# Audit log (see fees/audit.py). Trust X-Forwarded-For for the client IP
+# only behind a proxy that sets it; months older than AUDIT_LOG_LIVE_MONTHS
+# are moved to monthly archive tables by the archive_audit_log command.
+AUDIT_TRUST_X_FORWARDED_FOR = False
+AUDIT_LOG_LIVE_MONTHS = 12
+
+# Caches. 'default' is per process; 'shared' keeps its entries in files so
+# every worker process on the host sees the same ones (the SQLite database
+# already keeps the app to a single host). Point it at Redis or Memcached
+# if that changes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+}
+
+# Dashboard fragment cache (see accounts/dashboard_cache.py). Fragments are
+# keyed by per-model version counters kept in DASHBOARD_CACHE, which must be
+# shared by all worker processes or one would serve fragments another has
+# retired.
+DASHBOARD_CACHE = 'shared'
+DASHBOARD_CACHE_TIMEOUT = 3600
@@ -1,4 +1,52 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from .enrollment import EnrollmentImportError, import_enrollments
+from .forms import EnrollmentImportForm
 from .models import Student
 
-admin.site.register(Student)
+
+@admin.register(Student)
+class StudentAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'grade', 'class_room', 'guardian_phone')
+    list_filter = ('grade', 'class_room')
+    search_fields = ('user__first_name', 'user__last_name', 'user__email')
+    list_select_related = ('user', 'grade', 'class_room')
+    change_list_template = 'admin/students/student/change_list.html'
+
+    def get_urls(self):
+        urls = [
+            path('import-enrollments/', self.admin_site.admin_view(self.import_enrollments_view), name='students_student_import_enrollments'),
+        ]
+        return urls + super().get_urls()
+
+    def import_enrollments_view(self, request):
+        """Upload a CSV/XLSX class list and enroll it in bulk"""
+        if not self.has_add_permission(request):
+            return redirect('admin:students_student_changelist')
+
+        result = None
+        if request.method == 'POST':
+            form = EnrollmentImportForm(request.POST, request.FILES)
+            if form.is_valid():
+                class_list = form.cleaned_data['class_list']
+                try:
+                    result = import_enrollments(class_list.file, class_list.name, dry_run=form.cleaned_data['dry_run'])
+                except (EnrollmentImportError, UnicodeDecodeError) as e:
+                    messages.error(request, f'Could not import class list: {e}')
+                else:
+                    level = messages.WARNING if result.errors else messages.SUCCESS
+                    messages.add_message(request, level, str(result))
+        else:
+            form = EnrollmentImportForm()
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import enrollments',
+            'form': form,
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/students/student/import_enrollments.html', context)
@@ -0,0 +1,271 @@
+"""
+Bulk student enrollment from a CSV or XLSX class list.
+
+Every row is validated before anything is written: required columns, email
+format, duplicates within the file, emails already registered (one query),
+grade and class names (one query each) and the password validators. The
+valid rows' passwords are then hashed in a pool of forked processes, one
+per core by default. Hashing dominates the cost of create_user(), so
+spreading it across cores is what turns minutes into seconds. Finally User
+and Student rows go in with bulk_create, one transaction per chunk, and
+the new students are added to their teachers' rosters.
+"""
+import csv
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from accounts.dashboard_cache import bump_versions
+from accounts.models import User
+from classes.models import ClassRoom, Grade
+from classes.roster import sync_roster
+
+from .models import Student
+from .search import search_columns
+
+try:
+    import openpyxl
+except ImportError:  # XLSX class lists need openpyxl
+    openpyxl = None
+
+# Accepted header spellings for each class list column
+COLUMN_ALIASES = {
+    'first_name': ('first_name', 'firstname', 'first', 'given_name'),
+    'last_name': ('last_name', 'lastname', 'surname', 'family_name'),
+    'email': ('email', 'email_address', 'username'),
+    'password': ('password', 'initial_password'),
+    'grade': ('grade', 'grade_name'),
+    'class_room': ('class_room', 'class', 'classroom', 'class_name'),
+    'guardian_phone': ('guardian_phone', 'guardian_mobile', 'parent_phone', 'phone'),
+}
+REQUIRED_COLUMNS = ('first_name', 'last_name', 'email', 'password', 'grade')
+DEFAULT_CHUNK_SIZE = 500
+# Fewer rows than this are hashed in process; forking would cost more
+PARALLEL_THRESHOLD = 8
+
+
+class EnrollmentImportError(Exception):
+    """Raised when a class list cannot be imported at all"""
+
+
+class EnrollmentResult:
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.rows_read = 0
+        self.enrolled = 0
+        self.errors = []  # (line number, message)
+
+    def add_error(self, line, message):
+        self.errors.append((line, message))
+
+    def __str__(self):
+        verb = 'Would enroll' if self.dry_run else 'Enrolled'
+        return f'{verb} {self.enrolled} of {self.rows_read} students; {len(self.errors)} error(s)'
+
+
+# Reading
+
+def _resolve_columns(fieldnames):
+    headers = {str(name).strip().lower().replace(' ', '_'): name for name in fieldnames or [] if name is not None}
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in headers:
+                columns[column] = headers[alias]
+                break
+    missing = set(REQUIRED_COLUMNS) - set(columns)
+    if missing:
+        raise EnrollmentImportError(f"Class list is missing column(s): {', '.join(sorted(missing))}")
+    return columns
+
+
+def _csv_rows(class_list):
+    reader = csv.DictReader(class_list)
+    # Header is line 1
+    return reader.fieldnames, ((index + 2, row) for index, row in enumerate(reader))
+
+
+def _xlsx_rows(class_list):
+    if openpyxl is None:
+        raise EnrollmentImportError('XLSX class lists need openpyxl installed; upload a CSV instead.')
+    try:
+        workbook = openpyxl.load_workbook(class_list, read_only=True, data_only=True)
+    except Exception as e:
+        raise EnrollmentImportError(f'Could not read workbook: {e}')
+    rows = workbook.active.iter_rows(values_only=True)
+    header = next(rows, None) or ()
+
+    def cells():
+        for line, values in enumerate(rows, start=2):
+            if any(value not in (None, '') for value in values):
+                yield line, {name: '' if value is None else str(value) for name, value in zip(header, values)}
+    return header, cells()
+
+
+def read_class_list(class_list, filename=''):
+    """
+    (fieldnames, (line, row dict) iterator) for a class list opened in binary
+    mode: XLSX if the file name says so, otherwise UTF-8 CSV
+    """
+    if filename.lower().endswith('.xlsx'):
+        return _xlsx_rows(class_list)
+    return _csv_rows(io.TextIOWrapper(class_list, encoding='utf-8-sig', newline=''))
+
+
+# Validation
+
+def _cell(row, columns, column):
+    return (row.get(columns[column]) or '').strip() if column in columns else ''
+
+
+def _parse_rows(rows, columns, result):
+    """Check each row on its own and against the rest of the file; returns clean row dicts"""
+    parsed = []
+    seen_emails = set()
+    for line, row in rows:
+        result.rows_read += 1
+        values = {column: _cell(row, columns, column) for column in COLUMN_ALIASES}
+        missing = [column for column in REQUIRED_COLUMNS if not values[column]]
+        if missing:
+            result.add_error(line, f"missing {', '.join(missing).replace('_', ' ')}")
+            continue
+        email = User.objects.normalize_email(values['email'])
+        try:
+            validate_email(email)
+        except ValidationError:
+            result.add_error(line, f'invalid email "{email}"')
+            continue
+        if email.lower() in seen_emails:
+            result.add_error(line, f'duplicate email "{email}" in class list')
+            continue
+        seen_emails.add(email.lower())
+        parsed.append({'line': line, **values, 'email': email})
+    return parsed
+
+
+def _drop_registered(rows, result):
+    """Skip rows whose email is already a login, so re-imports are safe"""
+    emails = {row['email'].lower() for row in rows}
+    taken = set()
+    if emails:
+        for email, username in User.objects.annotate(email_lower=Lower('email'), username_lower=Lower('username')).filter(
+            Q(email_lower__in=emails) | Q(username_lower__in=emails)
+        ).values_list('email_lower', 'username_lower'):
+            taken.update((email, username))
+    fresh = []
+    for row in rows:
+        if row['email'].lower() in taken:
+            result.add_error(row['line'], f"{row['email']} is already registered")
+            continue
+        fresh.append(row)
+    return fresh
+
+
+def _match_classes(rows, result):
+    """Attach grades and classes by name (or id) with one query each"""
+    grades = {}
+    for grade in Grade.objects.all():
+        grades[grade.name.lower()] = grade
+        grades[str(grade.id)] = grade
+    classes = {
+        (class_room.grade_id, class_room.name.lower()): class_room
+        for class_room in ClassRoom.objects.all()
+    }
+    matched = []
+    for row in rows:
+        grade = grades.get(row['grade'].lower())
+        if grade is None:
+            result.add_error(row['line'], f"unknown grade \"{row['grade']}\"")
+            continue
+        class_room = None
+        if row['class_room']:
+            class_room = classes.get((grade.id, row['class_room'].lower()))
+            if class_room is None:
+                result.add_error(row['line'], f"{grade} has no class \"{row['class_room']}\"")
+                continue
+        row['grade'], row['class_room'] = grade, class_room
+        matched.append(row)
+    return matched
+
+
+def _check_passwords(rows, result):
+    valid = []
+    for row in rows:
+        user = User(username=row['email'], email=row['email'], first_name=row['first_name'], last_name=row['last_name'])
+        try:
+            validate_password(row['password'], user)
+        except ValidationError as e:
+            result.add_error(row['line'], f"password: {' '.join(e.messages)}")
+            continue
+        valid.append(row)
+    return valid
+
+
+# Hashing
+
+def hash_passwords(passwords, workers=None):
+    """make_password() for each password, spread over `workers` forked processes (default: one per core)"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(passwords) < PARALLEL_THRESHOLD:
+        return [make_password(password) for password in passwords]
+    # Workers inherit the configured settings (and hashers) by forking; they never touch the database
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def _enroll_chunk(rows, hashes):
+    users = User.objects.bulk_create([
+        User(
+            username=User.normalize_username(row['email']),
+            email=row['email'],
+            password=password,
+            first_name=row['first_name'],
+            last_name=row['last_name'],
+            role='student',
+        )
+        for row, password in zip(rows, hashes)
+    ])
+    students = Student.objects.bulk_create([
+        Student(
+            user=user, grade=row['grade'], class_room=row['class_room'], guardian_phone=row['guardian_phone'],
+            **search_columns(user),
+        )
+        for row, user in zip(rows, users)
+    ])
+    # bulk_create skips the post_save signals that put students on teacher
+    # rosters and retire cached dashboard fragments
+    sync_roster(student_ids=[student.id for student in students])
+    bump_versions('accounts.User', 'students.Student')
+
+
+def import_enrollments(class_list, filename='', dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+    """
+    Enroll the students in a class list (a binary file; see read_class_list)
+    and return an EnrollmentResult. Rows with errors are reported and skipped; valid rows
+    are still enrolled.
+    """
+    fieldnames, rows = read_class_list(class_list, filename)
+    columns = _resolve_columns(fieldnames)
+    result = EnrollmentResult(dry_run=dry_run)
+
+    rows = _parse_rows(rows, columns, result)
+    rows = _check_passwords(_match_classes(_drop_registered(rows, result), result), result)
+    result.enrolled = len(rows)
+    result.errors.sort()
+    if dry_run or not rows:
+        return result
+
+    hashes = hash_passwords([row['password'] for row in rows], workers)
+    for start in range(0, len(rows), chunk_size):
+        with transaction.atomic():
+            _enroll_chunk(rows[start:start + chunk_size], hashes[start:start + chunk_size])
+    return result
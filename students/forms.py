@@ -0,0 +1,6 @@
+from django import forms
+
+
+class EnrollmentImportForm(forms.Form):
+    class_list = forms.FileField(help_text='CSV or XLSX with first name, last name, email, password and grade columns')
+    dry_run = forms.BooleanField(required=False, initial=True, help_text='Validate only, enroll nobody')
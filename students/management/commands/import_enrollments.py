@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from students.enrollment import DEFAULT_CHUNK_SIZE, EnrollmentImportError, import_enrollments
+
+
+class Command(BaseCommand):
+    help = 'Enroll students in bulk from a CSV or XLSX class list'
+
+    def add_arguments(self, parser):
+        parser.add_argument('class_list', help='Path to the CSV or XLSX class list')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Students inserted per transaction')
+        parser.add_argument('--workers', type=int, help='Processes hashing passwords (default: one per core)')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and report without enrolling anyone')
+
+    def handle(self, *args, **options):
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        try:
+            with open(options['class_list'], 'rb') as class_list:
+                result = import_enrollments(
+                    class_list, options['class_list'],
+                    dry_run=options['dry_run'],
+                    chunk_size=options['chunk_size'],
+                    workers=options['workers'],
+                )
+        except (OSError, UnicodeDecodeError, EnrollmentImportError) as e:
+            raise CommandError(str(e))
+
+        for line, message in result.errors:
+            self.stdout.write(self.style.WARNING(f'Line {line}: {message}'))
+        style = self.style.WARNING if result.errors else self.style.SUCCESS
+        self.stdout.write(style(str(result)))
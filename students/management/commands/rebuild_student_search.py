@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from students.search import refresh_search_columns
+
+
+class Command(BaseCommand):
+    help = 'Recompute the student directory search columns, e.g. after bulk user changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report stale students without writing')
+
+    def handle(self, *args, **options):
+        stale = refresh_search_columns(dry_run=options['dry_run'])
+
+        if not stale:
+            self.stdout.write(self.style.SUCCESS('Search columns are up to date.'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{stale} student(s) out of date; rerun without --dry-run to repair.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Updated {stale} student(s).'))
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0002_alter_student_class_room'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='guardian_phone',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:03
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def _normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.casefold().split())
+
+
+def fill_search_columns(apps, schema_editor):
+    Student = apps.get_model('students', 'Student')
+    students = list(Student.objects.select_related('user'))
+    for student in students:
+        user = student.user
+        student.sort_name = _normalize(f'{user.last_name} {user.first_name}') or _normalize(user.username)
+        values = dict.fromkeys(_normalize(value) for value in (user.first_name, user.last_name, user.username, user.email))
+        student.search_text = ' '.join(value for value in values if value)
+    Student.objects.bulk_update(students, ['sort_name', 'search_text'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0003_student_guardian_phone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='search_text',
+            field=models.CharField(blank=True, editable=False, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='sort_name',
+            field=models.CharField(blank=True, editable=False, max_length=301),
+        ),
+        migrations.RunPython(fill_search_columns, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['sort_name', 'id'], name='student_sort_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['grade', 'sort_name', 'id'], name='student_grade_sort_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['class_room', 'sort_name', 'id'], name='student_class_sort_name_idx'),
+        ),
+    ]
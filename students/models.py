@@ -6,6 +6,21 @@ class Student(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     grade = models.ForeignKey(Grade, on_delete=models.CASCADE)
     class_room = models.ForeignKey(ClassRoom, on_delete=models.CASCADE, null=True, blank=True)
+    guardian_phone = models.CharField(max_length=20, blank=True)  # For SMS fee reminders
+    # Normalized copies of the user's name and email for the student
+    # directory; kept by students.search
+    sort_name = models.CharField(max_length=301, blank=True, editable=False)
+    search_text = models.CharField(max_length=1000, blank=True, editable=False)
+    # Also moved forward when the user or grade shown with the student
+    # changes (students.search), so it can stamp cached student data
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sort_name', 'id'], name='student_sort_name_idx'),
+            models.Index(fields=['grade', 'sort_name', 'id'], name='student_grade_sort_name_idx'),
+            models.Index(fields=['class_room', 'sort_name', 'id'], name='student_class_sort_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name}"
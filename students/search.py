@@ -0,0 +1,121 @@
+"""
+Student directory search.
+
+Names and emails live on User, so searching and sorting students by them
+would need a join plus case- and accent-insensitive comparisons on every
+row. Instead each Student keeps two precomputed columns: sort_name
+("surname first names", normalized) backs the name ordering through
+composite (grade / class, sort_name, id) indexes, and search_text holds
+the normalized name, admission number (username) and email, so a search
+is a plain contains test on one narrow column of the table the page is
+already scanning in index order.
+
+Signals keep the columns current when a student or their user is saved,
+and move Student.updated_at forward when their user or grade changes.
+Writes that skip signals (queryset.update(), bulk_create) should call
+refresh_search_columns() for what they touched, or run the
+rebuild_student_search command afterwards.
+"""
+import unicodedata
+
+from django.conf import settings
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from classes.models import Grade
+
+from .models import Student
+
+SEARCH_COLUMNS = ('sort_name', 'search_text')
+STUDENT_FILTERS = ('q', 'grade', 'class_room', 'sort')
+
+# Sort parameter: keyset ordering (the last field is unique)
+SORTS = {
+    'name': ('sort_name', 'id'),
+    '-name': ('-sort_name', '-id'),
+    'grade': ('grade', 'sort_name', 'id'),
+    '-grade': ('-grade', '-sort_name', '-id'),
+    'registered': ('id',),
+    '-registered': ('-id',),
+}
+DEFAULT_SORT = 'name'
+
+
+def normalize(text):
+    """Lower-case, accent-free, single-spaced text for matching and sorting"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.casefold().split())
+
+
+def search_columns(user):
+    """{column: value} of the search columns for a student's user"""
+    sort_name = normalize(f'{user.last_name} {user.first_name}') or normalize(user.username)
+    # Usernames are usually the email address; keep each value once
+    values = dict.fromkeys(normalize(value) for value in (user.first_name, user.last_name, user.username, user.email))
+    return {'sort_name': sort_name, 'search_text': ' '.join(value for value in values if value)}
+
+
+def refresh_search_columns(student_ids=None, dry_run=False):
+    """
+    Recompute the search columns of these students (default: all). Returns
+    how many were out of date.
+    """
+    students = Student.objects.select_related('user').only('user', *SEARCH_COLUMNS)
+    if student_ids is not None:
+        students = students.filter(id__in=student_ids)
+    stale = []
+    for student in students.iterator(chunk_size=2000):
+        columns = search_columns(student.user)
+        if any(getattr(student, name) != value for name, value in columns.items()):
+            for name, value in columns.items():
+                setattr(student, name, value)
+            stale.append(student)
+    if not dry_run:
+        Student.objects.bulk_update(stale, SEARCH_COLUMNS, batch_size=1000)
+    return len(stale)
+
+
+# Directory queries
+
+def filter_students(params, queryset=None):
+    """Apply the student directory search and filters in `params` (a QueryDict or dict)"""
+    students = Student.objects.all() if queryset is None else queryset
+    for word in normalize(params.get('q')).split():
+        students = students.filter(search_text__contains=word)
+    if (params.get('grade') or '').isdigit():
+        students = students.filter(grade_id=params['grade'])
+    if (params.get('class_room') or '').isdigit():
+        students = students.filter(class_room_id=params['class_room'])
+    return students
+
+
+def student_ordering(params):
+    """The keyset ordering for the `sort` in `params`, and its name"""
+    sort = params.get('sort') if params.get('sort') in SORTS else DEFAULT_SORT
+    return SORTS[sort], sort
+
+
+# Signals
+
+@receiver(pre_save, sender=Student)
+def _student_saving(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'user', 'user_id', *SEARCH_COLUMNS} & set(update_fields):
+        return
+    for name, value in search_columns(instance.user).items():
+        setattr(instance, name, value)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def _user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # A new user has no student yet, and logging in only touches last_login
+    if created or (update_fields is not None and set(update_fields) <= {'last_login', 'password'}):
+        return
+    Student.objects.filter(user=instance).update(updated_at=timezone.now(), **search_columns(instance))
+
+
+@receiver(post_save, sender=Grade)
+def _grade_saved(sender, instance, created, **kwargs):
+    if not created:
+        Student.objects.filter(grade=instance).update(updated_at=timezone.now())
@@ -0,0 +1,12 @@
+"""Fixtures shared by the apps' tests"""
+from accounts.models import User
+from classes.models import Grade
+
+from .models import Student
+
+
+def make_student(email='pupil@school.com', grade=None, class_room=None, **user_fields):
+    """A student whose user has `email` as username and email; the grade defaults to Grade 1"""
+    grade = grade or Grade.objects.get_or_create(name='Grade 1')[0]
+    user = User.objects.create_user(username=email, email=email, password='x', role='student', **user_fields)
+    return Student.objects.create(user=user, grade=grade, class_room=class_room)
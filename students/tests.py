@@ -1,3 +1,173 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+from unittest import skipUnless
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from classes.models import ClassRoom, Grade
+
+from .enrollment import EnrollmentImportError, hash_passwords, import_enrollments, openpyxl
+from .models import Student
+from .search import filter_students, refresh_search_columns
+from .testing import make_student
+
+HEADER = 'First Name,Surname,Email,Password,Grade,Class,Guardian Phone\n'
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def class_list(*rows):
+    return io.BytesIO((HEADER + ''.join(f'{row}\n' for row in rows)).encode())
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class EnrollmentImportTests(TestCase):
+    def setUp(self):
+        self.grade = Grade.objects.create(name='Grade 3')
+        self.class_room = ClassRoom.objects.create(name='B', grade=self.grade)
+        User.objects.create_user(username='taken@school.com', email='taken@school.com', password='x')
+
+    def test_valid_rows_are_enrolled_and_bad_rows_reported(self):
+        result = import_enrollments(class_list(
+            'Tariro,Moyo,tariro@school.com,Mango-tree-42,Grade 3,B,+263771000001',
+            'Farai,Ncube,farai@school.com,Baobab-tree-42,grade 3,,',
+            'Nyasha,Dube,,Acacia-tree-42,Grade 3,,',
+            'Rudo,Sibanda,not-an-email,Acacia-tree-42,Grade 3,,',
+            'Tariro,Again,TARIRO@school.com,Mango-tree-42,Grade 3,,',
+            'Tendai,Banda,taken@school.com,Acacia-tree-42,Grade 3,,',
+            'Chipo,Phiri,chipo@school.com,Acacia-tree-42,Grade 9,,',
+            'Kuda,Zulu,kuda@school.com,Acacia-tree-42,Grade 3,Z,',
+            'Tino,Mbeki,tino@school.com,12345678,Grade 3,,',
+        ))
+
+        self.assertEqual((result.rows_read, result.enrolled), (9, 2))
+        self.assertEqual([line for line, _ in result.errors], [4, 5, 6, 7, 8, 9, 10])
+        tariro = Student.objects.select_related('user').get(user__email='tariro@school.com')
+        self.assertEqual(
+            (tariro.user.username, tariro.user.role, tariro.grade, tariro.class_room, tariro.guardian_phone),
+            ('tariro@school.com', 'student', self.grade, self.class_room, '+263771000001'),
+        )
+        self.assertTrue(tariro.user.check_password('Mango-tree-42'))
+        self.assertIsNone(Student.objects.get(user__email='farai@school.com').class_room)
+
+    def test_dry_run_enrolls_nobody(self):
+        result = import_enrollments(class_list('Tariro,Moyo,tariro@school.com,Mango-tree-42,Grade 3,B,'), dry_run=True)
+        self.assertEqual(str(result), 'Would enroll 1 of 1 students; 0 error(s)')
+        self.assertFalse(User.objects.filter(email='tariro@school.com').exists())
+
+    def test_missing_columns_are_rejected(self):
+        with self.assertRaises(EnrollmentImportError):
+            import_enrollments(io.BytesIO(b'name,email\nTariro,tariro@school.com\n'))
+
+    def test_queries_do_not_grow_with_rows(self):
+        rows = [f'Pupil,{n},pupil{n}@school.com,Mango-tree-42,Grade 3,B,' for n in range(40)]
+        # Registered emails, grades, classes, then savepoint, users, students,
+        # roster (savepoint, stored, by class, by grade, release), release
+        with self.assertNumQueries(12):
+            result = import_enrollments(class_list(*rows), workers=1)
+        self.assertEqual(result.enrolled, 40)
+        self.assertEqual(Student.objects.filter(class_room=self.class_room).count(), 40)
+
+    def test_passwords_are_hashed_in_worker_processes(self):
+        passwords = [f'Mango-tree-{n}' for n in range(12)]
+        hashes = hash_passwords(passwords, workers=3)
+        # The workers hash with the (overridden) hashers they inherited
+        self.assertTrue(all(encoded.startswith('md5$') for encoded in hashes))
+        self.assertEqual(len(set(hashes)), 12)
+
+        rows = [f'Pupil,{n},pupil{n}@school.com,{password},Grade 3,,' for n, password in enumerate(passwords)]
+        import_enrollments(class_list(*rows), workers=3, chunk_size=5)
+        user = User.objects.get(email='pupil7@school.com')
+        self.assertTrue(user.check_password('Mango-tree-7'))
+
+    def test_command_reports_result(self):
+        with tempfile.NamedTemporaryFile('wb', suffix='.csv', delete=False) as handle:
+            handle.write(class_list('Tariro,Moyo,tariro@school.com,Mango-tree-42,Grade 3,B,').getvalue())
+        self.addCleanup(os.unlink, handle.name)
+        out = io.StringIO()
+        call_command('import_enrollments', handle.name, '--workers', '1', stdout=out)
+        self.assertIn('Enrolled 1 of 1 students', out.getvalue())
+
+    @skipUnless(openpyxl, 'openpyxl is not installed')
+    def test_xlsx_class_list(self):
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['first_name', 'last_name', 'email', 'password', 'grade', 'class'])
+        sheet.append(['Tariro', 'Moyo', 'tariro@school.com', 'Mango-tree-42', 'Grade 3', 'B'])
+        sheet.append([None, None, None, None, None, None])
+        upload = io.BytesIO()
+        workbook.save(upload)
+        upload.seek(0)
+
+        result = import_enrollments(upload, 'class.xlsx')
+        self.assertEqual((result.rows_read, result.enrolled), (1, 1))
+        self.assertTrue(Student.objects.filter(user__email='tariro@school.com', class_room=self.class_room).exists())
+
+
+@override_settings(
+    PASSWORD_HASHERS=FAST_HASHERS,
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class StudentSearchTests(TestCase):
+    def setUp(self):
+        self.grade3, self.grade4 = Grade.objects.create(name='Grade 3'), Grade.objects.create(name='Grade 4')
+        self.class_3b = ClassRoom.objects.create(name='B', grade=self.grade3)
+        self.tinashe = make_student('tinashé.moyo@school.com', self.grade3, self.class_3b, first_name='Tinashé', last_name='Moyo')
+        self.farai = make_student('farai.ncube@school.com', self.grade4, first_name='Farai', last_name='Ncube')
+
+    def search(self, **params):
+        return list(filter_students(params).order_by('sort_name'))
+
+    def test_columns_are_normalized_and_follow_the_user(self):
+        self.assertEqual(self.tinashe.sort_name, 'moyo tinashe')
+        self.assertEqual(self.tinashe.search_text, 'tinashe moyo tinashe.moyo@school.com')
+        self.assertEqual(self.search(q='  TINASHE  moyo'), [self.tinashe])
+        self.assertEqual(self.search(q='tinashe.moyo@'), [self.tinashe])
+
+        user = self.farai.user
+        user.last_name = 'Banda'
+        user.save()
+        self.assertEqual(self.search(q='banda'), [self.farai])
+        self.assertEqual(Student.objects.get(pk=self.farai.pk).sort_name, 'banda farai')
+
+    def test_filters(self):
+        self.assertEqual(self.search(grade=str(self.grade4.id)), [self.farai])
+        self.assertEqual(self.search(class_room=str(self.class_3b.id)), [self.tinashe])
+        self.assertEqual(self.search(q='moyo', grade=str(self.grade4.id)), [])
+        self.assertEqual(self.search(grade='not-a-number'), [self.tinashe, self.farai])
+
+    def test_enrolled_students_are_searchable(self):
+        import_enrollments(class_list('Rudo,Sibanda,rudo@school.com,Mango-tree-42,Grade 3,B,'), workers=1)
+        self.assertEqual(Student.objects.get(user__email='rudo@school.com').search_text, 'rudo sibanda rudo@school.com')
+
+    def test_rebuild_repairs_bulk_changes(self):
+        User.objects.filter(pk=self.farai.user_id).update(first_name='Fadzai')
+        self.assertEqual(refresh_search_columns(dry_run=True), 1)
+        out = io.StringIO()
+        call_command('rebuild_student_search', stdout=out)
+        self.assertIn('Updated 1 student(s)', out.getvalue())
+        self.assertEqual(self.search(q='fadzai'), [self.farai])
+
+    def test_directory_pages_sorts_and_searches(self):
+        for n in range(55):
+            make_student(f'pupil.{n:02}@school.com', self.grade3, first_name='Pupil', last_name=f'{n:02}')
+        admin = User.objects.create_user(username='admin@school.com', email='admin@school.com', password='x', role='admin')
+        self.client.force_login(admin)
+        url = reverse('admin_manage_students')
+
+        first = self.client.get(url, {'grade': self.grade3.id, 'sort': 'name'})
+        names = [student.sort_name for student in first.context['page_obj']]
+        self.assertEqual(names, [f'{n:02} pupil' for n in range(50)])
+        self.assertContains(first, f'grade={self.grade3.id}&amp;sort=name&amp;cursor=')
+
+        rest = self.client.get(url, {'grade': self.grade3.id, 'cursor': first.context['page_obj'].next_cursor})
+        self.assertEqual(len(rest.context['page_obj']), 6)
+        self.assertFalse(rest.context['page_obj'].has_next())
+
+        newest = self.client.get(url, {'sort': '-registered'}).context['page_obj']
+        self.assertEqual(newest.object_list[0].sort_name, '54 pupil')
+        found = self.client.get(url, {'q': 'tinashe'})
+        self.assertEqual(list(found.context['page_obj']), [self.tinashe])